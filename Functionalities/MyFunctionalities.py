@@ -1,61 +1,1046 @@
-class OrderExecutionNewPositions:
+# Add imports if needed
+from ibapi.order_cancel import OrderCancel
 
-    @staticmethod
-    def abc():
-        pass
+import collections
+import datetime
+import math
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from Utilities.MyUtilities import MyUtilities
+from Utilities.MyOrders import MyOrders
+from Utilities.MyQuoteBoard import BID_PRICE, ASK_PRICE, LAST_PRICE, HIGH_PRICE, LOW_PRICE, QUOTE_COLUMNS
+from Utilities.MyLifecycle import (OPEN_POSITION_BRACKET, STOP_UNDERCUT, ENTRY, ADD_AND_REDUCE, SELL_HALF, BREAK_EVEN,
+                                   SELL_ON_CLOSE_SMA, BAD_CLOSE_CHECK, NEGATIVE_CLOSE_CHECK, X_R_PROFITS)
+from Utilities.MyMarketSession import (FIRST_MINUTE_END, FIRST_10_MINUTES_END, PLAN_FREEZE, SELL_ON_CLOSE, BAD_CLOSE,
+                                       CLOSE)
+from Rules.ConstantsAndRules import (MAX_STOCK_SPREAD, SELL_HALF_REVERSAL_RULE, SELL_FULL_REVERSAL_RULE, BAD_CLOSE_RULE,
+                                     MAX_ALLOWED_DAILY_PNL_LOSS, MIN_POSITION_SIZE)
+
+# Events waking rules besides the quote board columns
+SESSION_EVENT = 'session event'  # A boundary of the market session passed (open, sell on close, bad close, ...)
+ORDER_STATUS = 'order status'  # An order of the trading plan was filled
+PLAN_CHANGED = 'plan changed'  # The row was changed by a plan reload or by a rule of another row
+TIMER = 'timer'  # Re-check scheduled by a rule (stop recheck, arming after 2.5 minutes)
+
+ALL_INPUTS = frozenset(range(len(QUOTE_COLUMNS))) | frozenset((SESSION_EVENT, ORDER_STATUS, PLAN_CHANGED, TIMER))
+_EVENTS = frozenset((SESSION_EVENT, ORDER_STATUS, PLAN_CHANGED, TIMER))
+
+# Returned by an action to end the rule pass of the row
+STOP_PASS = 'stop pass'
+
+
+class RuleContext:
+    """
+    Everything the rules need besides the row itself.
+
+    Shared objects and the settings of the day are given once. Account and session state is refreshed by
+    evaluate_rules() before every rule pass. daily_brackets_submitted and all_orders_cancelled are owned by the rules.
+    """
+
+    def __init__(self, engine, positions, clock, quote_board, symbol_index, risk_ledger, scheduler, tick_queue,
+                 batch_evaluator, bar_aggregator, indicator_engine, market_data_subscriptions, old_orderids,
+                 name_of_dailytradingplan, exr_rate, limit_absolute_risk, percent_invested_max, risk_abs_max):
+        self.engine = engine
+        self.positions = positions
+        self.clock = clock
+        self.quote_board = quote_board
+        self.symbol_index = symbol_index
+        self.risk_ledger = risk_ledger
+        self.scheduler = scheduler
+        self.tick_queue = tick_queue
+        self.batch_evaluator = batch_evaluator
+        self.bar_aggregator = bar_aggregator
+        self.indicator_engine = indicator_engine
+        self.market_data_subscriptions = market_data_subscriptions
+        self.old_orderids = old_orderids
+        self.name_of_dailytradingplan = name_of_dailytradingplan
+        self.exr_rate = exr_rate
+        self.limit_absolute_risk = limit_absolute_risk
+        self.percent_invested_max = percent_invested_max
+        self.risk_abs_max = risk_abs_max
+
+        # Refreshed before every rule pass
+        self.app = None
+        self.now = 0.0
+        self.market_session = None
+        self.ib_timezone_str = ""
+        self.is_market_open = False
+        self.percent_invested = None
+        self.portfolio_size = None
+        self.max_daily_loss_reached = False
+
+        # State of the trading day owned by the rules
+        self.daily_brackets_submitted = False
+        self.all_orders_cancelled = False
+
+    def refresh(self, app, now, market_session, ib_timezone_str, is_market_open, percent_invested, portfolio_size,
+                max_daily_loss_reached):
+        self.app = app
+        self.now = now
+        self.market_session = market_session
+        self.ib_timezone_str = ib_timezone_str
+        self.is_market_open = is_market_open
+        self.percent_invested = percent_invested
+        self.portfolio_size = portfolio_size
+        self.max_daily_loss_reached = max_daily_loss_reached
+
+    def account_ready(self, position):
+        # Only continues if all relevant data points are defined and parameters given
+        return not (pd.isnull(self.percent_invested) or self.portfolio_size is None or
+                    self.percent_invested is None or position.position_below_limit or
+                    position.max_daily_loss_reached)
+
+    def last(self, position):
+        return self.quote_board.get(position.req_id, LAST_PRICE)
+
+    def bars(self, position, seconds, count=1):
+        # Latest bars of the contract of the row (BAR_1S, BAR_1M or BAR_5M), the current bar is the last one
+        ticker_id = self.market_data_subscriptions.ticker_id(position.req_id)
+        return self.bar_aggregator.bars(ticker_id, seconds, count)
+
+    def indicator(self, position, name):
+        # Intraday indicator of the contract of the row by name ("VWAP", "ATR", "EMA9", ...), None while warming up
+        ticker_id = self.market_data_subscriptions.ticker_id(position.req_id)
+        return self.indicator_engine.value(ticker_id, name)
+
+    def recheck_at(self, epoch, position, key):
+        # Re-evaluates the row at epoch, even if no tick arrives until then
+        self.scheduler.call_at(epoch, self.wake, position.req_id, key=(key, position.req_id))
+
+    def wake(self, req_id):
+        self.engine.notify(req_id, TIMER)
+        self.tick_queue.mark_dirty(req_id)
+
+    def plan_changed(self, position):
+        # Used when a rule changes another row than its own
+        self.batch_evaluator.refresh(self.positions, [position.req_id])
+        self.risk_ledger.sync(self.positions, position.req_id)
+        self.engine.notify(position.req_id, PLAN_CHANGED)
+
+    def one_cancels_all(self, position, total_quantity, lmt_price, aux_price):
+        # Places a new OCA profit taker and stop loss (and SOC order) for the row
+        contract = MyUtilities.get_contract_details(position)
+        oca = MyOrders.one_cancels_all(self.app.nextOrderId(), total_quantity, lmt_price, aux_price, position,
+                                       self.clock, self.ib_timezone_str, self.market_session.close)
+        for o in oca:
+            self.app.placeOrder(o.orderId, contract, o)
+            self.app.nextOrderId()
+
+    def adjust_protection(self, position, total_quantity, lmt_price, aux_price):
+        # Modifies the profit taker and stop loss of the row in place, or replaces them if their structure changed
+        contract = MyUtilities.get_contract_details(position)
+        return MyOrders.adjust_one_cancels_all(self.app, contract, total_quantity, lmt_price, aux_price, position,
+                                               self.clock, self.ib_timezone_str, self.market_session.close)
+
+    def sell_market(self, position, total_quantity):
+        contract = MyUtilities.get_contract_details(position)
+        order = MyOrders.sell_market_order(self.app.nextOrderId(), position, total_quantity)
+        self.app.placeOrder(order.orderId, contract, order)
+
+    def cancel(self, order_id):
+        self.app.cancelOrder(int(order_id), OrderCancel())
+
+
+class RuleEngine:
+    """
+    Runs the rule classes of this module for one row at a time.
+
+    Each rule declares the lifecycle phase block it belongs to (phase), the quote columns and events that can change
+    its outcome (inputs) and whether it needs the account data (gated). A pass only runs the rules registered for the
+    phase of the row whose inputs changed since the last completed pass of the row - quote columns are compared to the
+    values seen then, events are collected through notify(). Rules without inputs are evaluated on every pass.
+    Evaluations, actions, skips and time are counted per rule.
+    """
+
+    def __init__(self, rules, quote_board, capacity=64):
+        self.rules = rules
+        self.quote_board = quote_board
+        self._seen = np.full((capacity, len(QUOTE_COLUMNS)), np.nan)
+        self._passes = np.zeros(capacity, dtype=bool)
+        self._pass_quotes = {}
+        self._events = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+        # Counters per rule name
+        self.evaluations = collections.Counter()
+        self.actions = collections.Counter()
+        self.skipped = collections.Counter()
+        self.seconds = collections.Counter()
+
+    def notify(self, req_id, event):
+        with self._lock:
+            self._events[req_id].add(event)
+
+    def notify_rows(self, req_ids, event):
+        with self._lock:
+            for req_id in req_ids:
+                self._events[req_id].add(event)
+
+    def changed_inputs(self, req_id):
+        """
+        Inputs of the row that changed since its last completed pass.
+
+        Parameters:
+        - req_id (int): Row of the trading plan.
+
+        Returns:
+        - frozenset: Quote board columns and events - all inputs for a row without a completed pass so far.
+        """
+        quotes = self.quote_board.row(req_id).copy()
+        self._pass_quotes[req_id] = quotes
+
+        with self._lock:
+            events = frozenset(self._events.get(req_id, ()))
+
+        if req_id >= len(self._passes) or not self._passes[req_id]:
+            return ALL_INPUTS | events
+
+        seen = self._seen[req_id]
+        changed = ~((quotes == seen) | (np.isnan(quotes) & np.isnan(seen)))
+
+        return frozenset(np.flatnonzero(changed).tolist()) | events
+
+    def commit(self, req_id, changed):
+        """
+        Marks the inputs of a completed pass as seen. Passes ended early are not committed, so that the next pass
+        sees their changes again.
+
+        Parameters:
+        - req_id (int): Row of the trading plan.
+        - changed (frozenset): Inputs returned by changed_inputs() for this pass - events arriving meanwhile are kept.
+        """
+        if req_id >= len(self._passes):
+            self._grow(req_id + 1)
+
+        self._seen[req_id] = self._pass_quotes.pop(req_id)
+        self._passes[req_id] = True
+
+        with self._lock:
+            events = self._events.get(req_id)
+            if events is not None:
+                events -= changed
+                if not events:
+                    del self._events[req_id]
+
+    def _grow(self, n_rows):
+        capacity = max(n_rows, 2 * len(self._passes))
+        seen = np.full((capacity, len(QUOTE_COLUMNS)), np.nan)
+        seen[:len(self._seen)] = self._seen
+        passes = np.zeros(capacity, dtype=bool)
+        passes[:len(self._passes)] = self._passes
+        self._seen, self._passes = seen, passes
+
+    def run(self, ctx, position, phase_rules, rules, changed):
+        """
+        Runs the triggered rules of the given list in order.
+
+        Parameters:
+        - ctx (RuleContext): Shared state, refreshed for this pass.
+        - position (PositionRecord): Row of the trading plan.
+        - phase_rules (frozenset): Rule blocks registered for the phase of the row (RowLifecycle.rules()).
+        - rules (tuple): Rule classes in the order they are evaluated.
+        - changed (frozenset): Inputs changed since the last completed pass (changed_inputs()).
+
+        Returns:
+        - str: STOP_PASS if a rule ended the pass, None otherwise.
+        """
+        account_checked = False
+
+        for rule in rules:
+            if rule.phase not in phase_rules:
+                continue
+
+            if rule.inputs is not None and not (rule.inputs & changed):
+                self.skipped[rule.__name__] += 1
+                continue
+
+            # Same place as the former account check - no rule after it runs without the account data
+            if rule.gated and not account_checked:
+                if not ctx.account_ready(position):
+                    return STOP_PASS
+                account_checked = True
+
+            if self.call(rule, ctx, position) == STOP_PASS:
+                return STOP_PASS
+
+        return None
+
+    def call(self, rule, ctx, position):
+        # Evaluates one rule and books its counts and time - also used by rules calling a sub-rule
+        name = rule.__name__
+        start = time.perf_counter()
+
+        try:
+            self.evaluations[name] += 1
+            if not rule.applies(ctx, position):
+                return None
+
+            self.actions[name] += 1
+            return rule.action(ctx, position)
+
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def report(self):
+        lines = ["Rules (evaluations / actions / skipped / time [ms]):"]
+        for rule in self.rules:
+            name = rule.__name__
+            lines.append(f"  {name}: {self.evaluations[name]} / {self.actions[name]} / {self.skipped[name]} / "
+                         f"{round(self.seconds[name] * 1000, 1)}")
+
+        return "\n".join(lines)
 
 
 class BracketOrdersOpenPositions:
+    """
+    Places the brackets around the open positions carried into the day.
+
+    Before the open, all orders of the last session are cancelled once. At the open, the bracket is placed if LAST is
+    within -1% of the stop. A stock gapping below waits 4 seconds and is sold if it keeps falling.
+    """
+
+    phase = OPEN_POSITION_BRACKET
+    inputs = None  # Polls - the old orders are cancelled 15 minutes before the open, even if no quote changes
+    gated = False
 
     @staticmethod
-    def abc():
-        pass
+    def applies(ctx, position):
+        return not ctx.daily_brackets_submitted and position.open_position and \
+            not position.open_position_bracket_submitted
 
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+        minutes_to_market_open = ctx.market_session.seconds_to_open(ctx.now) / 60
 
-class SellHalfRule:
+        # Cancels all open orders every time the algo is started if the market opening is only some minutes away
+        # Note that this only happens if there are open positions in the trading plan
+        if not ctx.all_orders_cancelled and minutes_to_market_open < 15:
+
+            for old_id in ctx.old_orderids:
+                ctx.cancel(old_id)
+
+            ctx.all_orders_cancelled = True
+
+        # Only continues in logic if all relevant data points are already received
+        if np.isnan(ctx.last(position)):
+            return STOP_PASS
+
+        # Bracket shall immediately be placed when last price is within -1% or above of defined stop
+        if ctx.is_market_open and ctx.last(position) > position.stop_price * 0.99:
+            # Place new OCA profit taker and stop loss
+            total_quantity = round(position.quantity, 0)
+            lmt_price = round(position.profit_taker_price, 2)
+            aux_price = round(position.stop_price, 2)
+            ctx.one_cancels_all(position, total_quantity, lmt_price, aux_price)
+
+            position.open_position_bracket_submitted = True
+            position.order_executed_time = clock.now_str("%y%m%d %H:%M:%S")
+            print(f"\nStock ID: {req_id} {position.symbol} within -1% from buy price - bracket defined."
+                  f"( {clock.now_str()} )")
+
+        # If price gaps below -1% from buy price and stock iterates the first time:
+        elif ctx.is_market_open and position.stop_timestamp == "":
+            position.stop_timestamp = clock.epoch()
+            position.last_stop_price = ctx.last(position)
+            position.stock_looped = True
+            ctx.recheck_at(position.stop_timestamp + 4, position, 'stop recheck')
+            print(f"\nStock ID: {req_id} {position.symbol} gapped below -1% from buy price - we wait 4 secs."
+                  f"( {clock.now_str()} )")
+
+        # If price gaps below -1% from buy price and stock iterates further:
+        elif ctx.is_market_open and position.stop_timestamp <= clock.epoch() - 4:
+
+            # If stock continues to sink within last 4 seconds, sell order is placed
+            if position.last_stop_price > ctx.last(position):
+
+                # Shoot market sell order
+                contract = MyUtilities.get_contract_details(position)
+                total_quantity = round(position.quantity, 0)
+                order_id = ctx.app.nextOrderId()
+                order = MyOrders.sell_market_order(order_id, position, total_quantity)
+                ctx.app.placeOrder(order.orderId, contract, order)
+
+                position.open_position_bracket_submitted = True
+                position.order_executed_time = clock.now_str("%y%m%d %H:%M:%S")
+                MyOrders.order_index.assign(position, 'stop_order_id', order_id)
+
+                print(f"\n Stock with ID: {req_id} {position.symbol} fell further in price - stock sold."
+                      f"( {clock.now_str()} )")
+
+            # If the price increased, I will wait 4 more seconds
+            else:
+                position.stop_timestamp = clock.epoch()
+                position.last_stop_price = ctx.last(position)
+                ctx.recheck_at(position.stop_timestamp + 4, position, 'stop recheck')
+                print(f"\nStock ID: {req_id} {position.symbol} improved in price - wait 4 more secs.\n")
+
+        if all(p.open_position == p.open_position_bracket_submitted for p in ctx.positions):
+            ctx.daily_brackets_submitted = True
+
+            # Add & reduce waits for all brackets - other rows are woken up for it
+            ctx.engine.notify_rows(range(len(ctx.positions)), PLAN_CHANGED)
+
+            print(f"\nAll brackets for open positions transmitted. ( {clock.now_str()} )\n")
+
+
+class StopUndercut:
+    """
+    Marks rows whose LAST price undercut the stop - new positions are not entered anymore afterwards.
+    """
+
+    phase = STOP_UNDERCUT
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = False
 
     @staticmethod
-    def abc():
-        pass
+    def applies(ctx, position):
+        return not position.stop_undercut and ctx.last(position) < position.stop_price
 
+    @staticmethod
+    def action(ctx, position):
+        position.stop_undercut = True
+        position.stop_undercut_time = ctx.clock.now_str()
+        print(f"\nStock ID: {position.req_id} {position.symbol} has undercut the stop. ( {ctx.clock.now_str()} )")
 
-class SellSquatRule:
+
+class DailyInvestmentLimit:
+    """
+    Sizes a new position to the daily investment limit before its buy order is placed.
+
+    Option A limits the %-invested of the portfolio, option B the absolute risk taken through new positions today.
+    Both are read from the RiskLedger, which includes the fills since the last account update and the entries in
+    flight.
+    Called by OrderExecutionNewPositions once the buy point is crossed.
+    """
+
+    phase = ENTRY
+    inputs = frozenset((LAST_PRICE, BID_PRICE, ASK_PRICE, LOW_PRICE)) | _EVENTS
+    gated = True
 
     @staticmethod
-    def abc():
-        pass
+    def applies(ctx, position):
+        return True
 
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+        portfolio_size = ctx.portfolio_size
 
-class BadCloseRule:
+        entry_price = position.entry_price
+        stop_price = position.stop_price
+        qty_full = position.quantity
+
+        if not ctx.limit_absolute_risk:
+            # ---------------------------------------------
+            # Option A: limit by %-invested (as per previous code versions)
+            # ---------------------------------------------
+            percent_invested = ctx.risk_ledger.percent_invested(portfolio_size)
+            if percent_invested is None:
+                percent_invested = ctx.percent_invested
+            percent_invested_max = ctx.percent_invested_max
+
+            if entry_price / ctx.exr_rate * qty_full / portfolio_size + percent_invested > percent_invested_max:
+
+                # Reduces the size of the position to stay within the investment limit
+                position.quantity = math.floor(
+                    (percent_invested_max - percent_invested) * portfolio_size
+                    / (entry_price / ctx.exr_rate)
+                )
+
+                position.invest_limit_reached = True
+                position.invest_limit_reached_time = clock.now_str()
+
+                # Very small resulting positions shall not be traded
+                if position.quantity * entry_price < MIN_POSITION_SIZE * portfolio_size:
+                    position.position_below_limit = True
+                    print(
+                        f"\nStock ID: {req_id} {position.symbol} would exceed my daily investment limit - "
+                        f"remainder is below the minimum position size of {round(MIN_POSITION_SIZE * 100, 1)}"
+                        f"% - trade not executed. ( {clock.now_str()} )"
+                    )
+                    return STOP_PASS
+
+                print(
+                    f"\nStock ID: {req_id} {position.symbol} would exceed my daily investment limit. "
+                    f"Position size has been reduced. ( {clock.now_str()} )"
+                )
+
+        else:
+            # --------------------------------------------------
+            # Option B: limit by absolute risk (new functionality)
+            # --------------------------------------------------
+            risk_abs_max = ctx.risk_abs_max
+
+            # 1) Risk already taken today by new, filled positions
+            # "Open position" == False -> not carried into the day
+            # "Order filled" == True   -> new buy-order has been filled
+            # Entries in flight count with their reserved risk
+            current_abs_risk = ctx.risk_ledger.risk_in_use
+
+            # 2) Risk of this order at full size (already in account currency)
+            per_share_risk_base = entry_price - stop_price
+            order_risk_full = per_share_risk_base * qty_full
+
+            print(
+                f"\nStock ID: {req_id} {position.symbol} position has an additional risk of "
+                f"{round(order_risk_full, 0)}. New risk taken today is {round(current_abs_risk, 0)}. "
+                f"( {clock.now_str()} )"
+            )
+
+            # If this order at full size would exceed the absolute risk limit
+            if current_abs_risk + order_risk_full > risk_abs_max:
+
+                max_risk_remaining = risk_abs_max - current_abs_risk
+
+                if max_risk_remaining <= 0:
+                    # No risk budget left at all -> don't trade
+                    position.invest_limit_reached = True
+                    position.invest_limit_reached_time = clock.now_str()
+                    print(
+                        f"\nStock ID: {req_id} {position.symbol} would exceed my daily absolute risk limit "
+                        f"of {round(risk_abs_max, 0)} - no risk budget left, trade not executed. ( {clock.now_str()} )"
+                    )
+                    return STOP_PASS
+
+                # 3) Reduce quantity to fit into remaining risk budget
+                allowed_qty = math.floor(max_risk_remaining / per_share_risk_base)
+
+                # If we can't even buy 1 share within the remaining risk
+                if allowed_qty <= 0:
+                    position.invest_limit_reached = True
+                    position.invest_limit_reached_time = clock.now_str()
+                    position.position_below_limit = True
+                    print(
+                        f"\nStock ID: {req_id} {position.symbol} would exceed my daily absolute risk limit "
+                        f"of {round(risk_abs_max, 0)} - remainder is below the minimum position size of "
+                        f"{round(MIN_POSITION_SIZE * 100, 1)}% - trade not executed. ( {clock.now_str()} )"
+                    )
+                    return STOP_PASS
+
+                # Apply reduced quantity
+                position.quantity = allowed_qty
+                position.invest_limit_reached = True
+                position.invest_limit_reached_time = clock.now_str()
+
+                # Very small resulting positions shall not be traded
+                if allowed_qty * entry_price < MIN_POSITION_SIZE * portfolio_size:
+                    position.position_below_limit = True
+                    print(
+                        f"\nStock ID: {req_id} {position.symbol} would exceed my daily absolute risk limit "
+                        f"of {round(risk_abs_max, 0)} - remainder is below the minimum position size of "
+                        f"{round(MIN_POSITION_SIZE * 100, 1)}% - trade not executed. ( {clock.now_str()} )"
+                    )
+                    return STOP_PASS
+
+                print(
+                    f"\nStock ID: {req_id} {position.symbol} would exceed my daily absolute risk limit "
+                    f"of {round(risk_abs_max, 0)}. "
+                    f"Position size has been reduced to {allowed_qty}. ( {clock.now_str()} )"
+                )
+
+        return None
+
+
+class OrderExecutionNewPositions:
+    """
+    Buys new positions once LAST crosses the entry price.
+
+    Two-step entries are excluded, but within the first minute a crossed stock keeps looping to enter at a lower
+    spread or price. The buy bracket is only placed while the stop is intact, LAST is below the buy limit and the
+    spread is below MAX_STOCK_SPREAD.
+    """
+
+    phase = ENTRY
+    inputs = frozenset((LAST_PRICE, BID_PRICE, ASK_PRICE, LOW_PRICE)) | _EVENTS
+    gated = True
+
+    @staticmethod
+    def applies(ctx, position):
+        return (
+            ctx.last(position) > position.entry_price and
+            not position.open_position and not position.crossed_buy_price and
+            not position.order_executed
+        ) or (
+            position.crossed_buy_price and not position.order_executed and
+            not ctx.market_session.passed(FIRST_MINUTE_END)
+        )
 
     @staticmethod
-    def abc():
-        pass
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+        quote_board = ctx.quote_board
+        market_session = ctx.market_session
+
+        # Marks "crossed buy price" only once
+        if not position.crossed_buy_price:
+            position.crossed_buy_price = True
+            position.crossed_buy_price_time = clock.now_str()
+            if position.stop_undercut:
+                print(f"\nStock ID: {req_id} {position.symbol} crossed buy price,"
+                      f" but stop is already undercut. ( {clock.now_str()} )")
+            else:
+                print(f"\nStock ID: {req_id} {position.symbol} crossed buy price. ( {clock.now_str()} )")
+            position.stop_timestamp = clock.epoch()
+
+        if ctx.engine.call(DailyInvestmentLimit, ctx, position) == STOP_PASS:
+            return STOP_PASS
+
+        # Terminates all buying if daily loss limit is reached
+        if ctx.max_daily_loss_reached:
+            position.max_daily_loss_reached = True
+            position.max_daily_loss_reached_time = clock.now_str()
+            print(f"\nStock ID: {req_id} {position.symbol} not executed - daily max. loss of "
+                  f"{round(MAX_ALLOWED_DAILY_PNL_LOSS * 100, 1)}% is reached. ( {clock.now_str()} ")
+            return STOP_PASS
+
+        stock_spread = abs((quote_board.get(req_id, ASK_PRICE) - quote_board.get(req_id, BID_PRICE))
+                           / quote_board.get(req_id, ASK_PRICE))
+        position.spread_at_execution = round(stock_spread * 100, 2)
+
+        # Provides feedback to cmd prompt when stock is above price or spread limit
+        # In the first minutes, a message is only printed every 10 seconds
+        # Only prints this message if stock is already looping for 10 sec. (small inaccuracy to CMD prompt)
+        if not market_session.passed(FIRST_MINUTE_END) and position.stop_timestamp <= clock.epoch() - 10:
+
+            position.stop_timestamp = clock.epoch()
+
+            if ctx.last(position) >= position.buy_limit_price:
+                print(f"\nStock ID: {req_id} {position.symbol} - LAST price is above buy limit -"
+                      f"stock loops within first minutes. ( {clock.now_str()} )")
+                position.stock_looped = True
+
+            if stock_spread > MAX_STOCK_SPREAD:
+                print(f"\nStock ID: {req_id} {position.symbol} - Spread is above limit at:"
+                      f"{round(stock_spread * 100, 2)}% - stock loops within first minutes. ( {clock.now_str()} )")
+                position.stock_looped = True
+
+        elif market_session.passed(FIRST_MINUTE_END) and not market_session.passed(CLOSE):
+
+            if ctx.last(position) >= position.buy_limit_price:
+                print(f"\nStock ID: {req_id} {position.symbol} - LAST price is above buy limit."
+                      f"( {clock.now_str()} )")
+
+            if stock_spread > MAX_STOCK_SPREAD:
+                print(f"\nStock ID: {req_id} {position.symbol} - Spread is above limit at: "
+                      f"{round(stock_spread * 100, 2)}%. ( {clock.now_str()} )")
+
+        # Provides feedback to DailyTradingPlan if stock is above price or spread limit
+        if ctx.last(position) >= position.buy_limit_price:
+            position.price_above_limit = True
+
+        if stock_spread > MAX_STOCK_SPREAD:
+            position.spread_above_limit = True
+
+        # Checks 1) if stop has not already been undercut, 2) if stock price is still below the buy limit price,
+        # 3) spread < MAX_STOCK_SPREAD
+        if not position.stop_undercut and \
+                ctx.last(position) < position.buy_limit_price and \
+                stock_spread < MAX_STOCK_SPREAD:
+
+            position.order_executed = True
+            position.order_executed_time = clock.now_str("%y%m%d %H:%M:%S")
+
+            # Blocks execution of buy order shortly before market close for "sell on close" stock
+            # 5 minutes since at t-4min the SOC brackets get replaced and t-3min the sells are done
+            if market_session.passed(PLAN_FREEZE) and position.sell_on_close:
+                print(
+                    f"\nStock ID: {req_id} {position.symbol} shall be sold on close - buy not executed."
+                    f"( {clock.now_str()} )")
+
+                return STOP_PASS
+
+            if position.stop_low_of_day and quote_board.get(req_id, LOW_PRICE) > position.stop_price:
+
+                stop_risk_abs = (position.entry_price - position.stop_price) * position.quantity
+
+                # Uses half of the original risk or low of day, whatever is wider
+                # within first 10 Minutes of trading and the low of day thereafter
+                if not market_session.passed(FIRST_10_MINUTES_END):
+                    risk_per_share = position.entry_price - position.stop_price
+                    risk_per_share_halved = risk_per_share / 2
+                    risk_per_share_LoD = ctx.last(position) - quote_board.get(req_id, LOW_PRICE)
+
+                    if risk_per_share_halved >= risk_per_share_LoD:
+                        position.stop_price = position.entry_price - risk_per_share_halved
+                        print(
+                            f"\nStock ID: {req_id} {position.symbol} crossed buy price within "
+                            f"first 10 minutes and therefore uses 50% of original risk instead of low of day. "
+                            f"{position.stop_price} is the stop loss price. ( {clock.now_str()} )")
+                    else:
+                        position.stop_price = quote_board.get(req_id, LOW_PRICE)
+                        print(
+                            f"\nStock ID: {req_id} {position.symbol} crossed buy price within "
+                            f"first 10 minutes - still used low of day as stop due to its width. "
+                            f"{position.stop_price} is the stop loss price. ( {clock.now_str()} )")
+                else:
+                    position.stop_price = quote_board.get(req_id, LOW_PRICE)
+                    print(
+                        f"\nStock ID: {req_id} {position.symbol} uses low of the day of "
+                        f"{position.stop_price} as stop loss price. ( {clock.now_str()} )")
+
+                # Adjust position size to match pre-defined absolute risk
+                new_quantity = stop_risk_abs / (ctx.last(position) - position.stop_price)
+                print(
+                    f"\nStock ID: {req_id} {position.symbol} buy quantity changed from "
+                    f"{position.quantity} to {round(new_quantity, 0)}. ( {clock.now_str()} )")
+                print("### Attention ### Do not unintentionally overwrite buy quantity for open position.")
+                position.quantity = round(new_quantity, 0)
+
+                MyUtilities.dailytradingplan_update(req_id, position.stop_price, position.quantity,
+                                                    ctx.name_of_dailytradingplan)
+
+            contract = MyUtilities.get_contract_details(position)
+            bracket = MyOrders.bracket_order(ctx.app.nextOrderId(), position, clock, ctx.ib_timezone_str,
+                                             market_session.close)
+            ctx.app.place_bracket(contract, bracket)
+            for _ in bracket:
+                ctx.app.nextOrderId()
+
+            position.spread_at_execution = round(stock_spread * 100, 2)
+            position.quantity_at_open = position.quantity
+            print(f"\nStock ID: {req_id} {position.symbol} - Order placed. ( {clock.now_str()} )")
+
+            # Reserves exposure and risk until the entry is filled, cancelled or expired (GTD of 1 minute)
+            ctx.risk_ledger.reserve(position)
+            ctx.scheduler.call_at(clock.epoch() + 65, ctx.risk_ledger.release, req_id, key=('reservation', req_id))
+
+        return None
 
 
 class AddAndReduce:
+    """
+    Raises the stop of all positions in the same symbol to the stop of a newly filled add-on position.
+
+    Only the rows of the symbol holding shares are visited (SymbolIndex.held_rows()).
+    """
+
+    phase = ADD_AND_REDUCE
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
 
     @staticmethod
-    def abc():
-        pass
+    def applies(ctx, position):
+        return ctx.daily_brackets_submitted and position.add_and_reduce and \
+            not position.add_and_reduce_executed and position.order_filled
+
+    @staticmethod
+    def action(ctx, position):
+        for req_id in ctx.symbol_index.held_rows(position.symbol, position.currency):
+            other = ctx.positions[req_id]
+
+            # Moves the stop loss of the current bracket order
+            total_quantity = round(other.quantity, 0)
+            lmt_price = round(other.profit_taker_price, 2)
+            aux_price = round(position.stop_price, 2)
+            ctx.adjust_protection(other, total_quantity, lmt_price, aux_price)
+
+            # Changes stop price in the trading plan
+            other.stop_price = aux_price
+            ctx.plan_changed(other)
+
+            # Changes stop price in DailyTradingPlan
+            MyUtilities.dailytradingplan_update(req_id, aux_price, other.quantity, ctx.name_of_dailytradingplan)
+
+            print(f"\nStock ID: {req_id} {other.symbol} - Add and reduce executed. ( {ctx.clock.now_str()} )")
+
+        position.add_and_reduce_executed = True
+
+
+class SellHalfRule:
+    """
+    Sells half of a new position that gained SELL_HALF_REVERSAL_RULE over the buy point and came back in to it.
+
+    The marker is only set once the buy order is older than 2.5 minutes, otherwise the row is re-checked then.
+    """
+
+    phase = SELL_HALF
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
+
+    @staticmethod
+    def applies(ctx, position):
+        return not position.open_position and position.order_filled
+
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+
+        # First, marker to be set if buy price increases X% after buy (see SELL_HALF_REVERSAL_RULE)
+        if not position.two_percent_above_buy_point and \
+                ctx.last(position) > position.entry_price * (1 + SELL_HALF_REVERSAL_RULE):
+
+            execution_timestamp = datetime.datetime.strptime(position.order_executed_time, "%y%m%d %H:%M:%S")
+            execution_timestamp = clock.localize(execution_timestamp)
+            print(f"\nStock ID: {req_id} {position.symbol} increased {SELL_HALF_REVERSAL_RULE * 100}% "
+                  f"above buy price - Sell-half-rule activated. ( {clock.now_str()} )")
+
+            # Sets marker only if stock buy order was placed more than 2.5 minutes ago
+            if ctx.now - clock.to_epoch(execution_timestamp) > 150:
+                position.two_percent_above_buy_point = True
+
+            # Otherwise the row is re-evaluated once the 2.5 minutes have passed, even without a tick
+            else:
+                ctx.recheck_at(clock.to_epoch(execution_timestamp) + 151, position, 'arming')
+
+        # Second, if stock comes in again to b/o level, 50% must be sold, bracket cancelled
+        # New OCA profit taker and stop loss to be set for 50% of quantity
+        if position.two_percent_above_buy_point and not position.new_oca_bracket and \
+                not position.stock_sold and not position.five_percent_above_buy_point and \
+                ctx.last(position) <= position.entry_price * (1 + position.spread_at_execution / 100) and \
+                round(position.quantity, 0) > 1:
+
+            # Reduces the current bracket order to 50% quantity before the other half is sold
+            total_quantity = math.floor(round(position.quantity, 0) / 2)
+            lmt_price = round(position.profit_taker_price, 2)
+            aux_price = round(position.stop_price, 2)
+            ctx.adjust_protection(position, total_quantity, lmt_price, aux_price)
+
+            # Shoot market sell order for 50%
+            ctx.sell_market(position, math.ceil(round(position.quantity, 0) / 2))
 
+            print(
+                f"\nStock ID: {req_id} {position.symbol} increased {round(SELL_HALF_REVERSAL_RULE * 100, 1)}% "
+                f"above buy price and came in to B/O level - sold half. ( {clock.now_str()} )")
 
-class SellOnClose:
+            position.new_oca_bracket = True
+            position.new_oca_bracket_time = clock.now_str()
+            position.quantity = total_quantity
+
+
+class SellSquatRule:
+    """
+    Moves the stop to break-even once a new position gained SELL_FULL_REVERSAL_RULE, so that a squat back to the buy
+    point sells the full position without a loss.
+    """
+
+    phase = BREAK_EVEN
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
 
     @staticmethod
-    def abc():
-        pass
+    def applies(ctx, position):
+        return not position.open_position and position.order_filled and \
+            not position.stock_sold and not position.five_percent_above_buy_point and \
+            ctx.last(position) > position.entry_price * (1 + SELL_FULL_REVERSAL_RULE)
+
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+
+        execution_timestamp = datetime.datetime.strptime(position.order_executed_time, "%y%m%d %H:%M:%S")
+        execution_timestamp = clock.localize(execution_timestamp)
+
+        # Exits if order was place less than 2.5 minutes ago and comes back once they have passed
+        if ctx.now - clock.to_epoch(execution_timestamp) < 150:
+            ctx.recheck_at(clock.to_epoch(execution_timestamp) + 151, position, 'arming')
+            return STOP_PASS
+
+        position.five_percent_above_buy_point = True
+        position.five_percent_above_buy_point_time = clock.now_str()
+
+        # Moves the stop loss of the current bracket order to B/E
+        total_quantity = round(position.quantity, 0)
+        lmt_price = round(position.profit_taker_price, 2)
+        aux_price = round(position.entry_price, 2)
+        ctx.adjust_protection(position, total_quantity, lmt_price, aux_price)
+        position.stop_price = position.entry_price
+
+        # Changes stop price in DailyTradingPlan
+        MyUtilities.dailytradingplan_update(req_id, aux_price, position.quantity, ctx.name_of_dailytradingplan)
+
+        print("\nStock ID:", req_id, position.symbol,
+              "increased", round(SELL_FULL_REVERSAL_RULE * 100, 1),
+              "% above buy price - stop is increased to B/E. (",
+              clock.now_str(), ")")
 
 
 class SellBelowSMA:
+    """
+    Keeps the sell on close order only for stocks below their SMA - above it, the bracket is replaced by one without
+    the SOC order from t-4min on.
+    """
+
+    phase = SELL_ON_CLOSE_SMA
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
+
+    @staticmethod
+    def applies(ctx, position):
+        last = ctx.last(position)
+        return ctx.market_session.passed(SELL_ON_CLOSE) and \
+            not position.stock_sold and position.sell_on_close and \
+            pd.notna(position.sell_below_sma) and \
+            position.profit_taker_price > last > position.stop_price and \
+            last > position.sell_below_sma and \
+            ((not position.open_position and position.order_filled) or position.open_position)
 
     @staticmethod
-    def abc():
-        pass
+    def action(ctx, position):
+        # Important so that he places a bracket without SOC order
+        position.sell_on_close = False
 
+        # Replaces the current bracket order by one without GAT portion
+        total_quantity = round(position.quantity, 0)
+        lmt_price = round(position.profit_taker_price, 2)
+        aux_price = round(position.stop_price, 2)
+        ctx.adjust_protection(position, total_quantity, lmt_price, aux_price)
 
-class DailyInvestmentLimit:
+        print(f"\nStock ID: {position.req_id} {position.symbol} - Sell on close order deleted since last price "
+              f"{round(ctx.last(position), 2)} is above sell limit of "
+              f"{round(position.sell_below_sma, 2)}. ( {ctx.clock.now_str()} )")
+
+
+class BadCloseRule:
+    """
+    Sells half of a new position at t-2min if the stock does not close in the upper BAD_CLOSE_RULE of its daily range.
+
+    Only applies if neither the sell-half nor the break-even rule were triggered. Rows that are not filled yet are
+    only marked as checked, so that a later fill does not trigger it.
+    """
+
+    phase = BAD_CLOSE_CHECK
+    inputs = frozenset((LAST_PRICE, HIGH_PRICE, LOW_PRICE)) | _EVENTS
+    gated = True
 
     @staticmethod
-    def abc():
-        pass
\ No newline at end of file
+    def applies(ctx, position):
+        return ctx.market_session.passed(BAD_CLOSE) and not position.bad_close_checked
+
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        quote_board = ctx.quote_board
+
+        position.bad_close_checked = True
+
+        if not position.open_position and \
+                position.order_filled and not position.stock_sold and \
+                not position.sell_on_close and pd.isnull(position.sell_below_sma) and \
+                not position.five_percent_above_buy_point and not position.new_oca_bracket and \
+                not position.bad_close_rule and round(position.quantity, 0) > 1 and \
+                (
+                        (quote_board.get(req_id, LAST_PRICE) - quote_board.get(req_id, LOW_PRICE)) /
+                        (quote_board.get(req_id, HIGH_PRICE) - quote_board.get(req_id, LOW_PRICE)) < BAD_CLOSE_RULE
+                ):
+
+            # Reduces the current bracket order to 50% quantity before the other half is sold
+            total_quantity = math.floor(round(position.quantity, 0) / 2)
+            lmt_price = round(position.profit_taker_price, 2)
+            aux_price = round(position.stop_price, 2)
+            ctx.adjust_protection(position, total_quantity, lmt_price, aux_price)
+
+            # Shoot market sell order for 50%
+            ctx.sell_market(position, math.ceil(round(position.quantity, 0) / 2))
+
+            print(f"\nStock ID: {req_id} {position.symbol} attempts a bad close - sold half. "
+                  f"( {ctx.clock.now_str()} )")
+
+            position.bad_close_rule = True
+            position.bad_close_rule_time = ctx.clock.now_str()
+            position.quantity = total_quantity
+
+
+class SellNegativeOnDay1:
+    """
+    Sells a new position at t-2min if it is negative on day 1 ("Sell negative on day 1").
+    """
+
+    phase = NEGATIVE_CLOSE_CHECK
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
+
+    @staticmethod
+    def applies(ctx, position):
+        return ctx.market_session.passed(BAD_CLOSE) and position.sell_negative_on_day_1 and \
+            not position.negative_close_checked
+
+    @staticmethod
+    def action(ctx, position):
+        position.negative_close_checked = True
+
+        if not position.open_position and \
+                position.order_filled and not position.stock_sold and \
+                not position.sell_on_close and pd.isnull(position.sell_below_sma) and \
+                ctx.last(position) < position.entry_price:
+
+            # Cancels current bracket oder
+            ctx.cancel(position.profit_order_id)
+
+            # Shoot market sell order
+            ctx.sell_market(position, position.quantity)
+            position.quantity = 0
+            print(f"\nStock ID: {position.req_id} {position.symbol} attempts to close negative - stock sold. "
+                  f"( {ctx.clock.now_str()} )")
+            position.stock_sold = True
+            position.stock_sold_time = ctx.clock.now_str()
+
+
+class XRProfits:
+    """
+    Sells 1/x of a new position at x-times its risk on day 1 to cushion the risk.
+    """
+
+    phase = X_R_PROFITS
+    inputs = frozenset((LAST_PRICE,)) | _EVENTS
+    gated = True
+
+    @staticmethod
+    def applies(ctx, position):
+        return pd.notna(position.profit_at_x_r) and not position.open_position and \
+            position.order_filled and not position.stock_sold and not position.x_r_profits
+
+    @staticmethod
+    def action(ctx, position):
+        req_id = position.req_id
+        clock = ctx.clock
+
+        if position.profit_at_x_r <= 0:
+            print(f"\nStock ID: {req_id} {position.symbol} x-R multiple must be positive and >0. "
+                  f"( {clock.now_str()} )")
+            position.x_r_profits = True
+            return STOP_PASS
+
+        stop_risk_rel = (position.entry_price - position.stop_price) / position.entry_price
+        profit_price = (position.profit_at_x_r * stop_risk_rel + 1) * position.entry_price
+
+        # Shoot market order for 1/x of the position in case first profit target is reached
+        if profit_price <= ctx.last(position):
+            position.x_r_profits = True
+            sold_quantity = math.ceil(round(position.quantity, 0) / position.profit_at_x_r)
+
+            # Reduces the current bracket order by 1/x before it is sold
+            total_quantity = round(position.quantity, 0) - sold_quantity
+            lmt_price = round(position.profit_taker_price, 2)
+            aux_price = round(position.stop_price, 2)
+            ctx.adjust_protection(position, total_quantity, lmt_price, aux_price)
+
+            # Shoot market sell order for 1/x
+            ctx.sell_market(position, sold_quantity)
+
+            print(f"\nStock ID: {req_id} {position.symbol} reached {position.profit_at_x_r}-times "
+                  f"risk at {ctx.last(position)} for "
+                  f"{round(position.profit_at_x_r * 100 * stop_risk_rel, 1)}% profit - "
+                  f"sold 1/{position.profit_at_x_r}. ( {clock.now_str()} )")
+
+            position.x_r_profits_time = clock.now_str()
+            position.quantity = total_quantity
+            MyUtilities.dailytradingplan_update(req_id, position.stop_price, position.quantity,
+                                                ctx.name_of_dailytradingplan)
+
+
+# Rules in the order of a pass - brackets of open positions also run before the open
+PRE_OPEN_RULES = (BracketOrdersOpenPositions,)
+SESSION_RULES = (StopUndercut, OrderExecutionNewPositions, AddAndReduce, SellHalfRule, SellSquatRule, SellBelowSMA,
+                 BadCloseRule, SellNegativeOnDay1, XRProfits)
+ALL_RULES = (BracketOrdersOpenPositions, StopUndercut, OrderExecutionNewPositions, DailyInvestmentLimit, AddAndReduce,
+             SellHalfRule, SellSquatRule, SellBelowSMA, BadCloseRule, SellNegativeOnDay1, XRProfits)
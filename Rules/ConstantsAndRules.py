@@ -8,6 +8,14 @@ BAD_CLOSE_RULE = 0.1
 MAX_ALLOWED_DAILY_PNL_LOSS = -0.25
 MIN_POSITION_SIZE = 0.001
 PORTFOLIO_UPDATE_PRINTS = 0.1
+MARKET_DATA_LINES = 100  # Market data lines of your IB account (100 by default)
+RECORD_FINISHED_STOCKS = False  # Keeps market data of sold or stop undercut stocks for the fetch data outputs
+TICK_BY_TICK_ENTRIES = False  # Streams every trade and quote of stocks waiting for their entry (reqTickByTickData)
+MAX_TICK_BY_TICK_STREAMS = 3  # Simultaneous tick-by-tick subscriptions allowed by IB for your account (2 per stock)
+MAX_MESSAGES_PER_SECOND = 45  # Orders and market data requests sent per second (TWS rejects more than 50)
+MESSAGE_BURST = 10  # Requests sent at once after a quiet period
+INDICATOR_EMA_PERIODS = (9, 20)  # EMAs of the 1-minute closes, read by the rules as "EMA9" and "EMA20"
+INDICATOR_ATR_PERIOD = 14  # Intraday ATR of the 1-minute bars, read by the rules as "ATR"
 
 # TASK: Use only IB TIMEZONE
 market_constants = {
@@ -19,6 +27,7 @@ market_constants = {
         "NAME_OF_DAILYTRADINGPLAN_SAVE": "_trading_plan_JP.xlsx",
         "NAME_OF_FETCHDATA_NEW_SAVE": "_fetch_new_positions_JP.xlsx",
         "NAME_OF_FETCHDATA_OPEN_SAVE": "_fetch_open_positions_JP.xlsx",
+        "NAME_OF_BARS_SAVE": "_bars_1m_JP.xlsx",
         "CLIENT_ID": 11
     },
     "NY": {
@@ -29,6 +38,7 @@ market_constants = {
         "NAME_OF_DAILYTRADINGPLAN_SAVE": "_trading_plan.xlsx",
         "NAME_OF_FETCHDATA_NEW_SAVE": "_fetch_new_positions.xlsx",
         "NAME_OF_FETCHDATA_OPEN_SAVE": "_fetch_open_positions.xlsx",
+        "NAME_OF_BARS_SAVE": "_bars_1m.xlsx",
         "CLIENT_ID": 22
     },
     "DE": {
@@ -39,6 +49,7 @@ market_constants = {
         "NAME_OF_DAILYTRADINGPLAN_SAVE": "_trading_plan_DE.xlsx",
         "NAME_OF_FETCHDATA_NEW_SAVE": "_fetch_new_positions_DE.xlsx",
         "NAME_OF_FETCHDATA_OPEN_SAVE": "_fetch_open_positions_DE.xlsx",
+        "NAME_OF_BARS_SAVE": "_bars_1m_DE.xlsx",
         "CLIENT_ID": 33
     }
 }
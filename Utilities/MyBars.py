@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+# Bar sizes in seconds
+BAR_1S = 1
+BAR_1M = 60
+BAR_5M = 300
+TIMEFRAMES = (BAR_1S, BAR_1M, BAR_5M)
+
+# Columns of a bar
+BAR_START = 0
+BAR_OPEN = 1
+BAR_HIGH = 2
+BAR_LOW = 3
+BAR_CLOSE = 4
+BAR_VOLUME = 5
+BAR_COLUMNS = ['Start', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+# Bars kept per timeframe - one trading day of 1m and 5m bars, the last hour of 1s bars
+DEFAULT_CAPACITY = {BAR_1S: 3600, BAR_1M: 1440, BAR_5M: 288}
+
+
+class BarRing:
+    """
+    Preallocated ring buffer of the bars of one contract and timeframe.
+    """
+
+    __slots__ = ('seconds', 'values', 'count', 'index')
+
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+        self.values = np.full((capacity, len(BAR_COLUMNS)), np.nan)
+        self.count = 0  # Bars written so far, the current bar included
+        self.index = -1  # Slot of the current bar
+
+    def add(self, epoch, price, size):
+        start = epoch - epoch % self.seconds
+        bar = self.values[self.index] if self.count else None
+
+        # Ticks arriving late are folded into the current bar
+        if bar is not None and start <= bar[BAR_START]:
+            if price > bar[BAR_HIGH]:
+                bar[BAR_HIGH] = price
+            if price < bar[BAR_LOW]:
+                bar[BAR_LOW] = price
+            bar[BAR_CLOSE] = price
+            bar[BAR_VOLUME] += size
+            return False
+
+        # New bar - intervals without any trade get no bar
+        self.index = (self.index + 1) % len(self.values)
+        self.values[self.index] = (start, price, price, price, price, size)
+        self.count += 1
+        return True
+
+    def add_volume(self, size):
+        if self.count:
+            self.values[self.index, BAR_VOLUME] += size
+
+    def last(self, count):
+        # The last count bars in chronological order (copy)
+        count = min(count, self.count, len(self.values))
+        if count <= 0:
+            return np.empty((0, len(BAR_COLUMNS)))
+
+        first = (self.index - count + 1) % len(self.values)
+        if first <= self.index:
+            return self.values[first:self.index + 1].copy()
+        return np.concatenate((self.values[first:], self.values[:self.index + 1]))
+
+
+class BarAggregator:
+    """
+    1s, 1m and 5m OHLCV bars of every contract, built tick by tick.
+
+    A trade updates the current bar of each timeframe in place or starts the next one in a preallocated ring buffer,
+    so a tick costs the same however long the day is, and rules or the recorder read bars without rescanning ticks.
+    Contracts are keyed by the tickerId of their market data subscription.
+
+    Volume comes with the trades of the tick-by-tick stream, otherwise from the changes of the day's VOLUME tick.
+    Ticks are only written by the API thread. Every write bumps the version twice (odd while writing), so that
+    reader threads repeat a copy which overlapped a write, as for the quote board.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = {**DEFAULT_CAPACITY, **(capacity or {})}
+        self._rings = {}
+        self._volume = {}
+        self._sized = set()
+        self.version = 0
+
+        # Counters
+        self.ticks = 0
+        self.bars_started = 0
+
+    def _rings_of(self, key):
+        rings = self._rings.get(key)
+        if rings is None:
+            rings = {seconds: BarRing(seconds, self.capacity[seconds]) for seconds in TIMEFRAMES}
+            self._rings[key] = rings
+        return rings
+
+    def feed_trade(self, key, epoch, price, size=0.0):
+        """
+        Adds a trade (or LAST price tick) to the bars of a contract.
+
+        Parameters:
+        - key (int): tickerId of the contract.
+        - epoch (float): Time of the trade.
+        - price (float): Price of the trade.
+        - size (float): Shares traded, 0 for LAST ticks without size.
+        """
+        if not price > 0:
+            return
+
+        rings = self._rings_of(key)
+        epoch = int(epoch)
+        size = float(size)
+        if size:
+            self._sized.add(key)
+
+        self.version += 1
+        for ring in rings.values():
+            self.bars_started += ring.add(epoch, price, size)
+        self.version += 1
+        self.ticks += 1
+
+    def feed_volume(self, key, cumulative_volume):
+        # Day volume of the VOLUME tick - its change is added to the current bars, unless trades come with sizes
+        # Returns the change added, e.g. for the VWAP
+        cumulative_volume = float(cumulative_volume)
+        previous = self._volume.get(key)
+        self._volume[key] = cumulative_volume
+
+        if previous is None or key in self._sized or cumulative_volume <= previous:
+            return 0.0
+
+        rings = self._rings.get(key)
+        if rings is None:
+            return 0.0
+
+        self.version += 1
+        for ring in rings.values():
+            ring.add_volume(cumulative_volume - previous)
+        self.version += 1
+        return cumulative_volume - previous
+
+    def bars(self, key, seconds, count=1, max_attempts=100):
+        """
+        The latest bars of a contract.
+
+        Parameters:
+        - key (int): tickerId of the contract.
+        - seconds (int): Timeframe, BAR_1S, BAR_1M or BAR_5M.
+        - count (int): Number of bars, the current (still open) bar is the last one.
+
+        Returns:
+        - np.ndarray: One row per bar in chronological order, columns as in BAR_COLUMNS.
+        """
+        rings = self._rings.get(key)
+        if rings is None:
+            return np.empty((0, len(BAR_COLUMNS)))
+
+        ring = rings[seconds]
+        bars = None
+        for _ in range(max_attempts):
+            version = self.version
+            if version % 2:
+                continue
+            bars = ring.last(count)
+            if self.version == version:
+                break
+
+        return ring.last(count) if bars is None else bars
+
+    def count(self, key, seconds):
+        # Bars started so far for a contract, the current bar included
+        rings = self._rings.get(key)
+        return 0 if rings is None else rings[seconds].count
+
+    def last_bar(self, key, seconds, ago=0):
+        # Bar ago bars before the current one, None if there is none
+        bars = self.bars(key, seconds, ago + 1)
+        return bars[0] if len(bars) == ago + 1 else None
+
+    def keys(self):
+        # tickerIds of all contracts with bars, including the ones whose market data line was released since
+        return tuple(self._rings)
+
+    def frame(self, key, seconds):
+        # All bars held for a contract, e.g. for the post-session analysis
+        rings = self._rings.get(key)
+        count = 0 if rings is None else len(rings[seconds].values)
+        frame = pd.DataFrame(self.bars(key, seconds, count), columns=BAR_COLUMNS)
+        frame['Start'] = pd.to_datetime(frame['Start'], unit='s', utc=True)
+        return frame
+
+    def table(self, seconds, symbols):
+        """
+        Bars of all contracts in one frame, e.g. to save them at the close.
+
+        Parameters:
+        - seconds (int): Timeframe, BAR_1S, BAR_1M or BAR_5M.
+        - symbols (dict): Symbol per tickerId.
+
+        Returns:
+        - pd.DataFrame: Symbol and tickerId followed by BAR_COLUMNS, one row per bar.
+        """
+        frames = []
+        for key in sorted(self._rings):
+            frame = self.frame(key, seconds)
+            frame.insert(0, 'TickerId', key)
+            frame.insert(0, 'Symbol', symbols.get(key))
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=['Symbol', 'TickerId'] + BAR_COLUMNS)
+        # Start without timezone, as Excel does not store it
+        table = pd.concat(frames, ignore_index=True)
+        table['Start'] = table['Start'].dt.tz_localize(None)
+        return table
+
+    def stats(self):
+        return {
+            'contracts': len(self._rings),
+            'ticks': self.ticks,
+            'bars started': self.bars_started,
+        }
@@ -0,0 +1,154 @@
+import collections
+
+import numpy as np
+
+from Utilities.MyQuoteBoard import BID_PRICE, ASK_PRICE, LAST_PRICE
+
+# Plan attributes mirrored into arrays - prices as float64, flags as bool
+PRICE_ATTRIBUTES = ('entry_price', 'stop_price', 'buy_limit_price', 'quantity', 'spread_at_execution',
+                    'profit_at_x_r')
+FLAG_ATTRIBUTES = ('open_position', 'crossed_buy_price', 'order_executed', 'order_filled', 'stop_undercut',
+                   'stock_sold', 'two_percent_above_buy_point', 'five_percent_above_buy_point', 'new_oca_bracket',
+                   'x_r_profits', 'add_and_reduce', 'add_and_reduce_executed')
+
+# Boolean array per predicate, one entry per row of the trading plan
+BatchSignals = collections.namedtuple('BatchSignals', ['crossing', 'entry_ready', 'stop_undercut',
+                                                       'sell_half_arming', 'sell_half_trigger', 'break_even_arming',
+                                                       'x_r_profits', 'add_and_reduce', 'action'])
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class BatchEvaluator:
+    """
+    Evaluates the price predicates of the entry and exit rules for all rows at once.
+
+    The plan attributes are mirrored into NumPy arrays which are refreshed only for the rows whose record changed.
+    evaluate() combines them with a quote board snapshot once per strategy cycle, so the cost of a cycle hardly grows
+    with the number of rows.
+    """
+
+    def __init__(self, positions, capacity=64):
+        self.n_rows = 0
+        self._prices = {name: np.full(capacity, np.nan) for name in PRICE_ATTRIBUTES}
+        self._flags = {name: np.zeros(capacity, dtype=bool) for name in FLAG_ATTRIBUTES}
+
+        # Counters
+        self.evaluations = 0
+        self.rows_with_action = 0
+
+        self.refresh(positions)
+
+    def _grow(self, n_rows):
+        capacity = max(n_rows, 2 * len(self._prices['entry_price']))
+
+        for name, array in self._prices.items():
+            grown = np.full(capacity, np.nan)
+            grown[:len(array)] = array
+            self._prices[name] = grown
+
+        for name, array in self._flags.items():
+            grown = np.zeros(capacity, dtype=bool)
+            grown[:len(array)] = array
+            self._flags[name] = grown
+
+    def refresh(self, positions, req_ids=None):
+        """
+        Copies the plan attributes of the given rows into the arrays.
+
+        Parameters:
+        - positions (list): PositionRecord per row of the trading plan.
+        - req_ids (iterable, optional): Rows whose record changed - all rows if None, e.g. after a plan reload.
+        """
+        if len(positions) > len(self._prices['entry_price']):
+            self._grow(len(positions))
+        self.n_rows = max(self.n_rows, len(positions))
+
+        if req_ids is None:
+            req_ids = range(len(positions))
+
+        for req_id in req_ids:
+            position = positions[req_id]
+            for name, array in self._prices.items():
+                array[req_id] = _as_float(getattr(position, name))
+            for name, array in self._flags.items():
+                array[req_id] = bool(getattr(position, name))
+
+    def evaluate(self, quotes, max_stock_spread, sell_half_reversal_rule, sell_full_reversal_rule, first_minute):
+        """
+        Computes every predicate for all rows in one pass over the arrays.
+
+        Parameters:
+        - quotes (np.ndarray): Quote board values, e.g. QuoteSnapshot.values.
+        - max_stock_spread (float): MAX_STOCK_SPREAD.
+        - sell_half_reversal_rule (float): SELL_HALF_REVERSAL_RULE.
+        - sell_full_reversal_rule (float): SELL_FULL_REVERSAL_RULE.
+        - first_minute (bool): True within the first minute of trading, when crossed rows may still enter.
+
+        Returns:
+        - BatchSignals: Boolean array per predicate, action marks rows for which any predicate is true.
+        """
+        n = min(self.n_rows, len(quotes))
+        p = {name: array[:n] for name, array in self._prices.items()}
+        f = {name: array[:n] for name, array in self._flags.items()}
+
+        last = quotes[:n, LAST_PRICE]
+        ask = quotes[:n, ASK_PRICE]
+        bid = quotes[:n, BID_PRICE]
+        entry = p['entry_price']
+
+        # NaN quotes compare as False, so rows without complete market data never need action
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spread = np.abs((ask - bid) / ask)
+            new_filled = ~f['open_position'] & f['order_filled']
+
+            crossing = (last > entry) & ~f['open_position'] & ~f['crossed_buy_price'] & ~f['order_executed']
+            if first_minute:
+                crossing |= f['crossed_buy_price'] & ~f['order_executed']
+
+            entry_ready = crossing & ~f['stop_undercut'] & (last < p['buy_limit_price']) & \
+                (spread < max_stock_spread)
+
+            stop_undercut = (last < p['stop_price']) & ~f['stop_undercut']
+
+            sell_half_arming = new_filled & ~f['two_percent_above_buy_point'] & \
+                (last > entry * (1 + sell_half_reversal_rule))
+
+            sell_half_trigger = new_filled & f['two_percent_above_buy_point'] & ~f['new_oca_bracket'] & \
+                ~f['stock_sold'] & ~f['five_percent_above_buy_point'] & \
+                (last <= entry * (1 + p['spread_at_execution'] / 100)) & (np.round(p['quantity']) > 1)
+
+            break_even_arming = new_filled & ~f['stock_sold'] & ~f['five_percent_above_buy_point'] & \
+                (last > entry * (1 + sell_full_reversal_rule))
+
+            x_r = p['profit_at_x_r']
+            x_r_price = (x_r * (entry - p['stop_price']) / entry + 1) * entry
+            x_r_profits = new_filled & ~f['stock_sold'] & ~f['x_r_profits'] & ~np.isnan(x_r) & \
+                ((x_r <= 0) | (x_r_price <= last))
+
+        add_and_reduce = f['add_and_reduce'] & ~f['add_and_reduce_executed'] & f['order_filled']
+
+        action = crossing | stop_undercut | sell_half_arming | sell_half_trigger | break_even_arming | \
+            x_r_profits | add_and_reduce
+
+        self.evaluations += 1
+        self.rows_with_action += int(action.sum())
+
+        return BatchSignals(crossing, entry_ready, stop_undercut, sell_half_arming, sell_half_trigger,
+                            break_even_arming, x_r_profits, add_and_reduce, action)
+
+    def needs_action(self, signals, req_id):
+        # Rows appended after the evaluation are always handed to the rules
+        return req_id >= len(signals.action) or bool(signals.action[req_id])
+
+    def stats(self):
+        return {
+            'batch evaluations': self.evaluations,
+            'rows with action': self.rows_with_action,
+            'rows': self.n_rows,
+        }
@@ -0,0 +1,59 @@
+import datetime
+import time
+
+import pytz
+
+
+class Clock:
+    """
+    Clock service for the tick hot path.
+
+    The timezone object is looked up once, the wall time is derived from a monotonic base (re-synchronised with the
+    system clock every minute) and strings are only formatted on demand, at most once per second and format.
+    """
+
+    RESYNC_SECONDS = 60
+
+    def __init__(self, timezone):
+        self.tz = pytz.timezone(timezone)
+        # (epoch, monotonic) taken together - replaced as one tuple so that no thread reads halves of two resyncs
+        self._base = (time.time(), time.monotonic())
+        self._formatted = {}
+
+    def resync(self):
+        self._base = (time.time(), time.monotonic())
+
+    def epoch(self):
+        # Seconds since 1970 as float
+        now = time.monotonic()
+        epoch_base, monotonic_base = self._base
+        if now - monotonic_base > self.RESYNC_SECONDS:
+            self.resync()
+            epoch_base, monotonic_base = self._base
+
+        return epoch_base + now - monotonic_base
+
+    def now(self):
+        # Timezone-aware datetime in the timezone of the traded market
+        return datetime.datetime.fromtimestamp(self.epoch(), self.tz)
+
+    def now_str(self, fmt="%H:%M:%S"):
+        second = int(self.epoch())
+        cached = self._formatted.get(fmt)
+
+        if cached is None or cached[0] != second:
+            cached = (second, datetime.datetime.fromtimestamp(second, self.tz).strftime(fmt))
+            self._formatted[fmt] = cached
+
+        return cached[1]
+
+    def localize(self, naive_datetime):
+        # Interprets a naive datetime as local time of the traded market
+        return self.tz.normalize(self.tz.localize(naive_datetime))
+
+    def from_epoch(self, epoch):
+        return datetime.datetime.fromtimestamp(epoch, self.tz)
+
+    @staticmethod
+    def to_epoch(aware_datetime):
+        return aware_datetime.timestamp()
@@ -0,0 +1,175 @@
+import math
+
+import pandas as pd
+
+# Order ID attributes of a PositionRecord and the role of the order within the row
+ORDER_ROLES = (
+    ('parent_order_id', 'parent'),
+    ('profit_order_id', 'profit'),
+    ('stop_order_id', 'stop'),
+    ('sell_on_close_order_id', 'sell on close'),
+    ('market_order_id', 'market'),
+)
+
+# Columns of the per-row fill table
+FILL_COLUMNS = ['Symbol', 'Bought', 'Avg. buy price', 'Sold', 'Avg. sell price', 'Fees', 'Realized PnL']
+
+
+def _is_set(value):
+    # TWS sends Double.MAX_VALUE for values it has not calculated yet (e.g. realized PnL of an opening fill)
+    return value is not None and not math.isnan(value) and abs(value) < 1e300
+
+
+class OrderFills:
+    """
+    Fills of one order of the trading plan.
+    """
+
+    __slots__ = ('order_id', 'req_id', 'role', 'shares', 'notional', 'fees', 'realized_pnl', 'quantity_before')
+
+    def __init__(self, order_id, req_id, role, quantity_before):
+        self.order_id = order_id
+        self.req_id = req_id
+        self.role = role
+        self.shares = 0.0
+        self.notional = 0.0
+        self.fees = 0.0
+        self.realized_pnl = 0.0
+        # Quantity of the row before the first fill of this order - a sell order leaves quantity_before - shares
+        self.quantity_before = quantity_before
+
+    @property
+    def avg_price(self):
+        return self.notional / self.shares if self.shares else 0.0
+
+
+class ExecutionLedger:
+    """
+    Fills of the orders of the trading plan, booked from execDetails and commissionAndFeesReport.
+
+    Executions are keyed by execId - a repeated execId is ignored, a correction (same execId with a higher last
+    number) replaces the execution it corrects. They are aggregated per orderId and per row, so that quantity,
+    average price, fees and realized PnL are known with each execution, independent of repeated or late orderStatus
+    messages.
+    """
+
+    def __init__(self):
+        self._executions = {}  # execId without correction number -> (execId, order_id, shares, price)
+        self._orders = {}
+        self._orders_by_row = {}
+        self._symbols = {}
+        self._pending_commissions = {}
+
+        # Counters
+        self.executions = 0
+        self.duplicates = 0
+        self.corrections = 0
+        self.commission_reports = 0
+
+    @staticmethod
+    def _base_exec_id(exec_id):
+        return exec_id.rsplit('.', 1)[0]
+
+    def book_execution(self, exec_id, order_id, position, role, shares, price):
+        """
+        Books one execution of an order of the trading plan.
+
+        Parameters:
+        - exec_id (str): execId of the execution.
+        - order_id (int): Order ID of the execution.
+        - position (PositionRecord): Row the order belongs to.
+        - role (str): Role of the order within the row, see ORDER_ROLES.
+        - shares (float): Shares of this execution.
+        - price (float): Price of this execution.
+
+        Returns:
+        - OrderFills: Fills of the order, None if the execution was already booked.
+        """
+        base = self._base_exec_id(exec_id)
+        previous = self._executions.get(base)
+
+        if previous is not None and previous[0] >= exec_id:
+            self.duplicates += 1
+            return None
+
+        fills = self._orders.get(order_id)
+        if fills is None:
+            fills = OrderFills(order_id, position.req_id, role, float(position.quantity or 0))
+            self._orders[order_id] = fills
+            self._orders_by_row.setdefault(position.req_id, []).append(fills)
+            self._symbols[position.req_id] = position.symbol
+
+        # A correction replaces the execution booked before
+        if previous is not None:
+            fills.shares -= previous[2]
+            fills.notional -= previous[2] * previous[3]
+            self.corrections += 1
+
+        fills.shares += shares
+        fills.notional += shares * price
+        self._executions[base] = (exec_id, order_id, shares, price)
+        self.executions += 1
+
+        # Commission report arrived before its execution
+        commission = self._pending_commissions.pop(exec_id, None)
+        if commission is not None:
+            self.book_commission(exec_id, *commission)
+
+        return fills
+
+    def book_commission(self, exec_id, fees, realized_pnl):
+        execution = self._executions.get(self._base_exec_id(exec_id))
+        if execution is None or execution[0] != exec_id:
+            self._pending_commissions[exec_id] = (fees, realized_pnl)
+            return
+
+        fills = self._orders[execution[1]]
+        if _is_set(fees):
+            fills.fees += fees
+        if _is_set(realized_pnl):
+            fills.realized_pnl += realized_pnl
+        self.commission_reports += 1
+
+    def filled(self, order_id):
+        # Shares booked for the order so far
+        fills = self._orders.get(order_id)
+        return 0.0 if fills is None else fills.shares
+
+    def row_summary(self, req_id):
+        """
+        Aggregates the fills of all orders of a row.
+
+        Parameters:
+        - req_id (int): Row of the trading plan.
+
+        Returns:
+        - dict: Row of the fill table, see FILL_COLUMNS.
+        """
+        orders = self._orders_by_row.get(req_id, ())
+        bought = [o for o in orders if o.role == 'parent']
+        sold = [o for o in orders if o.role != 'parent']
+        bought_shares = sum(o.shares for o in bought)
+        sold_shares = sum(o.shares for o in sold)
+
+        return {
+            'Symbol': self._symbols.get(req_id),
+            'Bought': bought_shares,
+            'Avg. buy price': sum(o.notional for o in bought) / bought_shares if bought_shares else None,
+            'Sold': sold_shares,
+            'Avg. sell price': sum(o.notional for o in sold) / sold_shares if sold_shares else None,
+            'Fees': sum(o.fees for o in orders),
+            'Realized PnL': sum(o.realized_pnl for o in orders),
+        }
+
+    def table(self):
+        rows = sorted(self._orders_by_row)
+        return pd.DataFrame([self.row_summary(req_id) for req_id in rows], index=rows, columns=FILL_COLUMNS)
+
+    def stats(self):
+        return {
+            'executions': self.executions,
+            'duplicates': self.duplicates,
+            'corrections': self.corrections,
+            'commission reports': self.commission_reports,
+            'orders': len(self._orders),
+        }
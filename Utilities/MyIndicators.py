@@ -0,0 +1,151 @@
+from Utilities.MyBars import BAR_1M, BAR_HIGH, BAR_LOW, BAR_CLOSE
+
+# Names of the indicators besides the EMAs ("EMA" + period)
+VWAP = 'VWAP'
+ATR = 'ATR'
+
+
+class IndicatorState:
+    """
+    Running values of the indicators of one contract.
+    """
+
+    __slots__ = ('price_volume', 'volume', 'last_price', 'sized', 'bars_seen', 'previous_close', 'atr', 'atr_bars',
+                 'emas')
+
+    def __init__(self, ema_periods):
+        self.price_volume = 0.0
+        self.volume = 0.0
+        self.last_price = None
+        self.sized = False  # Trades come with sizes (tick-by-tick), the VOLUME tick is ignored then
+        self.bars_seen = 0
+        self.previous_close = None
+        self.atr = None
+        self.atr_bars = 0
+        self.emas = dict.fromkeys(ema_periods)
+
+
+class IndicatorEngine:
+    """
+    Intraday VWAP, ATR and EMAs of every contract, updated with every trade.
+
+    VWAP sums price * size of the trades of the day. Without tick-by-tick sizes the changes of the day's VOLUME tick
+    are booked at the last trade price.
+
+    ATR and EMAs are updated once per closed bar of the bar aggregator (1-minute bars by default) - a trade only
+    checks whether the aggregator started a new bar. The ATR is the mean true range of the first bars and smoothed as
+    by Wilder from then on, the EMAs start from the first close.
+
+    Rules read the values by name ("VWAP", "ATR", "EMA9", ...) through value(), which is a dict lookup.
+    """
+
+    def __init__(self, bar_aggregator, ema_periods, atr_period, seconds=BAR_1M):
+        self.bar_aggregator = bar_aggregator
+        self.ema_periods = tuple(ema_periods)
+        self.atr_period = atr_period
+        self.seconds = seconds
+        self.names = (VWAP, ATR) + tuple(f"EMA{period}" for period in self.ema_periods)
+        self._states = {}
+
+        # Counters
+        self.trades = 0
+        self.bars_closed = 0
+
+    def _state_of(self, key):
+        state = self._states.get(key)
+        if state is None:
+            state = IndicatorState(self.ema_periods)
+            self._states[key] = state
+        return state
+
+    def feed_trade(self, key, price, size=0.0):
+        """
+        Updates the indicators of a contract with a trade, after the bar aggregator got it.
+
+        Parameters:
+        - key (int): tickerId of the contract.
+        - price (float): Price of the trade.
+        - size (float): Shares traded, 0 for LAST ticks without size.
+        """
+        if not price > 0:
+            return
+
+        state = self._state_of(key)
+        state.last_price = price
+        size = float(size)
+        if size:
+            state.sized = True
+            state.price_volume += price * size
+            state.volume += size
+        self.trades += 1
+
+        # A new bar closes the one before
+        bars_started = self.bar_aggregator.count(key, self.seconds)
+        if bars_started > state.bars_seen:
+            if state.bars_seen:
+                self._close_bar(state, self.bar_aggregator.last_bar(key, self.seconds, ago=1))
+            state.bars_seen = bars_started
+
+    def feed_volume(self, key, volume_change):
+        # Change of the day's VOLUME tick - booked at the last price if the trades come without sizes
+        state = self._states.get(key)
+        if state is None or state.sized or state.last_price is None or not volume_change > 0:
+            return
+
+        state.price_volume += state.last_price * volume_change
+        state.volume += volume_change
+
+    def _close_bar(self, state, bar):
+        if bar is None:
+            return
+
+        high, low, close = float(bar[BAR_HIGH]), float(bar[BAR_LOW]), float(bar[BAR_CLOSE])
+
+        # True range of the bar, Wilder smoothing
+        if state.previous_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - state.previous_close), abs(low - state.previous_close))
+        state.atr_bars += 1
+        period = min(state.atr_bars, self.atr_period)
+        state.atr = true_range if state.atr is None else state.atr + (true_range - state.atr) / period
+        state.previous_close = close
+
+        for period, ema in state.emas.items():
+            state.emas[period] = close if ema is None else ema + (close - ema) * 2 / (period + 1)
+
+        self.bars_closed += 1
+
+    def value(self, key, name):
+        """
+        Current value of an indicator of a contract.
+
+        Parameters:
+        - key (int): tickerId of the contract.
+        - name (str): "VWAP", "ATR" or "EMA" + period, see names.
+
+        Returns:
+        - float: Value of the indicator, None before enough data arrived.
+        """
+        state = self._states.get(key)
+        if state is None:
+            return None
+
+        if name == VWAP:
+            return state.price_volume / state.volume if state.volume else None
+        if name == ATR:
+            return state.atr
+        if name.startswith('EMA'):
+            return state.emas.get(int(name[3:]))
+        raise KeyError(f"Unknown indicator {name}")
+
+    def values(self, key):
+        # All indicators of a contract, e.g. for prints
+        return {name: self.value(key, name) for name in self.names}
+
+    def stats(self):
+        return {
+            'contracts': len(self._states),
+            'trades': self.trades,
+            'bars closed': self.bars_closed,
+        }
@@ -0,0 +1,122 @@
+import collections
+
+from Utilities.MyUtilities import MyUtilities
+
+# Phases of a row of the trading plan
+WAITING = 'waiting'
+CROSSED = 'crossed'
+ENTRY_SUBMITTED = 'entry submitted'
+FILLED = 'filled'  # Open position carried into the day, bracket not yet placed
+PROTECTED = 'protected'
+PARTIALLY_SOLD = 'partially sold'
+CLOSED = 'closed'
+
+# Rule blocks of evaluate_rules()
+OPEN_POSITION_BRACKET = 'open position bracket'
+STOP_UNDERCUT = 'stop undercut'
+ENTRY = 'entry'
+ADD_AND_REDUCE = 'add and reduce'
+SELL_HALF = 'sell half'
+BREAK_EVEN = 'break even'
+SELL_ON_CLOSE_SMA = 'sell on close SMA'
+BAD_CLOSE_CHECK = 'bad close'
+NEGATIVE_CLOSE_CHECK = 'negative close'
+X_R_PROFITS = 'x-R profits'
+
+# Bad close and negative close are also marked as checked for rows which are not filled at t-2min, so that a later
+# fill does not trigger them
+_CLOSE_CHECKS = frozenset((BAD_CLOSE_CHECK, NEGATIVE_CLOSE_CHECK))
+_EXIT_RULES = frozenset((STOP_UNDERCUT, ADD_AND_REDUCE, SELL_HALF, BREAK_EVEN, SELL_ON_CLOSE_SMA, X_R_PROFITS)) | \
+              _CLOSE_CHECKS
+
+# Rules registered per phase - all other rule blocks are skipped for rows in this phase
+PHASE_RULES = {
+    WAITING: frozenset((STOP_UNDERCUT, ENTRY)) | _CLOSE_CHECKS,
+    CROSSED: frozenset((STOP_UNDERCUT, ENTRY)) | _CLOSE_CHECKS,
+    ENTRY_SUBMITTED: _CLOSE_CHECKS,
+    FILLED: frozenset((OPEN_POSITION_BRACKET, STOP_UNDERCUT)) | _CLOSE_CHECKS,
+    PROTECTED: _EXIT_RULES,
+    PARTIALLY_SOLD: _EXIT_RULES,
+    CLOSED: frozenset(),
+}
+
+
+class RowLifecycle:
+    """
+    Phase of every row of the trading plan and the rule blocks applicable to it.
+
+    Phases are derived from the flags of the PositionRecords, which stay the persisted state, so that plan reloads and
+    restarts resume in the right phase. sync() is called wherever the flags change and counts every transition.
+    """
+
+    def __init__(self, positions):
+        self._phases = []
+        self.transitions = collections.Counter()
+        self.add_rows(positions)
+
+    @staticmethod
+    def derive_phase(position):
+        """
+        Maps the flags of a row to its phase.
+
+        Parameters:
+        - position (PositionRecord): Row of the trading plan.
+
+        Returns:
+        - str: Phase of the row.
+        """
+        if MyUtilities.is_row_finished(position):
+            return CLOSED
+
+        partially_sold = position.new_oca_bracket or position.bad_close_rule or position.x_r_profits
+
+        if position.open_position:
+            if not position.open_position_bracket_submitted:
+                return FILLED
+            return PARTIALLY_SOLD if partially_sold else PROTECTED
+
+        # The bracket of a new position protects it as soon as the parent order is filled
+        if position.order_filled:
+            return PARTIALLY_SOLD if partially_sold else PROTECTED
+
+        if position.order_executed:
+            return ENTRY_SUBMITTED
+
+        if position.crossed_buy_price:
+            return CROSSED
+
+        return WAITING
+
+    def add_rows(self, positions):
+        # Rows appended through a plan reload start in their derived phase
+        for req_id in range(len(self._phases), len(positions)):
+            self._phases.append(self.derive_phase(positions[req_id]))
+
+    def sync(self, positions, req_id):
+        phase = self.derive_phase(positions[req_id])
+        previous_phase = self._phases[req_id]
+
+        if phase != previous_phase:
+            self._phases[req_id] = phase
+            self.transitions[(previous_phase, phase)] += 1
+
+        return phase
+
+    def sync_all(self, positions):
+        self.add_rows(positions)
+        for req_id in range(len(self._phases)):
+            self.sync(positions, req_id)
+
+    def phase(self, req_id):
+        return self._phases[req_id]
+
+    def rules(self, req_id):
+        return PHASE_RULES[self._phases[req_id]]
+
+    def report(self):
+        lines = ["Phase transitions:"]
+        for (previous_phase, phase), count in sorted(self.transitions.items()):
+            lines.append(f"  {previous_phase} -> {phase}: {count}")
+
+        lines.append(f"Rows per phase: {dict(collections.Counter(self._phases))}")
+        return "\n".join(lines)
@@ -0,0 +1,154 @@
+import datetime
+import re
+
+# Boundary events of the trading day - the phase of the session is named after the last event passed
+PRE_OPEN = 'PRE_OPEN'
+OPEN = 'OPEN'
+FIRST_MINUTE_END = 'FIRST_MINUTE_END'  # End of the two-step entries
+FIRST_10_MINUTES_END = 'FIRST_10_MINUTES_END'  # End of the 50%-risk stop instead of the low of the day
+PAUSE_START = 'PAUSE_START'
+PAUSE_END = 'PAUSE_END'
+PLAN_FREEZE = 'PLAN_FREEZE'  # No DailyTradingPlan updates and no buys of "sell on close" stocks anymore
+SELL_ON_CLOSE = 'SELL_ON_CLOSE'  # SOC orders are removed for stocks above their SMA
+BAD_CLOSE = 'BAD_CLOSE'  # Bad close rule and sell negative on day 1
+CLOSE = 'CLOSE'
+SHUTDOWN = 'SHUTDOWN'
+
+# Phases in which the market is open
+OPEN_PHASES = frozenset((OPEN, FIRST_MINUTE_END, FIRST_10_MINUTES_END, PAUSE_END, PLAN_FREEZE, SELL_ON_CLOSE,
+                         BAD_CLOSE))
+
+
+class MarketSession:
+    """
+    Opening hours of the trading day, built once from contractDetails.liquidHours.
+
+    All boundaries are held as sorted epoch seconds. update() moves the session forward to the current time and
+    publishes every boundary passed since the last call as an event to the subscribed listeners. In between, phase
+    and passed() are answered from the cached position with O(1) work.
+    """
+
+    PLAN_FREEZE_MINUTES = 5
+    SELL_ON_CLOSE_MINUTES = 4
+    BAD_CLOSE_MINUTES = 2
+    SHUTDOWN_MINUTES = 3
+
+    def __init__(self, clock, opening, close, pause_start=None, pause_end=None):
+        self.clock = clock
+        self.opening = opening
+        self.close = close
+        self.pause_start = pause_start
+        self.pause_end = pause_end
+
+        boundaries = [
+            (opening, OPEN),
+            (opening + datetime.timedelta(minutes=1), FIRST_MINUTE_END),
+            (opening + datetime.timedelta(minutes=10), FIRST_10_MINUTES_END),
+            (close - datetime.timedelta(minutes=self.PLAN_FREEZE_MINUTES), PLAN_FREEZE),
+            (close - datetime.timedelta(minutes=self.SELL_ON_CLOSE_MINUTES), SELL_ON_CLOSE),
+            (close - datetime.timedelta(minutes=self.BAD_CLOSE_MINUTES), BAD_CLOSE),
+            (close, CLOSE),
+            (close + datetime.timedelta(minutes=self.SHUTDOWN_MINUTES), SHUTDOWN),
+        ]
+        if pause_start is not None and pause_end is not None:
+            boundaries += [(pause_start, PAUSE_START), (pause_end, PAUSE_END)]
+
+        boundaries = sorted((clock.to_epoch(moment), event) for moment, event in boundaries)
+        self._epochs = [epoch for epoch, _ in boundaries]
+        self._events = [event for _, event in boundaries]
+        self._position = {event: i for i, event in enumerate(self._events)}
+        self.epoch_of = dict(zip(self._events, self._epochs))
+
+        # Index of the last boundary passed, -1 before the open
+        self._index = -1
+        self._listeners = []
+
+    @classmethod
+    def from_liquid_hours(cls, clock, liquid_hours, index_open, index_close, has_pause):
+        """
+        Builds the session from the liquidHours string of the contract details.
+
+        Parameters:
+        - clock (Clock): Clock of the traded market.
+        - liquid_hours (str): contractDetails.liquidHours e.g. "20240102:0930-20240102:1600;...".
+        - index_open (int): Index of the market open in the split liquidHours.
+        - index_close (int): Index of the market close in the split liquidHours.
+        - has_pause (bool): True if the market pauses e.g. over lunch in Japan.
+
+        Returns:
+        - MarketSession
+        """
+        split_hours = re.split(";|-", liquid_hours)
+
+        def moment(index):
+            return clock.localize(datetime.datetime.strptime(split_hours[index], "%Y%m%d:%H%M"))
+
+        if has_pause:
+            return cls(clock, moment(index_open), moment(index_close), moment(index_open + 1), moment(index_close - 1))
+
+        return cls(clock, moment(index_open), moment(index_close))
+
+    @property
+    def opening_epoch(self):
+        return self.epoch_of[OPEN]
+
+    @property
+    def close_epoch(self):
+        return self.epoch_of[CLOSE]
+
+    def boundaries(self):
+        # (epoch, event) of every boundary in chronological order, e.g. to schedule timers
+        return list(zip(self._epochs, self._events))
+
+    def subscribe(self, listener):
+        # listener(event) is called after the session moved to its current phase
+        self._listeners.append(listener)
+
+    def update(self, now):
+        """
+        Moves the session forward to now and publishes the boundary events passed since the last call.
+
+        Parameters:
+        - now (float): Current epoch seconds.
+
+        Returns:
+        - str: Current phase.
+        """
+        index = self._index
+        if index + 1 < len(self._epochs) and now >= self._epochs[index + 1]:
+            while index + 1 < len(self._epochs) and now >= self._epochs[index + 1]:
+                index += 1
+
+            passed_events = self._events[self._index + 1:index + 1]
+            self._index = index
+
+            for event in passed_events:
+                for listener in self._listeners:
+                    listener(event)
+
+        return self.phase
+
+    @property
+    def phase(self):
+        return self._events[self._index] if self._index >= 0 else PRE_OPEN
+
+    def passed(self, event):
+        # False for events the session does not have, e.g. the pause of markets without one
+        position = self._position.get(event)
+        return position is not None and self._index >= position
+
+    def is_open(self):
+        return self.phase in OPEN_PHASES
+
+    def seconds_to_open(self, now):
+        # Seconds to the next (re-)opening of the market, negative once it is open
+        if self.pause_end is not None and now > self.opening_epoch:
+            return self.epoch_of[PAUSE_END] - now
+
+        return self.opening_epoch - now
+
+    def __str__(self):
+        if self.pause_start is not None:
+            return f"Opening: {self.opening} - Pause: {self.pause_start} - {self.pause_end} - Closing: {self.close}"
+
+        return f"Opening: {self.opening} - Closing: {self.close}"
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from ibapi import utils
+from ibapi.contract import Contract
+from ibapi.order import Order
+
+from Utilities.MyClock import Clock
+from Utilities.MyOrders import MyOrders
+from Utilities.MyPositionRecord import PositionRecord
+from Utilities.MyUtilities import MyUtilities
+
+
+def sample_position():
+    # Row of a new position without sell on close (bracket of three orders, no print per bracket)
+    position = PositionRecord(0, {})
+    position.symbol = "NVDA"
+    position.security_type = "STK"
+    position.currency = "USD"
+    position.exchange = "SMART"
+    position.primary_exchange = "NASDAQ"
+    position.buy_limit_price = 101.0
+    position.profit_taker_price = 125.0
+    position.stop_price = 95.0
+    position.quantity = 100
+    position.sell_on_close = False
+    return position
+
+
+def time_bracket_orders(position, clock, iterations):
+    """
+    Builds contract and entry bracket of a row like the entry rule does.
+
+    Parameters:
+    - position (PositionRecord): Row of the bracket.
+    - clock (Clock): Clock of the program.
+    - iterations (int): Number of brackets built.
+
+    Returns:
+    - float: Microseconds per order.
+    """
+    market_close = clock.now()
+    orders = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        MyUtilities.get_contract_details(position)
+        orders += len(MyOrders.bracket_order(i * 3, position, clock, "US/Eastern", market_close))
+    return (time.perf_counter() - start) / orders * 1e6
+
+
+def time_prebuilt_brackets(position, clock, iterations):
+    # Same as time_bracket_orders(), but with the brackets prebuilt as at plan load - only IDs and GTD are stamped
+    market_close = clock.now()
+    templates = [MyOrders.build_bracket(position, "US/Eastern", market_close) for _ in range(iterations)]
+    orders = 0
+    start = time.perf_counter()
+    for i, bracket_orders in enumerate(templates):
+        orders += len(MyOrders.stamp_bracket(bracket_orders, i * 3, position, clock, "US/Eastern"))
+    return (time.perf_counter() - start) / orders * 1e6
+
+
+def main(iterations=20000):
+    # Same log level as main.py
+    logging.getLogger().setLevel(logging.ERROR)
+
+    position = sample_position()
+    clock = Clock("America/New_York")
+    original = (Order.__setattr__, Contract.__setattr__)
+
+    # Warm-up, then production mode (plain attribute assignment)
+    time_bracket_orders(position, clock, 1000)
+    production = time_bracket_orders(position, clock, iterations)
+    prebuilt = time_prebuilt_brackets(position, clock, iterations)
+
+    # Debug mode as enabled by "python main.py --debug"
+    Order.__setattr__ = utils.setattr_log
+    Contract.__setattr__ = utils.setattr_log
+    try:
+        debug = time_bracket_orders(position, clock, iterations)
+    finally:
+        Order.__setattr__, Contract.__setattr__ = original
+
+    print(f"Order construction (incl. contract) per order: production {production:.1f} us, "
+          f"debug (setattr_log) {debug:.1f} us, {debug / production:.1f}x")
+    print(f"Prebuilt entry bracket, order IDs and GTD stamped at the entry, per order: {prebuilt:.1f} us")
+
+
+# Run through "python -m Utilities.MyOrderBenchmark"
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import itertools
+import threading
+import time
+import traceback
+
+# Priorities of the outgoing requests, lowest first
+PROTECTIVE = 0  # Cancels and sell orders (stops, profit takers, market sells)
+ENTRY = 1  # Buy orders and brackets
+MARKET_DATA = 2  # Market data requests and cancels
+PRIORITY_NAMES = {PROTECTIVE: 'protective', ENTRY: 'entry', MARKET_DATA: 'market data'}
+
+
+class Batch:
+    """
+    Requests sent back to back, e.g. the parent and children of a bracket order.
+    """
+
+    __slots__ = ('priority', 'sequence', 'messages', 'order_ids', 'queued')
+
+    def __init__(self, priority, sequence, messages, order_ids, queued):
+        self.priority = priority
+        self.sequence = sequence
+        self.messages = messages  # List of (function, args)
+        self.order_ids = order_ids
+        self.queued = queued
+
+
+class OrderGateway:
+    """
+    Paces all orders and market data requests to TWS, which rejects more than 50 messages per second.
+
+    Requests are queued by priority (protective orders and cancels, then entries, then market data) and sent by the
+    gateway thread as long as the token bucket allows - tokens refill at messages_per_second up to burst. A batch
+    (parent and children of a bracket) is sent as a whole, nothing is sent in between.
+
+    TWS only accepts new order IDs above the highest one it has seen. A batch with new order IDs is therefore never
+    sent ahead of a queued batch with lower new order IDs - that batch is sent first, whatever its priority.
+    Modifies (order IDs already sent) and cancels are not held back.
+    """
+
+    def __init__(self, messages_per_second, burst):
+        self.messages_per_second = messages_per_second
+        self.burst = burst
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._tokens = burst
+        self._refilled = time.monotonic()
+        self._max_order_id_sent = -1
+        self._running = False
+        self._thread = None
+
+        # Counters
+        self.messages_sent = 0
+        self.batches_sent = 0
+        self.promotions = 0
+        self.max_depth = 0
+        self._wait_sum = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self._wait_max = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self._batches = dict.fromkeys(PRIORITY_NAMES, 0)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        # Sends what is queued (e.g. the cancels at shutdown) before the thread ends
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, priority, messages, order_ids=()):
+        """
+        Queues requests to be sent back to back.
+
+        Parameters:
+        - priority (int): PROTECTIVE, ENTRY or MARKET_DATA.
+        - messages (list): (function, args) per request, e.g. (EClient.placeOrder of the app, (orderId, contract, order)).
+        - order_ids (tuple): Order IDs placed by the batch.
+        """
+        with self._condition:
+            batch = Batch(priority, next(self._sequence), messages, tuple(order_ids), time.monotonic())
+            self._queue.append(batch)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._condition.notify()
+
+    def _new_order_id(self, batch):
+        # Lowest order ID of the batch TWS has not seen yet, None if there is none
+        new_ids = [order_id for order_id in batch.order_ids if order_id > self._max_order_id_sent]
+        return min(new_ids) if new_ids else None
+
+    def _next_batch(self):
+        # Highest priority first, in the order of submission
+        batch = min(self._queue, key=lambda b: (b.priority, b.sequence))
+
+        # Queued batches with lower new order IDs go first
+        new_id = self._new_order_id(batch)
+        if new_id is not None:
+            earlier = [(self._new_order_id(b), b.sequence, b) for b in self._queue if b is not batch]
+            earlier = [entry for entry in earlier if entry[0] is not None and entry[0] < new_id]
+            if earlier:
+                batch = min(earlier, key=lambda entry: entry[:2])[2]
+                self.promotions += 1
+
+        return batch
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.messages_per_second)
+        self._refilled = now
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch = None
+                while batch is None:
+                    if not self._queue:
+                        if not self._running:
+                            return
+                        self._condition.wait()
+                        continue
+
+                    # A batch larger than the bucket waits for a full bucket and borrows the rest
+                    candidate = self._next_batch()
+                    self._refill()
+                    needed = min(len(candidate.messages), self.burst)
+                    if self._tokens < needed:
+                        self._condition.wait((needed - self._tokens) / self.messages_per_second)
+                        continue
+
+                    batch = candidate
+                    self._queue.remove(batch)
+                    self._tokens -= len(batch.messages)
+                    if batch.order_ids:
+                        self._max_order_id_sent = max(self._max_order_id_sent, max(batch.order_ids))
+
+            wait = time.monotonic() - batch.queued
+            self._wait_sum[batch.priority] += wait
+            self._wait_max[batch.priority] = max(self._wait_max[batch.priority], wait)
+            self._batches[batch.priority] += 1
+
+            # Sends outside the lock so that other threads can queue meanwhile
+            for function, args in batch.messages:
+                try:
+                    function(*args)
+                except Exception:
+                    traceback.print_exc()
+
+            self.messages_sent += len(batch.messages)
+            self.batches_sent += 1
+
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        stats = {
+            'messages sent': self.messages_sent,
+            'batches sent': self.batches_sent,
+            'queue depth': self.depth(),
+            'max. queue depth': self.max_depth,
+            'promotions': self.promotions,
+        }
+        for priority, name in PRIORITY_NAMES.items():
+            batches = self._batches[priority]
+            stats[f'{name} avg. wait [ms]'] = round(self._wait_sum[priority] / batches * 1000, 1) if batches else None
+            stats[f'{name} max. wait [ms]'] = round(self._wait_max[priority] * 1000, 1)
+        return stats
@@ -1,90 +1,381 @@
 # Add imports if needed
 from ibapi.order import Order
+from ibapi.order_cancel import OrderCancel
 
+import copy
 import datetime
-import pytz
+
+from Utilities.MyExecutionLedger import ORDER_ROLES
+
+# Order ID attributes of a PositionRecord in the order of ORDER_ROLES
+ORDER_ID_ATTRIBUTES = tuple(attribute for attribute, _ in ORDER_ROLES)
+
+
+class OrderIndex:
+    """
+    Row and role of every order ID of the trading plan, so that a status or execution of an order is one lookup
+    instead of a scan of all rows per order ID attribute.
+
+    IDs are indexed as MyOrders assigns them and when rows are loaded from the plan (IDs of earlier sessions).
+    Reassigning an attribute (e.g. a new OCA bracket) removes the ID it held before. One ID can hold several roles of
+    the same row (a market order replacing the stop). IDs of no row of the plan (e.g. orders placed manually in TWS)
+    are counted.
+    """
+
+    def __init__(self):
+        self._orders = {}  # order ID -> (PositionRecord, order ID attributes in the order of ORDER_ROLES)
+        self._rows = 0
+
+        # Counters
+        self.lookups = 0
+        self.unknown = 0
+
+    @staticmethod
+    def _is_order_id(order_id):
+        # Empty cells of the plan are None or NaN
+        return order_id is not None and order_id == order_id and order_id != ''
+
+    def add_rows(self, positions):
+        # Rows loaded from the plan at start and appended through a plan reload
+        for req_id in range(self._rows, len(positions)):
+            for attribute in ORDER_ID_ATTRIBUTES:
+                self._add(positions[req_id], attribute, getattr(positions[req_id], attribute))
+        self._rows = max(self._rows, len(positions))
+
+    def _add(self, position, attribute, order_id):
+        if not self._is_order_id(order_id):
+            return
+
+        entry = self._orders.get(order_id)
+        attributes = entry[1] if entry is not None and entry[0] is position else ()
+        self._orders[order_id] = (position, tuple(a for a in ORDER_ID_ATTRIBUTES
+                                                  if a in attributes or a == attribute))
+
+    def _remove(self, position, attribute, order_id):
+        entry = self._orders.get(order_id)
+        if entry is None or entry[0] is not position:
+            return
+
+        attributes = tuple(a for a in entry[1] if a != attribute)
+        if attributes:
+            self._orders[order_id] = (position, attributes)
+        else:
+            del self._orders[order_id]
+
+    def assign(self, position, attribute, order_id):
+        """
+        Sets an order ID attribute of a row and indexes it.
+
+        Parameters:
+        - position (PositionRecord): Row of the order.
+        - attribute (str): Order ID attribute, see ORDER_ID_ATTRIBUTES.
+        - order_id (int): Order ID.
+        """
+        self._remove(position, attribute, getattr(position, attribute))
+        setattr(position, attribute, order_id)
+        self._add(position, attribute, order_id)
+
+    def lookup(self, order_id):
+        """
+        Row and order ID attributes of an order.
+
+        Parameters:
+        - order_id (int): Order ID of a status or execution.
+
+        Returns:
+        - tuple: (PositionRecord, attributes), (None, ()) for orders of no row of the plan.
+        """
+        self.lookups += 1
+        entry = self._orders.get(order_id)
+        if entry is None:
+            self.unknown += 1
+            return None, ()
+        return entry
+
+    def stats(self):
+        return {
+            'order ids': len(self._orders),
+            'lookups': self.lookups,
+            'unknown': self.unknown,
+        }
+
+
+class ProtectiveOrders:
+    """
+    Profit taker, stop loss and SOC order last sent per row, so that a change of prices or size re-sends them with
+    their order IDs (modify) instead of cancelling them and placing a new OCA group.
+
+    A modify only re-sends the orders whose price or quantity changed. The group is replaced (cancel and new OCA) if
+    its structure changed: the SOC order is added or removed, one of its orders is done or partially filled, or the
+    order IDs of the row were reassigned. Messages sent per adjustment are counted for both paths.
+    """
+
+    # Orders in these states can no longer be modified
+    DONE = ("Filled", "Cancelled", "ApiCancelled", "Inactive", "PendingCancel")
+
+    def __init__(self):
+        self._orders = {}  # reqId -> {'profit': Order, 'stop': Order, 'sell on close': Order}
+        self._status = {}  # order ID -> (status, filled)
+
+        # Counters
+        self.amends = 0
+        self.amend_messages = 0
+        self.replacements = 0
+        self.replace_messages = 0
+
+    def register(self, position, profit_order, stop_order, sell_on_close_order=None):
+        orders = {'profit': profit_order, 'stop': stop_order}
+        if sell_on_close_order is not None:
+            orders['sell on close'] = sell_on_close_order
+        self._orders[position.req_id] = orders
+
+    def update_status(self, order_id, status, filled):
+        # Called with every orderStatus
+        self._status[order_id] = (status, float(filled))
+
+    def _modifiable(self, position, orders):
+        if orders is None or ('sell on close' in orders) != bool(position.sell_on_close):
+            return False
+        if orders['profit'].orderId != position.profit_order_id or orders['stop'].orderId != position.stop_order_id:
+            return False
+
+        for order in orders.values():
+            status = self._status.get(order.orderId)
+            if status is not None and (status[0] in self.DONE or status[1] > 0):
+                return False
+        return True
+
+    def amend(self, position, total_quantity, lmt_price, aux_price):
+        """
+        Modified copies of the protective orders of a row.
+
+        Parameters:
+        - position (PositionRecord): Row of the orders.
+        - total_quantity (float): New quantity of all orders.
+        - lmt_price (float): New limit price of the profit taker.
+        - aux_price (float): New stop price.
+
+        Returns:
+        - list: Orders to re-send with placeOrder (only the changed ones), None if the group must be replaced.
+        """
+        orders = self._orders.get(position.req_id)
+        if not self._modifiable(position, orders):
+            return None
+
+        changed = []
+        amended = {}
+        for role, order in orders.items():
+            new = copy.copy(order)
+            new.totalQuantity = int(total_quantity)
+            if role == 'profit':
+                new.lmtPrice = float(lmt_price)
+            elif role == 'stop':
+                new.auxPrice = float(aux_price)
+
+            if (new.totalQuantity, new.lmtPrice, new.auxPrice) != \
+                    (order.totalQuantity, order.lmtPrice, order.auxPrice):
+                # Children of a bracket were sent with transmit = False
+                new.transmit = True
+                changed.append(new)
+            amended[role] = new
+
+        self._orders[position.req_id] = amended
+        return changed
+
+    def count(self, amended, messages):
+        if amended:
+            self.amends += 1
+            self.amend_messages += messages
+        else:
+            self.replacements += 1
+            self.replace_messages += messages
+
+    def stats(self):
+        return {
+            'amends': self.amends,
+            'messages per amend': round(self.amend_messages / self.amends, 1) if self.amends else None,
+            'replacements': self.replacements,
+            'messages per replacement':
+                round(self.replace_messages / self.replacements, 1) if self.replacements else None,
+        }
+
+
+class EntryTemplates:
+    """
+    Entry brackets of the rows waiting for their entry, built when the plan is loaded or reloaded.
+
+    At the breakout only the order IDs and the GTD of the parent are set (MyOrders.stamp_bracket()). A template is
+    keyed by the prices, quantity and sell on close of its row - if they changed since (e.g. stop at the low of the
+    day resizing the entry), the bracket is built at the entry as before. A template is used once.
+    """
+
+    def __init__(self):
+        self._templates = {}  # reqId -> (signature, orders)
+
+        # Counters
+        self.prepared = 0
+        self.used = 0
+        self.stale = 0
+
+    @staticmethod
+    def signature(position, ib_timezone_str, market_close):
+        return (position.buy_limit_price, position.profit_taker_price, position.stop_price, position.quantity,
+                bool(position.sell_on_close), ib_timezone_str, market_close)
+
+    def prepare(self, position, ib_timezone_str, market_close):
+        signature = self.signature(position, ib_timezone_str, market_close)
+        template = self._templates.get(position.req_id)
+        if template is not None and template[0] == signature:
+            return
+
+        # Rows with incomplete prices or quantity are left to the entry, as before
+        try:
+            orders = MyOrders.build_bracket(position, ib_timezone_str, market_close)
+        except (TypeError, ValueError):
+            self._templates.pop(position.req_id, None)
+            return
+
+        self._templates[position.req_id] = (signature, orders)
+        self.prepared += 1
+
+    def discard(self, req_id):
+        self._templates.pop(req_id, None)
+
+    def take(self, position, ib_timezone_str, market_close):
+        """
+        Hands over the prebuilt bracket of a row.
+
+        Returns:
+        - list: Orders without order IDs and GTD, None if there is no template or the row changed since.
+        """
+        template = self._templates.pop(position.req_id, None)
+        if template is None:
+            return None
+        if template[0] != self.signature(position, ib_timezone_str, market_close):
+            self.stale += 1
+            return None
+
+        self.used += 1
+        return template[1]
+
+    def stats(self):
+        return {
+            'prepared': self.prepared,
+            'used': self.used,
+            'stale': self.stale,
+            'pending': len(self._templates),
+        }
 
 
 class MyOrders:
 
+    # Order IDs of all rows, updated by the order functions below
+    order_index = OrderIndex()
+
+    # Protective orders last sent per row, for modifies in place
+    protective_orders = ProtectiveOrders()
+
+    # Entry brackets prebuilt per waiting row
+    entry_templates = EntryTemplates()
+
+    @staticmethod
+    def bracket_order(parent_order_id, position, clock, ib_timezone_str, market_close):
+        # Uses the bracket prebuilt for the row when the plan was loaded, unless its prices or quantity changed since
+        bracket_orders = MyOrders.entry_templates.take(position, ib_timezone_str, market_close)
+        if bracket_orders is None:
+            bracket_orders = MyOrders.build_bracket(position, ib_timezone_str, market_close)
+
+        return MyOrders.stamp_bracket(bracket_orders, parent_order_id, position, clock, ib_timezone_str)
+
     @staticmethod
-    def bracket_order(parent_order_id, req_id, timezone, ib_timezone_str, market_close, io_list):
+    def build_bracket(position, ib_timezone_str, market_close):
+        # Orders of the entry bracket without order IDs and GTD, which are only known at the entry
 
         # Create Parent Order / Initial Entry
         parent = Order()
-        parent.orderId = parent_order_id
         parent.orderType = "LMT"
         parent.action = "BUY"
         parent.tif = "GTD"
-        # Order cancelled in 1 minute from now if it does not get filled
-        # I want to avoid that price runs away and fills when it comes back in - this would not be directional
-        parent.goodTillDate = \
-            (datetime.datetime.now().astimezone(pytz.timezone(timezone)) + datetime.timedelta(minutes=1)) \
-                .strftime("%Y%m%d %H:%M:%S " + ib_timezone_str)
-        parent.lmtPrice = float(round(io_list['Buy limit price [$]'][req_id], 2))
-        parent.totalQuantity = int(round(io_list['Quantity [#]'][req_id], 0))
+        parent.lmtPrice = float(round(position.buy_limit_price, 2))
+        parent.totalQuantity = int(round(position.quantity, 0))
         parent.transmit = False
 
         # Profit Target
         profit_target_order = Order()
-        profit_target_order.orderId = parent_order_id + 1
         profit_target_order.orderType = "LMT"
         profit_target_order.action = "SELL"
         profit_target_order.tif = "GTC"
-        profit_target_order.totalQuantity = int(round(io_list['Quantity [#]'][req_id], 0))
-        profit_target_order.lmtPrice = float(round(io_list['Profit taker price [$]'][req_id], 2))
-        profit_target_order.parentId = parent_order_id
+        profit_target_order.totalQuantity = int(round(position.quantity, 0))
+        profit_target_order.lmtPrice = float(round(position.profit_taker_price, 2))
         profit_target_order.transmit = False
 
         # Stop Loss
         stop_loss_order = Order()
-        stop_loss_order.orderId = parent_order_id + 2
         stop_loss_order.orderType = "STP"
         stop_loss_order.action = "SELL"
         stop_loss_order.tif = "GTC"
-        stop_loss_order.totalQuantity = int(round(io_list['Quantity [#]'][req_id], 0))
-        stop_loss_order.auxPrice = float(round(io_list['Stop price [$]'][req_id], 2))
-        stop_loss_order.parentId = parent_order_id
+        stop_loss_order.totalQuantity = int(round(position.quantity, 0))
+        stop_loss_order.auxPrice = float(round(position.stop_price, 2))
         stop_loss_order.transmit = True
 
-        if io_list['Sell on close'][req_id]:
+        if position.sell_on_close:
             # Market on close order if "sell on close" (faked MOC order since it did not execute in OCA)
             market_on_close_order = Order()
-            market_on_close_order.orderId = parent_order_id + 3
             market_on_close_order.orderType = "MKT"
             market_on_close_order.action = "SELL"
             market_on_close_order.tif = "DAY"
             market_on_close_order.goodAfterTime = \
                 (market_close - datetime.timedelta(minutes=3)).strftime("%Y%m%d %H:%M:%S " + ib_timezone_str)
-            market_on_close_order.totalQuantity = int(round(io_list['Quantity [#]'][req_id], 0))
-            market_on_close_order.parentId = parent_order_id
+            market_on_close_order.totalQuantity = int(round(position.quantity, 0))
             market_on_close_order.transmit = True
             # Only the very last child of the array is allowed to be .transmit = True
             stop_loss_order.transmit = False
 
-            bracket_orders = [parent, profit_target_order, stop_loss_order, market_on_close_order]
+            return [parent, profit_target_order, stop_loss_order, market_on_close_order]
 
-            print("\nStock ID:", req_id, io_list['Symbol'][req_id],
+        return [parent, profit_target_order, stop_loss_order]
+
+    @staticmethod
+    def stamp_bracket(bracket_orders, parent_order_id, position, clock, ib_timezone_str):
+        # Sets order IDs and GTD of the bracket at the entry
+        parent = bracket_orders[0]
+        parent.orderId = parent_order_id
+        # Order cancelled in 1 minute from now if it does not get filled
+        # I want to avoid that price runs away and fills when it comes back in - this would not be directional
+        parent.goodTillDate = \
+            (clock.now() + datetime.timedelta(minutes=1)) \
+                .strftime("%Y%m%d %H:%M:%S " + ib_timezone_str)
+
+        for offset, child in enumerate(bracket_orders[1:], 1):
+            child.orderId = parent_order_id + offset
+            child.parentId = parent_order_id
+
+        MyOrders.protective_orders.register(position, *bracket_orders[1:])
+
+        if len(bracket_orders) == 4:
+            print("\nStock ID:", position.req_id, position.symbol,
                   "- Sell on close OCA bracket defined. (",
-                  datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
+                  clock.now_str(), ")")
 
             # Reporting
-            io_list.loc[req_id, 'sellOnCloseOrderId'] = parent_order_id + 3
-
-        else:
-            bracket_orders = [parent, profit_target_order, stop_loss_order]
+            MyOrders.order_index.assign(position, 'sell_on_close_order_id', parent_order_id + 3)
 
         # Reporting
-        io_list.loc[req_id, 'parentOrderId'] = parent_order_id
-        io_list.loc[req_id, 'profitOrderId'] = parent_order_id + 1
-        io_list.loc[req_id, 'stopOrderId'] = parent_order_id + 2
+        MyOrders.order_index.assign(position, 'parent_order_id', parent_order_id)
+        MyOrders.order_index.assign(position, 'profit_order_id', parent_order_id + 1)
+        MyOrders.order_index.assign(position, 'stop_order_id', parent_order_id + 2)
+
+        return bracket_orders
 
-        return bracket_orders, io_list
+    @staticmethod
+    def prepare_bracket(position, ib_timezone_str, market_close):
+        # Prebuilds the entry bracket of a row waiting for its entry (only rebuilt if its prices or quantity changed)
+        MyOrders.entry_templates.prepare(position, ib_timezone_str, market_close)
 
     # This is technically not a bracket order, it is an OCA order
     @staticmethod
-    def one_cancels_all(order_id, total_quantity, lmt_price, aux_price, req_id, timezone, ib_timezone_str, market_close,
-                        io_list):
+    def one_cancels_all(order_id, total_quantity, lmt_price, aux_price, position, clock, ib_timezone_str,
+                        market_close):
 
         # Profit Target
         profit_target_order = Order()
@@ -108,7 +399,7 @@ class MyOrders:
         stop_loss_order.ocaGroup = "OCA_" + str(order_id)
         stop_loss_order.ocaType = 2
 
-        if io_list['Sell on close'][req_id]:
+        if position.sell_on_close:
             # Market on close order if "sell on close" - fake MOC (see above)
             market_on_close_order = Order()
             market_on_close_order.orderId = order_id + 2
@@ -122,28 +413,73 @@ class MyOrders:
             market_on_close_order.ocaType = 2
 
             oca = [profit_target_order, stop_loss_order, market_on_close_order]
+            MyOrders.protective_orders.register(position, profit_target_order, stop_loss_order,
+                                                market_on_close_order)
 
-            print("\nStock ID:", req_id, io_list['Symbol'][req_id],
+            print("\nStock ID:", position.req_id, position.symbol,
                   "- Sell on close OCA bracket defined. (",
-                  datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
+                  clock.now_str(), ")")
 
             # Reporting & deletion of previous status
-            io_list.loc[req_id, 'sellOnCloseOrderId'] = order_id + 2
-            io_list.loc[req_id, 'SOC order filled'] = False
+            MyOrders.order_index.assign(position, 'sell_on_close_order_id', order_id + 2)
+            position.soc_order_filled = False
 
         else:
             oca = [profit_target_order, stop_loss_order]
+            MyOrders.protective_orders.register(position, profit_target_order, stop_loss_order)
 
         # Reporting & deletion of previous status
-        io_list.loc[req_id, 'profitOrderId'] = order_id
-        io_list.loc[req_id, 'Profit order filled'] = False
-        io_list.loc[req_id, 'stopOrderId'] = order_id + 1
-        io_list.loc[req_id, 'Stop order filled'] = False
+        MyOrders.order_index.assign(position, 'profit_order_id', order_id)
+        position.profit_order_filled = False
+        MyOrders.order_index.assign(position, 'stop_order_id', order_id + 1)
+        position.stop_order_filled = False
+
+        return oca
+
+    @staticmethod
+    def adjust_one_cancels_all(app, contract, total_quantity, lmt_price, aux_price, position, clock, ib_timezone_str,
+                               market_close):
+        """
+        Moves the profit taker and stop loss of a row to new prices and size.
+
+        The orders are modified in place if only prices or size change, otherwise the current group is cancelled and
+        a new OCA group is placed.
+
+        Parameters:
+        - app (TestApp): Client to send the orders with.
+        - contract (Contract): Contract of the row.
+        - total_quantity (float): Quantity to protect.
+        - lmt_price (float): Limit price of the profit taker.
+        - aux_price (float): Stop price.
+        - position (PositionRecord): Row of the orders.
+
+        Returns:
+        - int: Messages sent to TWS for the adjustment.
+        """
+        amended = MyOrders.protective_orders.amend(position, total_quantity, lmt_price, aux_price)
+
+        if amended is not None:
+            for o in amended:
+                app.placeOrder(o.orderId, contract, o)
+            messages = len(amended)
+
+        else:
+            # Cancel current bracket order - the other orders of the group are cancelled with it
+            app.cancelOrder(int(position.profit_order_id), OrderCancel())
+
+            # Place new OCA profit taker and stop loss
+            oca = MyOrders.one_cancels_all(app.nextOrderId(), total_quantity, lmt_price, aux_price, position, clock,
+                                           ib_timezone_str, market_close)
+            for o in oca:
+                app.placeOrder(o.orderId, contract, o)
+                app.nextOrderId()
+            messages = 1 + len(oca)
 
-        return oca, io_list
+        MyOrders.protective_orders.count(amended is not None, messages)
+        return messages
 
     @staticmethod
-    def sell_market_order(order_id, req_id, total_quantity, io_list):
+    def sell_market_order(order_id, position, total_quantity):
         # Create Parent Order / Initial Entry
         order = Order()
         order.orderId = order_id
@@ -152,6 +488,6 @@ class MyOrders:
         order.totalQuantity = int(total_quantity)
 
         # Reporting
-        io_list.loc[req_id, 'marketOrderId'] = order_id
+        MyOrders.order_index.assign(position, 'market_order_id', order_id)
 
-        return order, io_list
+        return order
@@ -0,0 +1,109 @@
+import itertools
+import math
+
+import pandas as pd
+
+# Columns of the per-position PnL table
+PNL_COLUMNS = ['Symbol', 'Currency', 'Position', 'DailyPnL', 'UnrealizedPnL', 'RealizedPnL', 'Value', 'Updated']
+
+
+def _is_set(value):
+    # TWS sends Double.MAX_VALUE for values it has not calculated yet
+    return value is not None and not math.isnan(value) and abs(value) < 1e300
+
+
+class PnLTable:
+    """
+    Real-time PnL of the account (reqPnL) and of every position held (reqPnLSingle, one per conId).
+
+    The account stream updates about once per second and drives the max. daily loss check, where the account updates
+    of TWS only arrive every few minutes. Positions are subscribed as reqPositions reports them, so that new fills of
+    the day are covered as well.
+
+    The reqIds are shifted by the offsets below, so that they never collide with the reqIds of the rows and of the
+    tick-by-tick streams.
+    """
+
+    ACCOUNT_REQ_ID = 300000
+    SINGLE_OFFSET = 300001
+
+    def __init__(self):
+        self._req_id_by_con_id = {}
+        self._rows = {}
+        self._next_req_id = itertools.count(self.SINGLE_OFFSET)
+
+        self.daily_pnl = None
+        self.unrealized_pnl = None
+        self.realized_pnl = None
+
+        # Counters
+        self.account_updates = 0
+        self.position_updates = 0
+
+    def subscribe(self, con_id, symbol, currency):
+        """
+        Registers a position for reqPnLSingle.
+
+        Parameters:
+        - con_id (int): conId of the contract.
+        - symbol (str): Symbol of the contract.
+        - currency (str): Currency of the contract.
+
+        Returns:
+        - int: reqId to request reqPnLSingle with, None if the contract is already subscribed.
+        """
+        if con_id in self._req_id_by_con_id:
+            return None
+
+        req_id = next(self._next_req_id)
+        self._req_id_by_con_id[con_id] = req_id
+        self._rows[req_id] = dict.fromkeys(PNL_COLUMNS)
+        self._rows[req_id].update({'Symbol': symbol, 'Currency': currency})
+        return req_id
+
+    def req_ids(self):
+        return tuple(self._req_id_by_con_id.values())
+
+    def update_account(self, daily_pnl, unrealized_pnl, realized_pnl):
+        """
+        Stores a reqPnL update.
+
+        Returns:
+        - bool: True if realized and unrealized PnL are both calculated by TWS.
+        """
+        if not (_is_set(unrealized_pnl) and _is_set(realized_pnl)):
+            return False
+
+        self.daily_pnl = daily_pnl if _is_set(daily_pnl) else None
+        self.unrealized_pnl = unrealized_pnl
+        self.realized_pnl = realized_pnl
+        self.account_updates += 1
+        return True
+
+    def is_live(self):
+        # True once reqPnL delivered - the PnL of the account updates is outdated from then on
+        return self.account_updates > 0
+
+    def update_position(self, req_id, position, daily_pnl, unrealized_pnl, realized_pnl, value, time_str):
+        row = self._rows.get(req_id)
+        if row is None:
+            return
+
+        row['Position'] = float(position)
+        row['DailyPnL'] = daily_pnl if _is_set(daily_pnl) else None
+        row['UnrealizedPnL'] = unrealized_pnl if _is_set(unrealized_pnl) else None
+        row['RealizedPnL'] = realized_pnl if _is_set(realized_pnl) else None
+        row['Value'] = value if _is_set(value) else None
+        row['Updated'] = time_str
+        self.position_updates += 1
+
+    def table(self):
+        # Copy of the rows - other threads only read this frame
+        return pd.DataFrame(list(self._rows.values()), columns=PNL_COLUMNS)
+
+    def stats(self):
+        return {
+            'positions': len(self._rows),
+            'account updates': self.account_updates,
+            'position updates': self.position_updates,
+        }
@@ -0,0 +1,171 @@
+import pandas as pd
+
+# io_list columns and the attributes of PositionRecord holding them (same order as in DailyTradingPlan)
+COLUMN_ATTRIBUTES = (
+    ('Symbol', 'symbol'),
+    ('Company name', 'company_name'),
+    ('Security Type', 'security_type'),
+    ('Currency', 'currency'),
+    ('Exchange', 'exchange'),
+    ('Primary Exchange', 'primary_exchange'),
+    ('Entry price [$]', 'entry_price'),
+    ('Stop price [$]', 'stop_price'),
+    ('Quantity [#]', 'quantity'),
+    ('Buy limit price [$]', 'buy_limit_price'),
+    ('Profit taker price [$]', 'profit_taker_price'),
+    ('Open position', 'open_position'),
+    ('Add and reduce', 'add_and_reduce'),
+    ('Sell on close', 'sell_on_close'),
+    ('Stop low of day', 'stop_low_of_day'),
+    ('Sell bellow SMA [$]', 'sell_below_sma'),
+    ('Sell negative on day 1', 'sell_negative_on_day_1'),
+    ('Profit at x-R', 'profit_at_x_r'),
+    ('Stop undercut [time]', 'stop_undercut_time'),
+    ('Stop undercut', 'stop_undercut'),
+    ('Crossed buy price [time]', 'crossed_buy_price_time'),
+    ('Crossed buy price', 'crossed_buy_price'),
+    ('Order executed [time]', 'order_executed_time'),
+    ('Order executed', 'order_executed'),
+    ('parentOrderId', 'parent_order_id'),
+    ('Order filled', 'order_filled'),
+    ('profitOrderId', 'profit_order_id'),
+    ('Profit order filled', 'profit_order_filled'),
+    ('stopOrderId', 'stop_order_id'),
+    ('Stop order filled', 'stop_order_filled'),
+    ('sellOnCloseOrderId', 'sell_on_close_order_id'),
+    ('SOC order filled', 'soc_order_filled'),
+    ('marketOrderId', 'market_order_id'),
+    ('Market order filled', 'market_order_filled'),
+    ('Market sell price [$]', 'market_sell_price'),
+    ('Spread at execution [%]', 'spread_at_execution'),
+    ('Quantity [#] at open', 'quantity_at_open'),
+    ('2% above buy point', 'two_percent_above_buy_point'),
+    ('New OCA bracket [time]', 'new_oca_bracket_time'),
+    ('New OCA bracket', 'new_oca_bracket'),
+    ('5% above buy point [time]', 'five_percent_above_buy_point_time'),
+    ('5% above buy point', 'five_percent_above_buy_point'),
+    ('Bad close rule [time]', 'bad_close_rule_time'),
+    ('Bad close rule', 'bad_close_rule'),
+    ('x-R profits [time]', 'x_r_profits_time'),
+    ('x-R profits', 'x_r_profits'),
+    ('Stock sold [time]', 'stock_sold_time'),
+    ('Stock sold', 'stock_sold'),
+    ('Spread above limit', 'spread_above_limit'),
+    ('Price above limit', 'price_above_limit'),
+    ('Stock looped', 'stock_looped'),
+    ('Open position bracket submitted', 'open_position_bracket_submitted'),
+    ('Add and reduce executed', 'add_and_reduce_executed'),
+    ('Open position updated', 'open_position_updated'),
+    ('Open position updated [time]', 'open_position_updated_time'),
+    ('New position updated', 'new_position_updated'),
+    ('New position updated [time]', 'new_position_updated_time'),
+    ('New position added', 'new_position_added'),
+    ('New position added [time]', 'new_position_added_time'),
+    ('Stop timestamp', 'stop_timestamp'),
+    ('Last stop price', 'last_stop_price'),
+    ('Invest limit reached [time]', 'invest_limit_reached_time'),
+    ('Invest limit reached', 'invest_limit_reached'),
+    ('Position below limit', 'position_below_limit'),
+    ('Max. daily loss reached [time]', 'max_daily_loss_reached_time'),
+    ('Max. daily loss reached', 'max_daily_loss_reached'),
+    ('LAST price [$]', 'last_price'),
+    ('BID price [$]', 'bid_price'),
+    ('ASK price [$]', 'ask_price'),
+    ('BID size', 'bid_size'),
+    ('ASK size', 'ask_size'),
+    ('HIGH price [$]', 'high_price'),
+    ('LOW price [$]', 'low_price'),
+    ('CLOSE price [$]', 'close_price'),
+    ('Volume', 'volume'),
+    ('MAX_STOCK_SPREAD', 'param_max_stock_spread'),
+    ('SELL_HALF_REVERSAL_RULE', 'param_sell_half_reversal_rule'),
+    ('SELL_FULL_REVERSAL_RULE', 'param_sell_full_reversal_rule'),
+    ('BAD_CLOSE_RULE', 'param_bad_close_rule'),
+    ('MAX_ALLOWED_DAILY_PNL_LOSS', 'param_max_allowed_daily_pnl_loss'),
+    ('MIN_POSITION_SIZE', 'param_min_position_size'),
+    ('Bad close checked', 'bad_close_checked'),
+    ('Negative close checked', 'negative_close_checked'),
+    ('liquidHours', 'liquid_hours'),
+    ('timeZoneId', 'time_zone_id'),
+    ('local opening time', 'local_opening_time'),
+    ('local closing time', 'local_closing_time'),
+)
+
+ATTRIBUTE_BY_COLUMN = dict(COLUMN_ATTRIBUTES)
+
+
+class PositionRecord:
+    """
+    One row of io_list with plain attribute access for the rule hot path.
+
+    The records are the live trading plan. io_list is only built from them when the plan is saved, see to_io_list().
+    Columns unknown to COLUMN_ATTRIBUTES are carried along in extra, so that the conversion stays lossless.
+    """
+
+    __slots__ = ('req_id', 'extra') + tuple(attribute for _, attribute in COLUMN_ATTRIBUTES)
+
+    def __init__(self, req_id, row):
+        self.req_id = req_id
+        self.extra = {}
+
+        for column, value in row.items():
+            attribute = ATTRIBUTE_BY_COLUMN.get(column)
+            if attribute is None:
+                self.extra[column] = value
+            else:
+                setattr(self, attribute, value)
+
+        # Columns missing in an older DailyTradingPlan
+        for _, attribute in COLUMN_ATTRIBUTES:
+            if not hasattr(self, attribute):
+                setattr(self, attribute, None)
+
+    @classmethod
+    def from_io_list(cls, io_list):
+        """
+        Converts io_list into one record per row.
+
+        Parameters:
+        - io_list (pd.DataFrame): Trading plan as read from DailyTradingPlan.
+
+        Returns:
+        - list: PositionRecord per row, the position in the list is the reqId.
+        """
+        return [cls(req_id, row) for req_id, row in enumerate(io_list.to_dict('records'))]
+
+    @staticmethod
+    def to_io_list(records, template):
+        """
+        Converts the records back into io_list, e.g. before the trading plan is saved as Excel.
+
+        Parameters:
+        - records (list): PositionRecord per row.
+        - template (pd.DataFrame): io_list as loaded (or any slice of it) - gives column order, dtypes and index name.
+
+        Returns:
+        - pd.DataFrame: Trading plan with the columns of the template.
+        """
+        io_list = pd.DataFrame([record.to_dict() for record in records], columns=template.columns)
+        io_list.index.name = template.index.name
+
+        # Columns keep their dtype as long as the values still fit (e.g. no NaN in an integer column)
+        for column, dtype in template.dtypes.items():
+            try:
+                io_list[column] = io_list[column].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+
+        return io_list
+
+    def to_dict(self):
+        row = {column: getattr(self, attribute) for column, attribute in COLUMN_ATTRIBUTES}
+        row.update(self.extra)
+        return row
+
+    def get(self, column):
+        # Access by io_list column name, e.g. for generic comparisons during a plan reload
+        attribute = ATTRIBUTE_BY_COLUMN.get(column)
+        return self.extra.get(column) if attribute is None else getattr(self, attribute)
+
+    def __repr__(self):
+        return f"PositionRecord({self.req_id}, {self.symbol})"
@@ -0,0 +1,244 @@
+from ibapi.ticktype import TickTypeEnum
+
+import collections
+import time
+
+import numpy as np
+
+# Column positions of the quote board - rows are the reqIds (= index of io_list)
+BID_PRICE = 0
+ASK_PRICE = 1
+LAST_PRICE = 2
+HIGH_PRICE = 3
+LOW_PRICE = 4
+CLOSE_PRICE = 5
+BID_SIZE = 6
+ASK_SIZE = 7
+VOLUME = 8
+
+# io_list columns the quote board is materialised into when the outputs are saved (same order as above)
+QUOTE_COLUMNS = ['BID price [$]', 'ASK price [$]', 'LAST price [$]', 'HIGH price [$]', 'LOW price [$]',
+                 'CLOSE price [$]', 'BID size', 'ASK size', 'Volume']
+
+# Integer dispatch tables from ibapi tickType to quote board column
+PRICE_TICK_COLUMNS = {
+    TickTypeEnum.BID: BID_PRICE,
+    TickTypeEnum.ASK: ASK_PRICE,
+    TickTypeEnum.LAST: LAST_PRICE,
+    TickTypeEnum.HIGH: HIGH_PRICE,
+    TickTypeEnum.LOW: LOW_PRICE,
+    TickTypeEnum.CLOSE: CLOSE_PRICE,
+}
+
+SIZE_TICK_COLUMNS = {
+    TickTypeEnum.BID_SIZE: BID_SIZE,
+    TickTypeEnum.ASK_SIZE: ASK_SIZE,
+    TickTypeEnum.VOLUME: VOLUME,
+}
+
+# Price tickTypes which are taken from the tick-by-tick stream instead while it is active
+TICK_BY_TICK_TYPES = frozenset((TickTypeEnum.BID, TickTypeEnum.ASK, TickTypeEnum.LAST))
+
+
+# Immutable view of the quote board at one consistent moment, handed to reader threads (recorder, prints, status)
+QuoteSnapshot = collections.namedtuple('QuoteSnapshot', ['version', 'timestamp', 'values', 'symbols',
+                                                         'open_positions', 'recorded'])
+
+
+class QuoteBoard:
+    """
+    Preallocated NumPy array holding the latest market data of every io_list row.
+
+    The tick callbacks only write single floats into the array, rules read them back through get(). The board is
+    only turned into io_list columns by materialise() when the outputs are saved.
+
+    Every write bumps the version twice (odd while writing, even when done), so that reader threads can take a
+    consistent snapshot() without any lock. This needs a single writer: the thread running the message loop of the
+    app (tick callbacks). The rare writes of other threads (new rows, released subscriptions, session events) are
+    queued and applied by that thread with its next message, see apply_commands().
+    """
+
+    def __init__(self, positions, capacity=64):
+        self.n_rows = 0
+        self.version = 0
+        self._values = np.full((max(capacity, len(positions)), len(QUOTE_COLUMNS)), np.nan)
+
+        # Row labels needed by the readers - tuples are rebuilt on append so snapshots can share them
+        self._symbols = ()
+        self._open_positions = ()
+        self._recorded = ()
+        self._snapshot = None
+
+        # Writes of other threads as (function, args), applied in order by the writer thread
+        self._commands = collections.deque()
+
+        # Board is not shared yet
+        self._add_rows(self._labels(positions))
+
+    @staticmethod
+    def _labels(positions):
+        # Taken when the write is queued - the rows may change until it is applied
+        return tuple((str(position.symbol), bool(position.open_position)) for position in positions)
+
+    def add_rows(self, positions):
+        """
+        Grows the board and its row labels when new rows are appended to the trading plan through a plan reload.
+
+        Parameters:
+        - positions (list): PositionRecord per row including the newly appended rows.
+        """
+        if len(positions) > self.n_rows:
+            self._commands.append((self._add_rows, (self._labels(positions),)))
+
+    def set_recorded(self, req_id, recorded):
+        # Rows whose market data subscription is released are no longer recorded
+        self._commands.append((self._set_recorded, (req_id, recorded)))
+
+    def copy_row(self, from_req_id, to_req_id):
+        # Used when a new row shares the market data subscription of an existing row
+        self._commands.append((self._copy_row, (from_req_id, to_req_id)))
+
+    def clear(self, columns):
+        self._commands.append((self._clear, (columns,)))
+
+    def apply_commands(self):
+        # Called by the writer thread only (tick callbacks and message loop of the app)
+        while self._commands:
+            function, args = self._commands.popleft()
+            function(*args)
+
+    def _add_rows(self, labels):
+        n_rows = len(labels)
+        if n_rows <= self.n_rows:
+            return
+
+        self.version += 1
+
+        if n_rows > len(self._values):
+            values = np.full((max(n_rows, 2 * len(self._values)), len(QUOTE_COLUMNS)), np.nan)
+            values[:len(self._values)] = self._values
+            self._values = values
+
+        new_labels = labels[self.n_rows:]
+        self._symbols = self._symbols + tuple(symbol for symbol, _ in new_labels)
+        self._open_positions = self._open_positions + tuple(open_position for _, open_position in new_labels)
+        self._recorded = self._recorded + (True,) * len(new_labels)
+
+        self.n_rows = n_rows
+        self.version += 1
+
+    def _set_recorded(self, req_id, recorded):
+        self.version += 1
+        self._recorded = self._recorded[:req_id] + (recorded,) + self._recorded[req_id + 1:]
+        self.version += 1
+
+    def _copy_row(self, from_req_id, to_req_id):
+        self.version += 1
+        self._values[to_req_id] = self._values[from_req_id]
+        self.version += 1
+
+    def _clear(self, columns):
+        self.version += 1
+        self._values[:self.n_rows, columns] = np.nan
+        self.version += 1
+
+    def feed_price(self, req_id, tick_type, price):
+        if self._commands:
+            self.apply_commands()
+
+        column = PRICE_TICK_COLUMNS.get(tick_type)
+        if column is None or req_id >= self.n_rows:
+            return False
+
+        price = round(price, 2)
+        current = self._values[req_id, column]
+
+        # HIGH and LOW only move outwards, all other prices are overwritten
+        if column == HIGH_PRICE and current >= price:
+            return False
+        if column == LOW_PRICE and current <= price:
+            return False
+
+        self.version += 1
+        self._values[req_id, column] = price
+        self.version += 1
+        return True
+
+    def feed_size(self, req_id, tick_type, size):
+        if self._commands:
+            self.apply_commands()
+
+        column = SIZE_TICK_COLUMNS.get(tick_type)
+        if column is None or req_id >= self.n_rows:
+            return False
+
+        self.version += 1
+        self._values[req_id, column] = float(size)
+        self.version += 1
+        return True
+
+    def get(self, req_id, column):
+        return self._values[req_id, column]
+
+    def row(self, req_id):
+        return self._values[req_id]
+
+    def is_complete(self, req_id, columns):
+        # True if none of the given columns is still NaN for this row (False for rows not on the board yet)
+        return req_id < self.n_rows and not np.isnan(self._values[req_id, columns]).any()
+
+    def snapshot(self, max_attempts=100):
+        """
+        Returns a read-only copy of the quote board taken at one consistent moment.
+
+        The copy is only taken if the version changed since the last snapshot, otherwise the previous snapshot is
+        handed out again. A copy overlapping a write is repeated until one does not.
+
+        Parameters:
+        - max_attempts (int): Copies tried back to back, the reader yields to the writer between further attempts.
+
+        Returns:
+        - QuoteSnapshot: Version, epoch timestamp, quote values and row labels.
+        """
+        snapshot = self._snapshot
+        attempts = 0
+
+        while True:
+            version = self.version
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+
+            # Odd version means a write is in progress
+            if not version % 2:
+                n_rows = self.n_rows
+                symbols, open_positions, recorded = self._symbols, self._open_positions, self._recorded
+                values = self._values[:n_rows].copy()
+                if self.version == version:
+                    break
+
+            attempts += 1
+            if attempts >= max_attempts:
+                time.sleep(0.001)
+
+        values.flags.writeable = False
+        snapshot = QuoteSnapshot(version, time.time(), values, symbols, open_positions, recorded)
+        self._snapshot = snapshot
+
+        return snapshot
+
+    def materialise(self, io_list):
+        """
+        Writes the quote board into a copy of io_list, e.g. before the trading plan is saved as Excel.
+
+        Parameters:
+        - io_list (pd.DataFrame): Trading plan the quotes belong to.
+
+        Returns:
+        - pd.DataFrame: Copy of io_list including the latest quotes.
+        """
+        values = self.snapshot().values
+        io_list_out = io_list.copy()
+        n_rows = min(len(io_list_out), len(values))
+        io_list_out.loc[io_list_out.index[:n_rows], QUOTE_COLUMNS] = values[:n_rows]
+
+        return io_list_out
@@ -0,0 +1,187 @@
+import math
+import threading
+
+from Utilities.MySymbolIndex import SymbolIndex
+
+
+def _as_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+class RiskLedger:
+    """
+    Exposure and risk of the trading plan, kept as running totals for the daily investment limit.
+
+    Every row contributes its exposure (entry price * quantity of held rows, in account currency) and, for new
+    positions filled today, its risk ((entry - stop) * quantity at open). sync() replaces the contribution of one row
+    on fills, partial sells and stop moves, so the sizing of an entry is a lookup of the totals.
+
+    The %-invested of TWS (GrossPositionValue) is taken as baseline at every account update and moved by the exposure
+    changed since, so it stays current between account updates.
+
+    Entries submitted but not filled yet reserve their exposure and risk, so that a burst of entries at the open does
+    not size each of them against the same stale totals. The reservation shrinks with the fills and is released on
+    cancel or GTD expiry.
+    """
+
+    def __init__(self, positions, exr_rate):
+        self.exr_rate = exr_rate
+        self._exposure = []
+        self._risk = []
+        self.exposure = 0.0
+        self.new_risk = 0.0
+
+        # Reservations of entries in flight: reqId -> [quantity, exposure per share, risk per share]
+        self._reservations = {}
+        self._ordered = {}  # reqId -> quantity of the entry order, the reservation is this minus the shares filled
+        self._lock = threading.Lock()  # Reservations are also released by the scheduler thread (GTD expiry)
+        self.reserved_exposure = 0.0
+        self.reserved_risk = 0.0
+
+        # Baseline of the last account update
+        self._account_exposure = None
+        self._exposure_at_account = 0.0
+
+        # Counters
+        self.row_updates = 0
+        self.reservations = 0
+        self.releases = 0
+
+        self.add_rows(positions)
+
+    def row_exposure(self, position):
+        if not SymbolIndex.is_held(position):
+            return 0.0
+        return _as_float(position.entry_price) / self.exr_rate * _as_float(position.quantity)
+
+    @staticmethod
+    def row_risk(position):
+        # Risk taken today by new, filled positions ("Open position" == False, "Order filled" == True)
+        if position.open_position or not position.order_filled:
+            return 0.0
+        return (_as_float(position.entry_price) - _as_float(position.stop_price)) * \
+            _as_float(position.quantity_at_open)
+
+    def add_rows(self, positions):
+        # Rows appended through a plan reload
+        for req_id in range(len(self._exposure), len(positions)):
+            self._exposure.append(0.0)
+            self._risk.append(0.0)
+            self.sync(positions, req_id)
+
+    def sync(self, positions, req_id):
+        position = positions[req_id]
+        exposure = self.row_exposure(position)
+        risk = self.row_risk(position)
+
+        if exposure != self._exposure[req_id] or risk != self._risk[req_id]:
+            self.exposure += exposure - self._exposure[req_id]
+            self.new_risk += risk - self._risk[req_id]
+            self._exposure[req_id] = exposure
+            self._risk[req_id] = risk
+            self.row_updates += 1
+
+        # Fills take over the reservation - the risk of the row already counts its full quantity at open. The
+        # remaining quantity is always taken from the entry order, never from the reservation, and it only shrinks
+        # (sells of the filled shares do not bring the reservation back)
+        if position.order_filled and req_id in self._reservations:
+            with self._lock:
+                reservation = self._reservations.get(req_id)
+                if reservation is not None:
+                    remaining = self._ordered[req_id] - _as_float(position.quantity)
+                    if remaining <= 0:
+                        self._set_reservation(req_id, None)
+                    elif remaining < reservation[0] or reservation[2]:
+                        self._set_reservation(req_id, [min(remaining, reservation[0]), reservation[1], 0.0])
+
+    def sync_all(self, positions):
+        self.add_rows(positions)
+        for req_id in range(len(self._exposure)):
+            self.sync(positions, req_id)
+
+        # Sums again from the rows, so that no rounding error builds up over the day
+        self.exposure = math.fsum(self._exposure)
+        self.new_risk = math.fsum(self._risk)
+
+    def reserve(self, position):
+        """
+        Reserves exposure and risk of an entry order at its submission.
+
+        Parameters:
+        - position (PositionRecord): Row whose bracket order was placed.
+        """
+        reservation = [_as_float(position.quantity), _as_float(position.entry_price) / self.exr_rate,
+                       _as_float(position.entry_price) - _as_float(position.stop_price)]
+
+        with self._lock:
+            self._set_reservation(position.req_id, reservation)
+            self._ordered[position.req_id] = reservation[0]
+            self.reservations += 1
+
+    def release(self, req_id):
+        # Entry cancelled or expired - what was filled meanwhile is counted by the row itself
+        with self._lock:
+            if req_id in self._reservations:
+                self._set_reservation(req_id, None)
+                self.releases += 1
+
+    def _set_reservation(self, req_id, reservation):
+        previous = self._reservations.pop(req_id, None)
+        if reservation is None:
+            self._ordered.pop(req_id, None)
+        if previous is not None:
+            self.reserved_exposure -= previous[0] * previous[1]
+            self.reserved_risk -= previous[0] * previous[2]
+
+        if reservation is not None:
+            self._reservations[req_id] = reservation
+            self.reserved_exposure += reservation[0] * reservation[1]
+            self.reserved_risk += reservation[0] * reservation[2]
+
+        # No rounding residue once nothing is in flight
+        if not self._reservations:
+            self.reserved_exposure = 0.0
+            self.reserved_risk = 0.0
+
+    def is_reserved(self, req_id):
+        return req_id in self._reservations
+
+    @property
+    def risk_in_use(self):
+        # New risk of filled positions and of entries in flight
+        return self.new_risk + self.reserved_risk
+
+    def sync_account(self, gross_position_value):
+        # Called with every GrossPositionValue of TWS
+        self._account_exposure = gross_position_value
+        self._exposure_at_account = self.exposure
+
+    def percent_invested(self, portfolio_size):
+        """
+        %-invested of the portfolio including the fills since the last account update and the entries in flight.
+
+        Parameters:
+        - portfolio_size (float): NetLiquidation of the last account update.
+
+        Returns:
+        - float: Share of the portfolio invested, None before the first account update.
+        """
+        if self._account_exposure is None or not portfolio_size:
+            return None
+        return (self._account_exposure + self.exposure - self._exposure_at_account + self.reserved_exposure) / \
+            portfolio_size
+
+    def stats(self):
+        return {
+            'exposure': round(self.exposure, 0),
+            'new risk': round(self.new_risk, 0),
+            'reserved exposure': round(self.reserved_exposure, 0),
+            'reserved risk': round(self.reserved_risk, 0),
+            'row updates': self.row_updates,
+            'reservations': self.reservations,
+            'releases': self.releases,
+        }
@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import threading
+import traceback
+
+
+class Scheduler:
+    """
+    Timer heap worked off by its own thread, so that time-based rules fire at their deadline even if no tick arrives.
+
+    Timers can be given a key. Scheduling a key again replaces its pending timer, cancelled or replaced entries stay in
+    the heap and are skipped when they come up.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._heap = []
+        self._sequence = itertools.count()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Counters
+        self.timers_fired = 0
+        self.max_delay = 0.0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def call_at(self, epoch, action, *args, key=None):
+        """
+        Schedules action(*args) to run on the scheduler thread once the clock reaches epoch.
+
+        Parameters:
+        - epoch (float): Deadline in epoch seconds.
+        - action (callable): Function to be called.
+        - key (hashable, optional): Identifies the timer - a pending timer with the same key is replaced.
+
+        Returns:
+        - hashable: Key of the timer.
+        """
+        with self._condition:
+            if key is None:
+                key = ('timer', next(self._sequence))
+
+            # Same deadline for the same key - nothing to do, e.g. when every tick re-arms the same timer
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] == epoch:
+                return key
+
+            entry = [epoch, next(self._sequence), key, action, args]
+            self._pending[key] = entry
+            heapq.heappush(self._heap, entry)
+
+            # Wakes the thread if the new timer is the next one due
+            if self._heap[0] is entry:
+                self._condition.notify()
+
+        return key
+
+    def call_later(self, seconds, action, *args, key=None):
+        return self.call_at(self.clock.epoch() + seconds, action, *args, key=key)
+
+    def cancel(self, key):
+        with self._condition:
+            self._pending.pop(key, None)
+
+    def is_scheduled(self, key):
+        return key in self._pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                entry = None
+                while self._running and entry is None:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    epoch, _, key, _, _ = self._heap[0]
+
+                    # Replaced or cancelled timers are dropped here
+                    if self._pending.get(key) is not self._heap[0]:
+                        heapq.heappop(self._heap)
+                        continue
+
+                    delay = epoch - self.clock.epoch()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+
+                    entry = heapq.heappop(self._heap)
+                    del self._pending[key]
+
+                if not self._running:
+                    return
+
+            self.timers_fired += 1
+            self.max_delay = max(self.max_delay, self.clock.epoch() - entry[0])
+
+            # Runs outside the lock so that actions can schedule follow-up timers
+            try:
+                entry[3](*entry[4])
+            except Exception:
+                traceback.print_exc()
+
+    def stats(self):
+        return {
+            'timers fired': self.timers_fired,
+            'timers pending': len(self._pending),
+            'max. delay [s]': round(self.max_delay, 3),
+        }
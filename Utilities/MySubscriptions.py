@@ -0,0 +1,186 @@
+import heapq
+import itertools
+
+
+class MarketDataSubscriptions:
+    """
+    Keeps one reqMktData subscription per contract and maps its tickerId to all io_list rows trading it.
+
+    The tickerId of a subscription is the row index (reqId) of the first row referencing the contract, so that it
+    never collides with the reqIds of other rows.
+
+    Rows which can no longer act are finished: their ticks no longer trigger any rule and the subscription is
+    cancelled as soon as no row needs it anymore. Rows exceeding the account's market data lines wait in a priority
+    queue until a line is released.
+
+    Contracts with rows waiting for their entry can additionally be streamed through reqTickByTickData (Last and
+    BidAsk), whose reqIds are the tickerId shifted by the offsets below. Each contract takes two of the account's
+    tick-by-tick streams.
+    """
+
+    LAST_OFFSET = 100000
+    BID_ASK_OFFSET = 200000
+    STREAMS_PER_CONTRACT = 2
+
+    def __init__(self, max_lines, max_tick_by_tick=0):
+        self.max_lines = max_lines
+        self.max_tick_by_tick = max_tick_by_tick
+        self._ticker_by_contract = {}
+        self._contract_by_ticker = {}
+        # Tuples are replaced on every change, so the tick callbacks can read them without a lock
+        self._rows_by_ticker = {}
+        self._ticker_by_row = {}
+        self._active_rows = set()
+        self._finished_rows = set()
+        self._tick_by_tick = set()
+
+        # Rows waiting for a free line - (priority, sequence, req_id, contract)
+        self._pending = []
+        self._pending_sequence = itertools.count()
+
+        # Counters
+        self.lines_cancelled = 0
+        self.max_lines_used = 0
+
+    @staticmethod
+    def contract_key(contract):
+        return contract.symbol, contract.secType, contract.currency, contract.exchange, contract.primaryExch
+
+    def add_row(self, req_id, contract, priority=1):
+        """
+        Maps an io_list row to the subscription of its contract.
+
+        Parameters:
+        - req_id (int): Index of the row in io_list.
+        - contract (Contract): Contract of the row as given by MyUtilities.get_contract_details().
+        - priority (int): Lower values are subscribed first when all market data lines are in use.
+
+        Returns:
+        - tuple: tickerId of the subscription (None if the row is queued) and True if reqMktData must be called.
+        """
+        key = self.contract_key(contract)
+        ticker_id = self._ticker_by_contract.get(key)
+        is_new = ticker_id is None
+
+        if is_new:
+            if len(self._rows_by_ticker) >= self.max_lines:
+                heapq.heappush(self._pending, (priority, next(self._pending_sequence), req_id, contract))
+                return None, False
+
+            ticker_id = req_id
+            self._ticker_by_contract[key] = ticker_id
+            self._contract_by_ticker[ticker_id] = contract
+            self._rows_by_ticker[ticker_id] = ()
+            self.max_lines_used = max(self.max_lines_used, len(self._rows_by_ticker))
+
+        if req_id not in self._rows_by_ticker[ticker_id]:
+            self._rows_by_ticker[ticker_id] = self._rows_by_ticker[ticker_id] + (req_id,)
+        self._ticker_by_row[req_id] = ticker_id
+        self._active_rows.add(req_id)
+        # A finished row can become active again through an update of the DailyTradingPlan
+        self._finished_rows.discard(req_id)
+
+        return ticker_id, is_new
+
+    def finish_row(self, req_id, keep_stream=False):
+        """
+        Stops the rule evaluation for a row and releases its share of the subscription.
+
+        Parameters:
+        - req_id (int): Index of the row in io_list.
+        - keep_stream (bool): True if the quotes shall still be received e.g. for the recorder.
+
+        Returns:
+        - int or None: tickerId to be cancelled through cancelMktData(), None if the line is still needed.
+        """
+        if req_id in self._finished_rows:
+            return None
+
+        self._finished_rows.add(req_id)
+        self._active_rows.discard(req_id)
+
+        ticker_id = self._ticker_by_row.get(req_id)
+        if ticker_id is None or keep_stream:
+            return None
+
+        rows = tuple(row for row in self._rows_by_ticker[ticker_id] if row != req_id)
+        self._rows_by_ticker[ticker_id] = rows
+        del self._ticker_by_row[req_id]
+
+        if rows:
+            return None
+
+        # No row needs the contract anymore - the line can be released
+        contract = self._contract_by_ticker.pop(ticker_id)
+        del self._ticker_by_contract[self.contract_key(contract)]
+        del self._rows_by_ticker[ticker_id]
+        self.lines_cancelled += 1
+
+        return ticker_id
+
+    def pop_pending(self):
+        # Next queued row if a line is free, otherwise None
+        while self._pending and len(self._rows_by_ticker) < self.max_lines:
+            _, _, req_id, contract = heapq.heappop(self._pending)
+            if req_id not in self._finished_rows:
+                return req_id, contract
+
+        return None
+
+    def start_tick_by_tick(self, ticker_id):
+        # True if reqTickByTickData must be called for this tickerId
+        if ticker_id is None or ticker_id in self._tick_by_tick or ticker_id not in self._rows_by_ticker or \
+                not self.has_free_tick_by_tick():
+            return False
+
+        self._tick_by_tick.add(ticker_id)
+        return True
+
+    def stop_tick_by_tick(self, ticker_id):
+        # True if cancelTickByTickData must be called for this tickerId
+        if ticker_id not in self._tick_by_tick:
+            return False
+
+        self._tick_by_tick.discard(ticker_id)
+        return True
+
+    def has_free_tick_by_tick(self):
+        # Streams left for one more contract
+        return self.STREAMS_PER_CONTRACT * (len(self._tick_by_tick) + 1) <= self.max_tick_by_tick
+
+    def has_tick_by_tick(self, ticker_id):
+        return ticker_id in self._tick_by_tick
+
+    def ticker_id_of_tick_by_tick(self, req_id):
+        return req_id - self.BID_ASK_OFFSET if req_id >= self.BID_ASK_OFFSET else req_id - self.LAST_OFFSET
+
+    def rows(self, ticker_id):
+        # Fan-out of a tick to every row referencing the contract
+        return self._rows_by_ticker.get(ticker_id, ())
+
+    def is_active(self, req_id):
+        return req_id in self._active_rows
+
+    def active_rows(self):
+        return tuple(self._active_rows)
+
+    def is_finished(self, req_id):
+        return req_id in self._finished_rows
+
+    def ticker_id(self, req_id):
+        return self._ticker_by_row.get(req_id)
+
+    def ticker_ids(self):
+        return list(self._rows_by_ticker)
+
+    def contract(self, ticker_id):
+        return self._contract_by_ticker.get(ticker_id)
+
+    def status(self):
+        return (f"Market data lines in use: {len(self._rows_by_ticker)} of {self.max_lines} "
+                f"({len(self._active_rows)} active rows, {len(self._finished_rows)} finished rows, "
+                f"{len(self._pending)} rows waiting, {self.lines_cancelled} lines released, "
+                f"{len(self._tick_by_tick)} tick-by-tick streams).")
+
+    def __len__(self):
+        return len(self._rows_by_ticker)
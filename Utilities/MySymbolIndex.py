@@ -0,0 +1,111 @@
+class SymbolIndex:
+    """
+    Rows of the trading plan per symbol and currency, split into open positions and new positions.
+
+    Same-symbol operations (add & reduce, one tick_data row per symbol) only visit the k rows of the symbol and do
+    not depend on the order of the rows in the plan. Rows holding shares (open positions and filled new positions
+    which are not sold) are tracked as well, sync() is called wherever the flags change (fills, plan reloads).
+    """
+
+    def __init__(self, positions):
+        self._open_rows = {}
+        self._new_rows = {}
+        self._keys = []
+        self._held = set()
+        self._groups = ()
+        self.add_rows(positions)
+
+    @staticmethod
+    def key(position):
+        return position.symbol, position.currency
+
+    @staticmethod
+    def is_held(position):
+        # Open positions and filled new positions which still hold shares
+        return not position.stock_sold and (position.open_position or position.order_filled)
+
+    def add_rows(self, positions):
+        # Rows appended through a plan reload
+        if len(self._keys) >= len(positions):
+            return
+
+        for req_id in range(len(self._keys), len(positions)):
+            position = positions[req_id]
+            key = (self.key(position), bool(position.open_position))
+            self._keys.append(key)
+            self._insert(key, req_id)
+
+            if self.is_held(position):
+                self._held.add(req_id)
+
+        self._publish_groups()
+
+    def _insert(self, key, req_id):
+        symbol_key, open_position = key
+        rows = (self._open_rows if open_position else self._new_rows).setdefault(symbol_key, [])
+        rows.append(req_id)
+        rows.sort()
+
+    def _remove(self, key, req_id):
+        symbol_key, open_position = key
+        index = self._open_rows if open_position else self._new_rows
+        rows = index[symbol_key]
+        rows.remove(req_id)
+        if not rows:
+            del index[symbol_key]
+
+    def _publish_groups(self):
+        # Immutable copy for the fetch thread, which reads it without io_list_lock
+        groups = [tuple(rows) for index in (self._new_rows, self._open_rows) for rows in index.values()]
+        self._groups = tuple(sorted(groups))
+
+    def sync(self, positions, req_id):
+        position = positions[req_id]
+        key = (self.key(position), bool(position.open_position))
+
+        if key != self._keys[req_id]:
+            self._remove(self._keys[req_id], req_id)
+            self._insert(key, req_id)
+            self._keys[req_id] = key
+            self._publish_groups()
+
+        if self.is_held(position):
+            self._held.add(req_id)
+        else:
+            self._held.discard(req_id)
+
+    def sync_all(self, positions):
+        self.add_rows(positions)
+        for req_id in range(len(self._keys)):
+            self.sync(positions, req_id)
+
+    def open_rows(self, symbol, currency):
+        return tuple(self._open_rows.get((symbol, currency), ()))
+
+    def new_rows(self, symbol, currency):
+        return tuple(self._new_rows.get((symbol, currency), ()))
+
+    def rows(self, symbol, currency):
+        return tuple(sorted(self.open_rows(symbol, currency) + self.new_rows(symbol, currency)))
+
+    def held_rows(self, symbol, currency):
+        """
+        Rows of the symbol which currently hold shares.
+
+        Parameters:
+        - symbol (str): Symbol of the contract.
+        - currency (str): Currency of the contract.
+
+        Returns:
+        - tuple: reqIds in the order of the trading plan.
+        """
+        return tuple(req_id for req_id in self.rows(symbol, currency) if req_id in self._held)
+
+    def groups(self):
+        """
+        Rows per symbol, currency and open/new position, e.g. to record one tick_data row per group.
+
+        Returns:
+        - tuple: Tuple of reqIds per group, ordered by their first row.
+        """
+        return self._groups
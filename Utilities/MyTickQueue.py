@@ -0,0 +1,81 @@
+import collections
+import threading
+
+
+class TickConflationQueue:
+    """
+    Queue of reqIds whose quotes changed since the strategy loop last evaluated them.
+
+    The tick callbacks only mark a row as dirty. A row that is already waiting is not queued again, so a burst of
+    ticks for one symbol costs one rule pass in the strategy loop.
+    """
+
+    def __init__(self, max_depth=1000):
+        self.max_depth = max_depth
+        self._queue = collections.deque()
+        self._dirty = set()
+        self._condition = threading.Condition()
+
+        # Counters
+        self.ticks_received = 0
+        self.ticks_conflated = 0
+        self.ticks_dropped = 0
+        self.rows_evaluated = 0
+        self.cycles = 0
+        self.max_depth_seen = 0
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def mark_dirty(self, req_id):
+        with self._condition:
+            self.ticks_received += 1
+
+            if req_id in self._dirty:
+                self.ticks_conflated += 1
+                return
+
+            if len(self._queue) >= self.max_depth:
+                self.ticks_dropped += 1
+                return
+
+            self._dirty.add(req_id)
+            self._queue.append(req_id)
+            self.max_depth_seen = max(self.max_depth_seen, len(self._queue))
+            self._condition.notify()
+
+    def drain(self, timeout=None):
+        """
+        Waits until at least one row is dirty and returns all dirty reqIds in the order they were marked.
+
+        Parameters:
+        - timeout (float, optional): Seconds to wait for a tick before an empty list is returned.
+
+        Returns:
+        - list: Dirty reqIds, each exactly once.
+        """
+        with self._condition:
+            if not self._queue:
+                self._condition.wait(timeout)
+
+            req_ids = list(self._queue)
+            self._queue.clear()
+            self._dirty.clear()
+
+            if req_ids:
+                self.cycles += 1
+                self.rows_evaluated += len(req_ids)
+
+        return req_ids
+
+    def stats(self):
+        return {
+            'ticks received': self.ticks_received,
+            'ticks conflated': self.ticks_conflated,
+            'ticks dropped': self.ticks_dropped,
+            'rows evaluated': self.rows_evaluated,
+            'strategy cycles': self.cycles,
+            'queue depth': self.depth,
+            'max. queue depth': self.max_depth_seen,
+        }
@@ -3,13 +3,16 @@ from ibapi.contract import *
 from pathlib import Path
 import pandas as pd
 import datetime
-import pytz
 from openpyxl import load_workbook
 import time
 from bs4 import BeautifulSoup
 import requests
 import re
 
+from Utilities.MyQuoteBoard import BID_PRICE, ASK_PRICE, LAST_PRICE, CLOSE_PRICE, BID_SIZE, ASK_SIZE, VOLUME
+from Utilities.MyExecutionLedger import ORDER_ROLES
+from Utilities.MyOrders import MyOrders
+
 def _to_float(x, default=0.0):
     try:
         # handles str, Decimal, int, float, None
@@ -21,61 +24,39 @@ def _to_float(x, default=0.0):
 class MyUtilities:
 
     @staticmethod
-    def feed_size_io_lists(io_list, io_list_copy_for_tick_data, tick_type, req_id, size):
-
-        if tick_type == "ASK_SIZE":
-            io_list.loc[req_id, 'ASK size'] = float(size)
-            io_list_copy_for_tick_data.loc[req_id, 'ASK size'] = float(size)
+    def is_row_finished(position):
+        """
+        Checks if a row of the trading plan can no longer act, so that its market data subscription can be released.
 
-        if tick_type == "BID_SIZE":
-            io_list.loc[req_id, 'BID size'] = float(size)
-            io_list_copy_for_tick_data.loc[req_id, 'BID size'] = float(size)
+        Parameters:
+        - position (PositionRecord): Row of the trading plan.
 
-        if tick_type == "VOLUME":
-            io_list.loc[req_id, 'Volume'] = float(size)
-            io_list_copy_for_tick_data.loc[req_id, 'Volume'] = float(size)
+        Returns:
+        - bool: True if the stock is sold, its quantity is 0 or its entry is blocked for the rest of the day.
+        """
+        if position.stock_sold or round(position.quantity, 0) == 0:
+            return True
 
-        return io_list, io_list_copy_for_tick_data
+        # New positions without an order can not be entered anymore
+        return not position.open_position and not position.order_executed and \
+            (position.stop_undercut or position.position_below_limit or position.max_daily_loss_reached)
 
     @staticmethod
-    def feed_price_io_lists(io_list, io_list_copy_for_tick_data, tick_type, req_id, price):
-
-        if tick_type == "CLOSE":
-            io_list.loc[req_id, 'CLOSE price [$]'] = round(price, 2)
-            io_list_copy_for_tick_data.loc[req_id, 'CLOSE price [$]'] = round(price, 2)
-
-        if tick_type == "BID":
-            io_list.loc[req_id, 'BID price [$]'] = round(price, 2)
-            io_list_copy_for_tick_data.loc[req_id, 'BID price [$]'] = round(price, 2)
-
-        if tick_type == "ASK":
-            io_list.loc[req_id, 'ASK price [$]'] = round(price, 2)
-            io_list_copy_for_tick_data.loc[req_id, 'ASK price [$]'] = round(price, 2)
-
-        if tick_type == "LAST":
-            io_list.loc[req_id, 'LAST price [$]'] = round(price, 2)
-            io_list_copy_for_tick_data.loc[req_id, 'LAST price [$]'] = round(price, 2)
-
-        if tick_type == "HIGH":
-            if pd.isnull(io_list['HIGH price [$]'][req_id]) or price > io_list['HIGH price [$]'][req_id]:
-                io_list.loc[req_id, 'HIGH price [$]'] = round(price, 2)
-
-        if tick_type == "LOW":
-            if pd.isnull(io_list['LOW price [$]'][req_id]) or price < io_list['LOW price [$]'][req_id]:
-                io_list.loc[req_id, 'LOW price [$]'] = round(price, 2)
-
-        return io_list, io_list_copy_for_tick_data
+    def is_waiting_for_entry(position):
+        # New positions which did not place their buy order yet
+        return not position.open_position and not position.order_executed and \
+            not MyUtilities.is_row_finished(position)
 
     @staticmethod
-    def get_contract_details(io_list, req_id: int):
+    def get_contract_details(position):
 
         # Create contract details
         contract = Contract()
-        contract.symbol = io_list['Symbol'][req_id]
-        contract.secType = io_list['Security Type'][req_id]
-        contract.currency = io_list['Currency'][req_id]
-        contract.exchange = io_list['Exchange'][req_id]
-        contract.primaryExch = io_list['Primary Exchange'][req_id]
+        contract.symbol = position.symbol
+        contract.secType = position.security_type
+        contract.currency = position.currency
+        contract.exchange = position.exchange
+        contract.primaryExch = position.primary_exchange
 
         return contract
 
@@ -185,20 +166,22 @@ class MyUtilities:
         return open_positions
 
     @staticmethod
-    def compare_positions_currency_specific(open_positions, io_list):
+    def compare_positions_currency_specific(open_positions, positions):
         """
-        Compares the sum of 'Quantity [#]' for each 'Symbol' in both open_positions and io_list DataFrames,
-        specifically for the currency present in io_list (ignoring the first line). Checks if the quantities
-        per Symbol in io_list cover the relevant quantities in open_positions for the given currency.
+        Compares the sum of 'Quantity [#]' for each 'Symbol' in both open_positions and the trading plan,
+        specifically for the currency present in the trading plan (ignoring the first line). Checks if the quantities
+        per Symbol in the trading plan cover the relevant quantities in open_positions for the given currency.
 
         Parameters:
         - open_positions (pd.DataFrame): DataFrame containing current open positions across various currencies.
-        - io_list (pd.DataFrame): DataFrame containing positions in a single currency, excluding the first row.
+        - positions (list): PositionRecord per row in a single currency.
         """
-        # Exclude the first row from io_list
-        io_list_filtered = io_list.iloc[1:]
+        io_list_filtered = pd.DataFrame(
+            [(p.symbol, p.currency, p.open_position, p.quantity) for p in positions],
+            columns=['Symbol', 'Currency', 'Open position', 'Quantity [#]']
+        )
 
-        # Assuming all entries in io_list are in the same currency, determine that currency
+        # Assuming all entries in the trading plan are in the same currency, determine that currency
         currency = io_list_filtered['Currency'].iloc[0]
 
         # Filter both DataFrames for the relevant currency
@@ -222,100 +205,70 @@ class MyUtilities:
             print(io_list_sum)
 
     @staticmethod
-    def update_io_list_order_execution_status(status, order_id, last_fill_price, filled, remaining, io_list, timezone):
-
-        filled_f = _to_float(filled, 0.0)
-        remaining_f = _to_float(remaining, 0.0)
-        last_fill_f = _to_float(last_fill_price, 0.0)
-
-        # "Tries" need to find the relevant order_id to confirm the "Filled" status
-        if status == "Filled" or ((status == "PreSubmitted" or status == "Submitted" or
-                                   status == "PendingCancel" or status == "Cancelled") and filled_f > 0):
-
-            try:
-                index = io_list[io_list['parentOrderId'] == order_id].index.item()
-                io_list.loc[index, 'Order filled'] = True
-                io_list.loc[index, 'Entry price [$]'] = last_fill_f
-                if filled_f > 0:
-                    io_list.loc[index, 'Quantity [#]'] = int(filled_f)
-                if remaining_f == 0:
-                    print("\nStock ID:", index, io_list['Symbol'][index], "buy order completely filled. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
-
-            except:
-                pass
+    def find_order_role(order_id):
+        # The row of an order and its role in it (parent, profit, stop, ...), (None, None) for unknown orders
+        position, attributes = MyOrders.order_index.lookup(order_id)
+        if position is None:
+            return None, None
+        return position, dict(ORDER_ROLES)[attributes[0]]
 
-            try:
-                index = io_list[io_list['profitOrderId'] == order_id].index.item()
-                io_list.loc[index, 'Profit order filled'] = True
-                io_list.loc[index, 'Profit taker price [$]'] = last_fill_f
-                if filled_f > 0:
-                    # Uses "remaining" since I want to know the position remaining in my portfolio
-                    io_list.loc[index, 'Quantity [#]'] = int(remaining_f)
-                if remaining_f == 0:
-                    io_list.loc[index, 'Stock sold'] = True
-                    io_list.loc[index, 'Stock sold [time]'] = \
-                        datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S")
-                    print("\nStock ID:", index, io_list['Symbol'][index], "completely sold for profit. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
-
-            except:
-                pass
-
-            try:
-                index = io_list[io_list['stopOrderId'] == order_id].index.item()
-                io_list.loc[index, 'Stop order filled'] = True
-                io_list.loc[index, 'Stop price [$]'] = last_fill_f
-                if filled_f > 0:
-                    # Uses "remaining" since I want to know the position remaining in my portfolio
-                    io_list.loc[index, 'Quantity [#]'] = int(remaining_f)
-                if remaining_f == 0:
-                    io_list.loc[index, 'Stock sold'] = True
-                    io_list.loc[index, 'Stock sold [time]'] = \
-                        datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S")
-                    print("\nStock ID:", index, io_list['Symbol'][index], "completely sold - stop hit. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
-
-            except:
-                pass
-
-            try:
-                index = io_list[io_list['sellOnCloseOrderId'] == order_id].index.item()
-                io_list.loc[index, 'SOC order filled'] = True
-                io_list.loc[index, 'Sell bellow SMA [$]'] = last_fill_f
-                if filled_f > 0:
-                    # Uses "remaining" since I want to know the position remaining in my portfolio
-                    io_list.loc[index, 'Quantity [#]'] = int(remaining_f)
-                if remaining_f == 0:
-                    io_list.loc[index, 'Stock sold'] = True
-                    io_list.loc[index, 'Stock sold [time]'] = \
-                        datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S")
-                    print("\nStock ID:", index, io_list['Symbol'][index], "completely sold - SOC order filled. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
-
-            except:
-                pass
-
-            try:
-                index = io_list[io_list['marketOrderId'] == order_id].index.item()
-                io_list.loc[index, 'Market order filled'] = True
-                io_list.loc[index, 'Market sell price [$]'] = last_fill_f
-                print("\nStock ID:", index, io_list['Symbol'][index], "Market order filled. (",
-                      datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
+    @staticmethod
+    def apply_execution(fills, position, clock):
+        """
+        Updates the row of an order from the fills booked for it in the ExecutionLedger.
 
-            except:
-                pass
+        Parameters:
+        - fills (OrderFills): Fills of the order so far.
+        - position (PositionRecord): Row the order belongs to.
+        - clock (Clock): Clock of the program.
+        """
+        if fills.role == 'parent':
+            position.order_filled = True
+            position.entry_price = fills.avg_price
+            position.quantity = int(fills.shares)
+            if fills.shares >= _to_float(position.quantity_at_open, 0.0):
+                print("\nStock ID:", position.req_id, position.symbol, "buy order completely filled. (",
+                      clock.now_str(), ")")
+            return
+
+        if fills.role == 'market':
+            # The quantity of the row is already reduced by the rule placing the market order
+            position.market_order_filled = True
+            position.market_sell_price = fills.avg_price
+            print("\nStock ID:", position.req_id, position.symbol, "Market order filled. (", clock.now_str(), ")")
+            return
+
+        if fills.role == 'profit':
+            position.profit_order_filled = True
+            position.profit_taker_price = fills.avg_price
+            message = "completely sold for profit."
+        elif fills.role == 'stop':
+            position.stop_order_filled = True
+            position.stop_price = fills.avg_price
+            message = "completely sold - stop hit."
+        else:
+            position.soc_order_filled = True
+            position.sell_below_sma = fills.avg_price
+            message = "completely sold - SOC order filled."
 
-        return io_list
+        # Quantity remaining in my portfolio
+        position.quantity = max(int(fills.quantity_before - fills.shares), 0)
+        if position.quantity == 0 and not position.stock_sold:
+            position.stock_sold = True
+            position.stock_sold_time = clock.now_str()
+            print("\nStock ID:", position.req_id, position.symbol, message, "(", clock.now_str(), ")")
 
     @staticmethod
     def update_daily_pnl(portfolio_size, exr_rate, realized_pnl, realized_pnl_percent_last, unrealized_pnl,
-                         unrealized_pnl_percent_last, max_allowed_daily_pnl_loss, max_daily_loss_reached, timezone,
-                         portfolio_update_prints):
+                         unrealized_pnl_percent_last, max_allowed_daily_pnl_loss, max_daily_loss_reached, clock,
+                         portfolio_update_prints, daily_pnl=None):
 
         # Starts the DailyPnL calculation
         if portfolio_size is not None:
-            daily_pnl = (realized_pnl + unrealized_pnl) / exr_rate  # Only PnL figures come in local currency e.g. YEN
+            # DailyPnL of reqPnL if given, otherwise realized + unrealized of the account updates
+            if daily_pnl is None:
+                daily_pnl = realized_pnl + unrealized_pnl
+            daily_pnl = daily_pnl / exr_rate  # Only PnL figures come in local currency e.g. YEN
             daily_pnl_percent = daily_pnl / portfolio_size
 
             realized_pnl_percent = realized_pnl / portfolio_size * 100
@@ -326,7 +279,7 @@ class MyUtilities:
             if abs(realized_pnl_percent - realized_pnl_percent_last) > portfolio_update_prints or \
                     abs(unrealized_pnl_percent - unrealized_pnl_percent_last) > portfolio_update_prints:
                 print("\nYour daily PnL (realized + unrealized) is now", round(daily_pnl_percent * 100, 2), "%. (",
-                      datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
+                      clock.now_str(), ")")
 
                 print("Realized:", round(realized_pnl_percent, 2), "%.   ")
                 print("Unrealized:", round(unrealized_pnl_percent, 2), "%.")
@@ -338,7 +291,7 @@ class MyUtilities:
             if max_daily_loss_reached == False and daily_pnl_percent <= max_allowed_daily_pnl_loss:
                 max_daily_loss_reached = True
                 print(f"\nDaily max. loss of {round(max_allowed_daily_pnl_loss * 100, 1)}% is reached. (",
-                      datetime.datetime.now().astimezone(pytz.timezone(timezone)).strftime("%H:%M:%S"), ")")
+                      clock.now_str(), ")")
 
         return max_daily_loss_reached, realized_pnl_percent_last, unrealized_pnl_percent_last
 
@@ -505,9 +458,9 @@ class MyUtilities:
             print("Failed to update DailyTradingPlan after 3 attempts - stop loss will change back to original value.")
 
     @staticmethod
-    def find_earnings_dates(io_list, market_opening):
+    def find_earnings_dates(positions, market_opening):
 
-        set_of_stocks = set(io_list['Symbol'][1:])
+        set_of_stocks = set(p.symbol for p in positions)
 
         data_table = pd.DataFrame(columns=['Symbol', 'Earnings Date', 'Days to Earnings'])
         data_table['Symbol'] = list(set_of_stocks)
@@ -581,68 +534,53 @@ class MyUtilities:
             print(f'It was not possible to calculate the delta to the earnings dates. Error code: {e}')
 
     @staticmethod
-    def should_start_market_opening_function(io_list, time_delta_to_initialized_market):
+    def should_start_market_opening_function(positions, market_session_defined):
         # Calculate the number of populated entries
-        populated_entries = io_list['Company name'].apply(lambda x: x != "").sum()
-        total_entries = len(io_list)
+        populated_entries = sum(p.company_name != "" for p in positions)
+        total_entries = len(positions)
 
         # Check if the list is fully populated
-        if time_delta_to_initialized_market.days > 10:
-            if populated_entries == total_entries:
-                return True
+        return not market_session_defined and populated_entries == total_entries
+
+    @staticmethod
+    def append_fetch_data(tick_data, tick_data_open_position, tick_data_new_row, quote_snapshot, symbol_groups,
+                          clock):
 
-            # Check if the list is one entry away from being fully populated
-            elif populated_entries == total_entries - 1:
-                # Find the index of the remaining unpopulated entry
-                unpopulated_index = io_list['Company name'].apply(lambda x: x == "").idxmax()
+        time_now_fetch_str = clock.now_str("%y%m%d %H:%M:%S")
 
-                # If the remaining entry is the one with req_id = 0
-                if unpopulated_index == 0:
-                    return True
+        symbols = quote_snapshot.symbols
+        open_positions = quote_snapshot.open_positions
 
-        return False
+        # Only seeks to append data once per symbol for open position and once for new position in case
+        # (SymbolIndex.groups() - independent of the order of the rows in the plan)
+        for group in symbol_groups:
 
-    @staticmethod
-    def append_fetch_data(tick_data, tick_data_open_position, tick_data_new_row, io_list_copy_for_tick_data, timezone):
+            # Stocks without a market data line (all lines in use or released) are not recorded
+            i = next((row for row in group if row < len(quote_snapshot.values) and quote_snapshot.recorded[row]),
+                     None)
+            if i is None:
+                continue
 
-        time_now_fetch = datetime.datetime.now().astimezone(pytz.timezone(timezone))
-        time_now_fetch_str = time_now_fetch.strftime("%y%m%d %H:%M:%S")
+            quotes = quote_snapshot.values[i]
 
-        for i in range(len(io_list_copy_for_tick_data)):
+            # Fills row to append in pd dataframe
+            tick_data_new_row.loc[0, 'timeStamp'] = time_now_fetch_str
+            tick_data_new_row.loc[0, 'Symbol'] = symbols[i]
+            tick_data_new_row.loc[0, 'CLOSE price [$]'] = quotes[CLOSE_PRICE]
+            tick_data_new_row.loc[0, 'BID price [$]'] = quotes[BID_PRICE]
+            tick_data_new_row.loc[0, 'ASK price [$]'] = quotes[ASK_PRICE]
+            tick_data_new_row.loc[0, 'LAST price [$]'] = quotes[LAST_PRICE]
+            tick_data_new_row.loc[0, 'ASK size'] = quotes[ASK_SIZE]
+            tick_data_new_row.loc[0, 'BID size'] = quotes[BID_SIZE]
+            tick_data_new_row.loc[0, 'Volume'] = quotes[VOLUME]
 
-            # Stocks meeting these criteria are skipped and shall only prevent the code from "falling asleep"
-            if io_list_copy_for_tick_data['Entry price [$]'][i] == 9 and \
-                    io_list_copy_for_tick_data['Stop price [$]'][i] == 11:
-                continue
+            if not open_positions[i]:
+                # Appends row to tick_data
+                tick_data = pd.concat([tick_data, tick_data_new_row], ignore_index=True)
 
-            # Only seeks to append data once per symbol for open position and once for new position in case
-            if i > 0 and io_list_copy_for_tick_data['Symbol'][i] == io_list_copy_for_tick_data['Symbol'][i - 1] and \
-                    (io_list_copy_for_tick_data['Open position'][i] == io_list_copy_for_tick_data['Open position'][i - 1] or
-                     (
-                             not io_list_copy_for_tick_data['Open position'][i] and
-                             not io_list_copy_for_tick_data['Open position'][i - 1]
-                     )
-                    ):
-                pass
             else:
-                # Fills row to append in pd dataframe
-                tick_data_new_row.loc[0, 'timeStamp'] = time_now_fetch_str
-                tick_data_new_row.loc[0, 'Symbol'] = io_list_copy_for_tick_data['Symbol'][i]
-                tick_data_new_row.loc[0, 'CLOSE price [$]'] = io_list_copy_for_tick_data['CLOSE price [$]'][i]
-                tick_data_new_row.loc[0, 'BID price [$]'] = io_list_copy_for_tick_data['BID price [$]'][i]
-                tick_data_new_row.loc[0, 'ASK price [$]'] = io_list_copy_for_tick_data['ASK price [$]'][i]
-                tick_data_new_row.loc[0, 'LAST price [$]'] = io_list_copy_for_tick_data['LAST price [$]'][i]
-                tick_data_new_row.loc[0, 'ASK size'] = io_list_copy_for_tick_data['ASK size'][i]
-                tick_data_new_row.loc[0, 'BID size'] = io_list_copy_for_tick_data['BID size'][i]
-                tick_data_new_row.loc[0, 'Volume'] = io_list_copy_for_tick_data['Volume'][i]
-
-                if not io_list_copy_for_tick_data['Open position'][i]:
-                    # Appends row to tick_data
-                    tick_data = pd.concat([tick_data, tick_data_new_row], ignore_index=True)
-
-                else:
-                    # Appends row to tick_data_open_position
-                    tick_data_open_position = pd.concat([tick_data_open_position, tick_data_new_row],
-                                                        ignore_index=True)
+                # Appends row to tick_data_open_position
+                tick_data_open_position = pd.concat([tick_data_open_position, tick_data_new_row],
+                                                    ignore_index=True)
 
         return tick_data, tick_data_open_position
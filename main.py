@@ -9,7 +9,6 @@ from typing import Optional
 import threading
 import pandas as pd
 import numpy as np
-import pytz
 import math
 import re
 
@@ -37,12 +36,32 @@ from ibapi.tag_value import TagValue
 
 from Utilities.MyUtilities import MyUtilities
 from Utilities.MyOrders import MyOrders
+from Utilities.MyQuoteBoard import (QuoteBoard, BID_PRICE, ASK_PRICE, LAST_PRICE, LOW_PRICE, CLOSE_PRICE, BID_SIZE,
+                                    ASK_SIZE, TICK_BY_TICK_TYPES)
+from Utilities.MyTickQueue import TickConflationQueue
+from Utilities.MySubscriptions import MarketDataSubscriptions
+from Utilities.MyClock import Clock
+from Utilities.MyScheduler import Scheduler
+from Utilities.MyPositionRecord import PositionRecord
+from Utilities.MyLifecycle import RowLifecycle, WAITING, PROTECTED, PARTIALLY_SOLD
+from Utilities.MyBatchEvaluator import BatchEvaluator
+from Utilities.MySymbolIndex import SymbolIndex
+from Utilities.MyRiskLedger import RiskLedger
+from Utilities.MyPnL import PnLTable
+from Utilities.MyExecutionLedger import ExecutionLedger
+from Utilities.MyBars import BarAggregator, BAR_1M
+from Utilities.MyIndicators import IndicatorEngine
+from Utilities.MyOrderGateway import OrderGateway, PROTECTIVE, ENTRY, MARKET_DATA
+from Utilities.MyMarketSession import MarketSession, FIRST_MINUTE_END, PLAN_FREEZE, SHUTDOWN
 from Rules.ConstantsAndRules import market_constants
-from Functionalities.MyFunctionalities import OrderExecutionNewPositions, BracketOrdersOpenPositions,SellHalfRule,\
-    SellSquatRule, BadCloseRule, AddAndReduce, SellOnClose, SellBelowSMA, DailyInvestmentLimit
+from Functionalities.MyFunctionalities import (RuleEngine, RuleContext, ALL_RULES, PRE_OPEN_RULES, SESSION_RULES,
+                                               STOP_PASS, SESSION_EVENT, ORDER_STATUS, PLAN_CHANGED)
 
 from Rules.ConstantsAndRules import (PORT, MAX_STOCK_SPREAD, SELL_HALF_REVERSAL_RULE, SELL_FULL_REVERSAL_RULE, BAD_CLOSE_RULE,
-                                     MAX_ALLOWED_DAILY_PNL_LOSS, MIN_POSITION_SIZE, PORTFOLIO_UPDATE_PRINTS)
+                                     MAX_ALLOWED_DAILY_PNL_LOSS, MIN_POSITION_SIZE, PORTFOLIO_UPDATE_PRINTS,
+                                     MARKET_DATA_LINES, RECORD_FINISHED_STOCKS, TICK_BY_TICK_ENTRIES,
+                                     MAX_TICK_BY_TICK_STREAMS, INDICATOR_EMA_PERIODS, INDICATOR_ATR_PERIOD,
+                                     MAX_MESSAGES_PER_SECOND, MESSAGE_BURST)
 
 which_markets_to_trade = input("\nDo you want to trade New York [NY], Japan [JP] or Germany [DE]?\n")
 config = market_constants.get(which_markets_to_trade)
@@ -58,24 +77,20 @@ NAME_OF_DAILYTRADINGPLAN = config["NAME_OF_DAILYTRADINGPLAN"]
 NAME_OF_DAILYTRADINGPLAN_SAVE = config["NAME_OF_DAILYTRADINGPLAN_SAVE"]
 NAME_OF_FETCHDATA_NEW_SAVE = config["NAME_OF_FETCHDATA_NEW_SAVE"]
 NAME_OF_FETCHDATA_OPEN_SAVE = config["NAME_OF_FETCHDATA_OPEN_SAVE"]
+NAME_OF_BARS_SAVE = config["NAME_OF_BARS_SAVE"]
 CLIENT_ID = config["CLIENT_ID"]
 
+# Cached timezone and wall time for all time stamps of the program
+clock = Clock(TIMEZONE)
+
 # Variables are defined here
-market_opening = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) - datetime.timedelta(days=31)
-market_close = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) - datetime.timedelta(days=30)
-market_pause_start = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) - datetime.timedelta(days=31)
-market_pause_end = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) - datetime.timedelta(days=31)
+market_session: Optional[MarketSession] = None  # Built once the contract details give the opening hours
 ib_timezone_str = ""
 is_market_open = False
-previous_is_market_open = False
-all_opening_hours = []
-market_open_print_timestamp = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
-update_DailyTradingPlan_timestamp = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
-time_algo_starts = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
-market_opening_hours_defined = False
+all_opening_hours = {}
+market_open_print_timestamp = clock.epoch()
+time_algo_starts = clock.epoch()
 fetch_data_triggered = False
-daily_brackets_submitted = False
-all_orders_cancelled = False
 percent_invested_last = -1
 portfolio_size: Optional[float] = None  # Required to avoid type warnings
 percent_invested: Optional[float] = None  # Required to avoid type warnings
@@ -89,9 +104,13 @@ unrealized_PnL_percent_last = 0
 old_orderids = []
 sum_of_open_positions = []
 fetch_stock_data_thread = None
+strategy_loop_thread = None
+strategy_loop_running = False
 open_positions_check_done = False
 last_order_status_by_id = {}
 limit_absolute_risk = False
+percent_invested_max: Optional[float] = None  # Option A of the daily investment limit
+risk_abs_max: Optional[float] = None  # Option B of the daily investment limit
 
 # Read Excel files using read_excel_inputs()
 io_list = MyUtilities.read_excel_inputs(NAME_OF_DAILYTRADINGPLAN, index_col=0)
@@ -103,16 +122,64 @@ io_list = MyUtilities.document_trading_parameters(io_list, MAX_STOCK_SPREAD, SEL
                                                   SELL_FULL_REVERSAL_RULE, BAD_CLOSE_RULE, MAX_ALLOWED_DAILY_PNL_LOSS,
                                                   MIN_POSITION_SIZE)
 
+# Live trading plan - one PositionRecord per row of io_list, the index in the list is the reqId
+# io_list is only rebuilt from the records (and the quote board) when the outputs are saved
+positions = PositionRecord.from_io_list(io_list)
+io_list_template = io_list.iloc[0:0]
+
+# Latest market data of every row, only written into io_list when the outputs are saved
+# Other threads (e.g. fetch_stock_data) only read versioned snapshots of it
+quote_board = QuoteBoard(positions)
+
+# Rows with new price ticks waiting for the strategy loop - the trading plan is only changed while holding io_list_lock
+tick_queue = TickConflationQueue()
+io_list_lock = threading.RLock()
+
+# Fires the time-based rules at their deadline, independent of tick arrival
+scheduler = Scheduler(clock)
+
+# Sends orders and market data requests by priority, paced below the message limit of TWS
+order_gateway = OrderGateway(MAX_MESSAGES_PER_SECOND, MESSAGE_BURST)
+
+# Phase of every row (waiting, crossed, entry submitted, ...) - gates which rule blocks run on a tick
+row_lifecycle = RowLifecycle(positions)
+
+# Price predicates of all rows evaluated at once per strategy cycle - rows without action skip their rule pass
+batch_evaluator = BatchEvaluator(positions)
+
+# Rows per symbol and currency (open and new positions) - same-symbol operations only visit the rows of the symbol
+symbol_index = SymbolIndex(positions)
+
+# Exposure and risk of the plan, updated per row on fills, partial sells and stop moves - read by the entry sizing
+risk_ledger = RiskLedger(positions, EXR_RATE)
+
+# Real-time PnL of the account (drives the max. daily loss check) and of every position held
+pnl_table = PnLTable()
+
+# Fills per execId and orderId from execDetails - the source of quantity, average price, fees and realized PnL per row
+execution_ledger = ExecutionLedger()
+
+# Row and role of every order ID - orderStatus and execDetails look their order up instead of scanning all rows
+MyOrders.order_index.add_rows(positions)
+
+# 1s, 1m and 5m bars per contract, updated with every trade - read by the rules and saved at the close
+bar_aggregator = BarAggregator()
+
+# VWAP, ATR and EMAs per contract, updated with the trades and bars - read by the rules by name
+indicator_engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, INDICATOR_ATR_PERIOD)
+
+# One market data subscription per contract, fanned out to every row of io_list trading it
+market_data_subscriptions = MarketDataSubscriptions(MARKET_DATA_LINES,
+                                                    MAX_TICK_BY_TICK_STREAMS if TICK_BY_TICK_ENTRIES else 0)
+
 tick_data_open_position = tick_data.copy()
 tick_data_new_row = tick_data.copy()
 
-# Ensures that indices are the same for both files
-io_list_copy_for_tick_data = io_list
 open_positions_iOList = io_list.copy()
 open_positions_iOList = open_positions_iOList.iloc[0:0]
 
 # Prints current time in NY to confirm that there are no bugs conc. timezones considered
-print("\n", datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)))
+print("\n", clock.now())
 
 # Prints io_list for reference and double-check
 print("\n", io_list.iloc[:, [0, 6, 7, 8, 10, 11]])
@@ -151,6 +218,13 @@ else:
         "(in your account currency)?\n"
     ))
 
+# Entry and exit rules of Functionalities - a rule only runs when one of its inputs changed since the last pass of the row
+rule_engine = RuleEngine(ALL_RULES, quote_board)
+rule_context = RuleContext(rule_engine, positions, clock, quote_board, symbol_index, risk_ledger, scheduler,
+                           tick_queue, batch_evaluator, bar_aggregator, indicator_engine, market_data_subscriptions,
+                           old_orderids, NAME_OF_DAILYTRADINGPLAN, EXR_RATE, limit_absolute_risk,
+                           percent_invested_max, risk_abs_max)
+
 
 def SetupLogger():
     if not os.path.exists("log"):
@@ -326,6 +400,9 @@ class TestApp(TestWrapper, TestClient):
             self.start()
 
     def start(self):
+        global strategy_loop_thread
+        global strategy_loop_running
+
         if self.started:
             return
 
@@ -336,11 +413,18 @@ class TestApp(TestWrapper, TestClient):
             self.reqGlobalCancel()
         else:
             print("Executing requests")
+            order_gateway.start()
             self.marketDataTypeOperations()
             self.accountOperations_req()
             self.tickDataOperations_req()
             self.contractOperations()
 
+            # Rules are evaluated in their own thread so that the tick callbacks return immediately
+            strategy_loop_running = True
+            strategy_loop_thread = threading.Thread(target=self.strategy_loop, daemon=True)
+            strategy_loop_thread.start()
+            scheduler.start()
+
             print("Executing requests ... finished")
 
     def keyboardInterrupt(self):
@@ -362,6 +446,34 @@ class TestApp(TestWrapper, TestClient):
         self.nextValidOrderId += 1
         return oid
 
+    # Orders and market data requests are queued in the order gateway, which sends them by priority and paced
+    def placeOrder(self, orderId, contract: Contract, order: Order):
+        priority = PROTECTIVE if order.action == "SELL" else ENTRY
+        order_gateway.submit(priority, [(super().placeOrder, (orderId, contract, order))], (orderId,))
+
+    def place_bracket(self, contract: Contract, orders):
+        # Parent and children are sent back to back
+        order_gateway.submit(ENTRY, [(super(TestApp, self).placeOrder, (o.orderId, contract, o)) for o in orders],
+                             tuple(o.orderId for o in orders))
+
+    def cancelOrder(self, orderId, orderCancel: OrderCancel):
+        order_gateway.submit(PROTECTIVE, [(super().cancelOrder, (orderId, orderCancel))])
+
+    def reqMktData(self, reqId, contract: Contract, genericTickList: str, snapshot: bool, regulatorySnapshot: bool,
+                   mktDataOptions):
+        order_gateway.submit(MARKET_DATA, [(super().reqMktData, (reqId, contract, genericTickList, snapshot,
+                                                                 regulatorySnapshot, mktDataOptions))])
+
+    def cancelMktData(self, reqId):
+        order_gateway.submit(MARKET_DATA, [(super().cancelMktData, (reqId,))])
+
+    def reqTickByTickData(self, reqId, contract: Contract, tickType: str, numberOfTicks: int, ignoreSize: bool):
+        order_gateway.submit(MARKET_DATA, [(super().reqTickByTickData, (reqId, contract, tickType, numberOfTicks,
+                                                                        ignoreSize))])
+
+    def cancelTickByTickData(self, reqId):
+        order_gateway.submit(MARKET_DATA, [(super().cancelTickByTickData, (reqId,))])
+
     @iswrapper
     def error(self, reqId: int, errorTime: str, errorCode: int, errorMsg: str, advancedOrderRejectJson: str = ""):
         super().error(reqId, errorTime, errorCode, errorMsg, advancedOrderRejectJson)
@@ -382,7 +494,6 @@ class TestApp(TestWrapper, TestClient):
                     remaining: Decimal, avgFillPrice: float, permId: int,
                     parentId: int, lastFillPrice: float, clientId: int,
                     whyHeld: str, mktCapPrice: float):
-        global io_list
         global old_orderids
         global last_order_status_by_id
 
@@ -411,26 +522,49 @@ class TestApp(TestWrapper, TestClient):
                 "AvgFillPrice:", floatMaxString(avgFillPrice),
                 "Parent ID:", parentId,
                 "(",
-                datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)).strftime("%H:%M:%S"),
+                clock.now_str(),
                 ")"
             )
 
             # Remember this snapshot for next comparison
             last_order_status_by_id[orderId] = current_snapshot
 
-        io_list = MyUtilities.update_io_list_order_execution_status(status, orderId, lastFillPrice, filled, remaining,
-                                                                    io_list, TIMEZONE)
+        with io_list_lock:
+            # Orders which are done or partially filled are replaced instead of modified
+            MyOrders.protective_orders.update_status(orderId, status, filled)
+
+            # Fills are booked from execDetails only - the quantities of a status may be older or newer than the
+            # executions booked so far, so the status never changes the quantity of a row
+
+            # Entries cancelled or expired (GTD) before their fill give their reservation back
+            if status in ("Cancelled", "ApiCancelled", "Inactive"):
+                position, attributes = MyOrders.order_index.lookup(orderId)
+                if 'parent_order_id' in attributes:
+                    risk_ledger.release(position.req_id)
+
+    # Keeps the derived state of the rows current after fills changed them
+    def sync_after_fills(self, updated):
+        for position in updated:
+            risk_ledger.sync(positions, position.req_id)
+        row_lifecycle.sync_all(positions)
+        symbol_index.sync_all(positions)
+        batch_evaluator.refresh(positions)
+        rule_engine.notify_rows(range(len(positions)), ORDER_STATUS)
 
     @printWhenExecuting
     def accountOperations_req(self):
         # Subscribing to an account's information. Only one at a time!
         self.reqAccountUpdates(True, self.account)
         self.reqPositions()
+        self.reqPnL(PnLTable.ACCOUNT_REQ_ID, self.account, "")
 
     @printWhenExecuting
     def accountOperations_cancel(self):
         self.reqAccountUpdates(False, self.account)
         self.cancelPositions()
+        self.cancelPnL(PnLTable.ACCOUNT_REQ_ID)
+        for req_id in pnl_table.req_ids():
+            self.cancelPnLSingle(req_id)
 
     @iswrapper
     def managedAccounts(self, accountsList: str):
@@ -472,6 +606,10 @@ class TestApp(TestWrapper, TestClient):
         if key == "GrossPositionValue":
             gross_position_value = float(val)
 
+            # New baseline of the risk ledger - fills booked from now on move %-invested until the next update
+            with io_list_lock:
+                risk_ledger.sync_account(gross_position_value)
+
         if key == "NetLiquidation":
             portfolio_size = float(val)
 
@@ -482,13 +620,17 @@ class TestApp(TestWrapper, TestClient):
                 # Only updates if something has changed (beware the units)
                 if abs(percent_invested - percent_invested_last) * 100 > PORTFOLIO_UPDATE_PRINTS:
                     print("\nYour portfolio size is", round(portfolio_size, 0), "$. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)).strftime("%H:%M:%S"), ")")
+                          clock.now_str(), ")")
 
                     print("You are now", round(percent_invested * 100, 2), "% invested. (",
-                          datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)).strftime("%H:%M:%S"), ")")
+                          clock.now_str(), ")")
 
                     percent_invested_last = percent_invested
 
+        # Once the reqPnL stream is live, its PnL is the only one taken - the PnL of these updates is minutes old
+        if pnl_table.is_live():
+            return
+
         if key == "RealizedPnL" and currency == "BASE":
             realized_PnL = float(val)
 
@@ -499,7 +641,7 @@ class TestApp(TestWrapper, TestClient):
             max_daily_loss_reached, realized_PnL_percent_last, unrealized_PnL_percent_last = (
                 MyUtilities.update_daily_pnl(portfolio_size, EXR_RATE, realized_PnL, realized_PnL_percent_last,
                                              unrealized_PnL, unrealized_PnL_percent_last, MAX_ALLOWED_DAILY_PNL_LOSS,
-                                             max_daily_loss_reached, TIMEZONE, PORTFOLIO_UPDATE_PRINTS))
+                                             max_daily_loss_reached, clock, PORTFOLIO_UPDATE_PRINTS))
 
     @iswrapper
     def accountDownloadEnd(self, accountName: str):
@@ -522,6 +664,12 @@ class TestApp(TestWrapper, TestClient):
             open_positions_iOList = MyUtilities.check_open_orders(open_positions_iOList, contract.symbol,
                                                                   contract.currency, decimalMaxString(position))
 
+        # Every position held gets its own PnL stream, including the ones opened today
+        if position != 0:
+            req_id = pnl_table.subscribe(contract.conId, contract.symbol, contract.currency)
+            if req_id is not None:
+                self.reqPnLSingle(req_id, self.account, "", contract.conId)
+
     @iswrapper
     def positionEnd(self):
         super().positionEnd()
@@ -530,17 +678,31 @@ class TestApp(TestWrapper, TestClient):
     @iswrapper
     def pnl(self, reqId: int, dailyPnL: float,
             unrealizedPnL: float, realizedPnL: float):
+        global realized_PnL
+        global unrealized_PnL
+        global max_daily_loss_reached
+        global realized_PnL_percent_last
+        global unrealized_PnL_percent_last
+
         super().pnl(reqId, dailyPnL, unrealizedPnL, realizedPnL)
-        print("Daily PnL. ReqId:", reqId, "DailyPnL:", floatMaxString(dailyPnL),
-              "UnrealizedPnL:", floatMaxString(unrealizedPnL), "RealizedPnL:", floatMaxString(realizedPnL))
+
+        if not pnl_table.update_account(dailyPnL, unrealizedPnL, realizedPnL):
+            return
+
+        # Same check as for the account updates, but within a second of the PnL change and on the DailyPnL of TWS
+        realized_PnL = realizedPnL
+        unrealized_PnL = unrealizedPnL
+        max_daily_loss_reached, realized_PnL_percent_last, unrealized_PnL_percent_last = (
+            MyUtilities.update_daily_pnl(portfolio_size, EXR_RATE, realized_PnL, realized_PnL_percent_last,
+                                         unrealized_PnL, unrealized_PnL_percent_last, MAX_ALLOWED_DAILY_PNL_LOSS,
+                                         max_daily_loss_reached, clock, PORTFOLIO_UPDATE_PRINTS,
+                                         pnl_table.daily_pnl))
 
     @iswrapper
     def pnlSingle(self, reqId: int, pos: Decimal, dailyPnL: float,
                   unrealizedPnL: float, realizedPnL: float, value: float):
         super().pnlSingle(reqId, pos, dailyPnL, unrealizedPnL, realizedPnL, value)
-        print("Daily PnL Single. ReqId:", reqId, "Position:", decimalMaxString(pos),
-              "DailyPnL:", floatMaxString(dailyPnL), "UnrealizedPnL:", floatMaxString(unrealizedPnL),
-              "RealizedPnL:", floatMaxString(realizedPnL), "Value:", floatMaxString(value))
+        pnl_table.update_position(reqId, pos, dailyPnL, unrealizedPnL, realizedPnL, value, clock.now_str())
 
     def marketDataTypeOperations(self):
         # Switch to live (1) frozen (2) delayed (3) delayed frozen (4).
@@ -550,943 +712,555 @@ class TestApp(TestWrapper, TestClient):
     def tickDataOperations_req(self):
         self.reqMarketDataType(MarketDataTypeEnum.REALTIME)
 
-        # Requesting real time market data
-        for i in range(len(io_list)):
-            contract = MyUtilities.get_contract_details(io_list, i)
-            self.reqMktData(i, contract, "", False, False, [])
+        # Requesting real time market data (only once per contract)
+        for i in range(len(positions)):
+            self.subscribe_market_data(i)
+
+        print(market_data_subscriptions.status())
 
     @printWhenExecuting
     def tickDataOperations_cancel(self):
         # Canceling the market data subscription
-        for i in range(len(io_list)):
-            self.cancelMktData(i)
+        for ticker_id in market_data_subscriptions.ticker_ids():
+            self.cancelMktData(ticker_id)
+            self.cancel_tick_by_tick(ticker_id)
 
-    @iswrapper
-    def tickPrice(self, reqId: TickerId, tickType: TickType, price: float,
-                  attrib: TickAttrib):
-        super().tickPrice(reqId, tickType, price, attrib)
+    def subscribe_market_data(self, req_id):
+        contract = MyUtilities.get_contract_details(positions[req_id])
 
-        global io_list
-        global fetch_data_triggered
-        global io_list_copy_for_tick_data
-        global all_orders_cancelled
-        global daily_brackets_submitted
-        global is_market_open
-        global previous_is_market_open
-        global market_opening_hours_defined
-        global market_open_print_timestamp
-        global update_DailyTradingPlan_timestamp
-        global fetch_stock_data_thread
-        global open_positions_check_done
+        # Open positions get the free market data lines first
+        priority = 0 if positions[req_id].open_position or positions[req_id].order_filled else 1
+        ticker_id, is_new = market_data_subscriptions.add_row(req_id, contract, priority)
 
-        time_now = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
-        time_now_str = time_now.strftime("%H:%M:%S")
+        if ticker_id is None:
+            print(f"\nStock ID: {req_id} {positions[req_id].symbol} - all {MARKET_DATA_LINES} market data lines "
+                  f"in use - market data requested once a line is released.")
+            quote_board.set_recorded(req_id, False)
+            return
 
-        if time_now > time_algo_starts + datetime.timedelta(minutes=1) and not open_positions_check_done:
-            MyUtilities.compare_positions_currency_specific(open_positions_iOList, io_list)
-            open_positions_check_done = True
+        quote_board.set_recorded(req_id, True)
+        if is_new:
+            self.reqMktData(ticker_id, contract, "", False, False, [])
+        elif ticker_id != req_id:
+            # Shares the subscription - copies the quotes received so far for this contract
+            quote_board.copy_row(ticker_id, req_id)
 
-        # Sets marker True if market opening hours are defined
-        if not market_opening_hours_defined:
-            time_delta_to_initialized_market = time_now - market_opening
-            if time_delta_to_initialized_market.days < 10:
-                market_opening_hours_defined = True
-                print("\nMarket opening hours are defined.\n")
-
-        if market_opening_hours_defined and \
-                (
-                        (market_close > time_now > market_opening and not MARKET_HAS_PAUSE)
-                        or
-                        (
-                                (market_pause_start > time_now > market_opening or
-                                 market_close > time_now > market_pause_end)
-                                and MARKET_HAS_PAUSE
-                        )
-                ):
+        if TICK_BY_TICK_ENTRIES:
+            self.update_tick_by_tick(ticker_id)
 
-            is_market_open = True
-        else:
-            is_market_open = False
+    # Streams every trade and quote of contracts with rows waiting for their entry (opt-in)
+    # Falls back to the aggregated reqMktData stream as soon as no row of the contract waits anymore
+    def update_tick_by_tick(self, ticker_id):
+        if ticker_id is None:
+            return
 
-        # Triggers only once when markets just opened
-        if market_opening_hours_defined and is_market_open and not previous_is_market_open:
-            update_DailyTradingPlan_timestamp = time_now
-            print("\n##################################################################")
-            print("\nDingDingDing - Markets are open!\n")
-            print("##################################################################\n")
-            columns_to_clear = ['LAST price [$]', 'BID price [$]', 'ASK price [$]', 'BID size', 'ASK size',
-                                'CLOSE price [$]']
-            io_list[columns_to_clear] = np.nan
+        is_waiting = any(MyUtilities.is_waiting_for_entry(positions[row])
+                         for row in market_data_subscriptions.rows(ticker_id))
 
-        # Triggers only once when markets just closed
-        if previous_is_market_open and not is_market_open:
-            print("\n##################################################################")
-            print("\nMarkets are closed.\n")
-            print("##################################################################\n")
+        if is_waiting and market_data_subscriptions.start_tick_by_tick(ticker_id):
+            contract = market_data_subscriptions.contract(ticker_id)
+            self.reqTickByTickData(ticker_id + MarketDataSubscriptions.LAST_OFFSET, contract, "Last", 0, False)
+            self.reqTickByTickData(ticker_id + MarketDataSubscriptions.BID_ASK_OFFSET, contract, "BidAsk", 0, False)
+            print(f"\nStock ID: {ticker_id} {contract.symbol} - tick-by-tick data requested for entry.")
 
-        # Update the previous state for the next check
-        previous_is_market_open = is_market_open
+        elif not is_waiting:
+            self.cancel_tick_by_tick(ticker_id)
 
-        # Allocates all relevant tickTypes to their respective field
-        io_list, io_list_copy_for_tick_data = MyUtilities.feed_price_io_lists(io_list, io_list_copy_for_tick_data,
-                                                                        TickTypeEnum.toStr(tickType), reqId, price)
+    def cancel_tick_by_tick(self, ticker_id):
+        if not market_data_subscriptions.stop_tick_by_tick(ticker_id):
+            return
 
-        # Start function fetch_stock_data() only oncetick_type
-        if not fetch_data_triggered and is_market_open:
-            fetch_stock_data_thread = threading.Thread(target=self.fetch_stock_data, daemon=False)
-            fetch_stock_data_thread.start()
-            fetch_data_triggered = True
+        self.cancelTickByTickData(ticker_id + MarketDataSubscriptions.LAST_OFFSET)
+        self.cancelTickByTickData(ticker_id + MarketDataSubscriptions.BID_ASK_OFFSET)
+
+        # Hands the free tick-by-tick stream to the next contract still waiting for its entry
+        for other_ticker_id in market_data_subscriptions.ticker_ids():
+            if other_ticker_id != ticker_id and not market_data_subscriptions.has_tick_by_tick(other_ticker_id):
+                self.update_tick_by_tick(other_ticker_id)
+            if not market_data_subscriptions.has_free_tick_by_tick():
+                break
+
+    # Releases the market data of rows which can no longer act and hands free lines to waiting rows
+    def release_finished_row(self, req_id):
+        # Drops a contract back to the aggregated stream after the entry
+        ticker_id = market_data_subscriptions.ticker_id(req_id)
+        if market_data_subscriptions.has_tick_by_tick(ticker_id) and \
+                not MyUtilities.is_waiting_for_entry(positions[req_id]):
+            self.update_tick_by_tick(ticker_id)
+
+        if market_data_subscriptions.is_finished(req_id) or not MyUtilities.is_row_finished(positions[req_id]):
+            return
 
-        # Continues only when market_hours are defined
-        if not market_opening_hours_defined:
+        ticker_id = market_data_subscriptions.finish_row(req_id, keep_stream=RECORD_FINISHED_STOCKS)
+        if not RECORD_FINISHED_STOCKS:
+            quote_board.set_recorded(req_id, False)
+
+        if ticker_id is None:
             return
 
-        if MARKET_HAS_PAUSE and time_now > market_opening:
-            minutes_to_market_open = (market_pause_end - time_now).total_seconds() / 60
-        else:
-            minutes_to_market_open = (market_opening - time_now).total_seconds() / 60
+        self.cancelMktData(ticker_id)
+        self.cancel_tick_by_tick(ticker_id)
 
-        # Place brackets around open positions
-        if not daily_brackets_submitted and market_opening_hours_defined and \
-                io_list['Open position'][reqId] and not io_list['Open position bracket submitted'][reqId]:
+        pending = market_data_subscriptions.pop_pending()
+        while pending is not None:
+            self.subscribe_market_data(pending[0])
+            pending = market_data_subscriptions.pop_pending()
 
-            # Cancels all open orders every time the algo is started if the market opening is only some minutes away
-            # Note that this only happens if there are open positions in io_list
-            if not all_orders_cancelled and minutes_to_market_open < 15:
+        print(f"\nStock ID: {req_id} {positions[req_id].symbol} - market data released. "
+              f"{market_data_subscriptions.status()}")
 
-                for old_id in old_orderids:
-                    self.cancelOrder(int(old_id), OrderCancel())
+    # Message loop of app.run() - the quote board is written by this thread only, so it also applies the writes the
+    # other threads queued (after every message and when no message arrived for 0.2 sec)
+    def msgLoopRec(self):
+        super().msgLoopRec()
+        quote_board.apply_commands()
 
-                all_orders_cancelled = True
+    def msgLoopTmo(self):
+        super().msgLoopTmo()
+        quote_board.apply_commands()
 
-            # Only continues in logic if all relevant data points are already received
-            if pd.isnull(io_list['LAST price [$]'][reqId]):
-                return
+    @staticmethod
+    def is_session_trade(epoch):
+        # Trades outside the session (pre-market, after-hours) feed neither the bars nor the indicators
+        session = market_session
+        return is_market_open and session is not None and session.opening_epoch <= epoch <= session.close_epoch
 
-            # Bracket shall immediately be placed when last price is within -1% or above of defined stop
-            if is_market_open and io_list['LAST price [$]'][reqId] > io_list['Stop price [$]'][reqId] * 0.99:
-                # Place new OCA profit taker and stop loss
-                contract = MyUtilities.get_contract_details(io_list, reqId)
-                total_quantity = round(io_list['Quantity [#]'][reqId], 0)
-                lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-                aux_price = round(io_list['Stop price [$]'][reqId], 2)
-                oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                        TIMEZONE, ib_timezone_str, market_close, io_list)
-                for o in oca:
-                    self.placeOrder(o.orderId, contract, o)
-                    self.nextOrderId()
-
-                io_list.loc[reqId, 'Open position bracket submitted'] = True
-                io_list.loc[reqId, 'Order executed [time]'] = time_now.strftime("%y%m%d %H:%M:%S")
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} within -1% from buy price - bracket defined."
-                      f"( {time_now_str} )")
-
-            # If price gaps below -1% from buy price and stock iterates the first time:
-            elif is_market_open and io_list["Stop timestamp"][reqId] == "":
-                io_list.loc[reqId, "Stop timestamp"] = datetime.datetime.now(tz=None)
-                io_list.loc[reqId, "Last stop price"] = io_list["LAST price [$]"][reqId]
-                io_list.loc[reqId, 'Stock looped'] = True
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} gapped below -1% from buy price - we wait 4 secs."
-                      f"( {time_now_str} )")
-
-            # If price gaps below -1% from buy price and stock iterates further:
-            elif is_market_open and io_list["Stop timestamp"][reqId] <= \
-                    datetime.datetime.now(tz=None) - datetime.timedelta(seconds=4):
-
-                # If stock continues to sink within last 4 seconds, sell order is placed
-                if io_list["Last stop price"][reqId] > io_list["LAST price [$]"][reqId]:
-
-                    # Shoot market sell order
-                    contract = MyUtilities.get_contract_details(io_list, reqId)
-                    total_quantity = round(io_list['Quantity [#]'][reqId], 0)
-                    orderId = self.nextOrderId()
-                    order, io_list = MyOrders.sell_market_order(orderId, reqId, total_quantity, io_list)
-                    self.placeOrder(order.orderId, contract, order)
-
-                    io_list.loc[reqId, 'Open position bracket submitted'] = True
-                    io_list.loc[reqId, 'Order executed [time]'] = time_now.strftime("%y%m%d %H:%M:%S")
-                    io_list.loc[reqId, 'stopOrderId'] = orderId
-
-                    print(f"\n Stock with ID: {reqId} {io_list['Symbol'][reqId]} fell further in price - stock sold."
-                          f"( {time_now_str} )")
-
-                # If the price increased, I will wait 4 more seconds
-                else:
-                    io_list.loc[reqId, "Stop timestamp"] = datetime.datetime.now(tz=None)
-                    io_list.loc[reqId, "Last stop price"] = io_list["LAST price [$]"][reqId]
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} improved in price - wait 4 more secs.\n")
-
-            if io_list['Open position'].equals(io_list['Open position bracket submitted']):
-                daily_brackets_submitted = True
-
-                print(f"\nAll brackets for open positions transmitted. ( {time_now_str} )\n")
+    @iswrapper
+    def tickPrice(self, reqId: TickerId, tickType: TickType, price: float,
+                  attrib: TickAttrib):
+        super().tickPrice(reqId, tickType, price, attrib)
 
-        # Only continues if market_hours are defined and markets are open (reports every minute)
-        if not is_market_open and time_now < market_close + datetime.timedelta(minutes=3):
+        # Last, bid and ask come from the tick-by-tick stream while it is active
+        if tickType in TICK_BY_TICK_TYPES and market_data_subscriptions.has_tick_by_tick(reqId):
+            return
 
-            # Prints message more often the closer it gets to market opening
-            if (
-                    minutes_to_market_open > 15 and market_open_print_timestamp + datetime.timedelta(minutes=15)
-                    < time_now
-            ) or \
-                    (
-                            15 >= minutes_to_market_open > 2 and
-                            market_open_print_timestamp + datetime.timedelta(minutes=3) < time_now
-                    ) or \
-                    (
-                            2 >= minutes_to_market_open and market_open_print_timestamp + datetime.timedelta(seconds=30)
-                            < time_now
-                    ):
-                print(f"\nMarkets not open. ( {time_now_str} )")
+        # Bars are built once per contract, from trades within the session as on the tick-by-tick stream
+        if tickType == TickTypeEnum.LAST:
+            now = clock.epoch()
+            if self.is_session_trade(now):
+                bar_aggregator.feed_trade(reqId, now, price)
+                indicator_engine.feed_trade(reqId, price)
 
-                market_open_print_timestamp = time_now
+        # reqId is the tickerId of the subscription - the tick is fanned out to all rows trading the contract
+        for row in market_data_subscriptions.rows(reqId):
+            # Allocates all relevant tickTypes to their respective field
+            quote_board.feed_price(row, tickType, price)
 
-            return
+            # Rules run for this row in the strategy loop - ticks arriving meanwhile are conflated
+            if market_data_subscriptions.is_active(row):
+                tick_queue.mark_dirty(row)
 
-        elif time_now > market_close + datetime.timedelta(minutes=3):
+    # Reads DailyTradingPlan and checks for updates (open and new positions)
+    # Called every 10 seconds by the scheduler while markets are open
+    def reload_daily_trading_plan(self):
+        success_reading_xls = True
+        io_list_update = None
 
-            print("Code attempting to shut down. ( ", time_now_str, " )")
+        try:
+            io_list_update = MyUtilities.read_excel_inputs(NAME_OF_DAILYTRADINGPLAN, index_col=0)
 
-            if fetch_stock_data_thread.is_alive():
-                fetch_stock_data_thread.join()
+        except PermissionError:
+            print(
+                f"Did not get permission to read DailyTradingPlan. Will try again in some secs. ( {clock.now_str()} )")
+            success_reading_xls = False
 
-                print("Threads joined. ( ", time_now_str, " )")
+        except FileNotFoundError:
+            print("File not found.")
+            success_reading_xls = False
 
-            print("Finally exit. ( ", time_now_str, " )")
-            exit()
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            success_reading_xls = False
 
-        # Only continues in logic if all relevant data points are already received and market_hours are defined
-        if pd.isnull(io_list['LAST price [$]'][reqId]) or pd.isnull(io_list['ASK price [$]'][reqId]) or \
-                pd.isnull(io_list['BID price [$]'][reqId]) or pd.isnull(io_list['LOW price [$]'][reqId]):
-            return
+        if success_reading_xls:
+            # Applies the necessary datatypes again only if excel was read propperly
+            if io_list_update is None:
+                print("Couldn’t reload DailyTradingPlan – skipping update.")
+                return
+            else:
+                io_list_update = MyUtilities.clean_up_data_frame(
+                    io_list_update, tick_data, return_both_dataframes=False
+                )
+                updates = PositionRecord.from_io_list(io_list_update)
+
+            for j in range(len(updates)):
+
+                # Adding new positions
+                # Must come first to avoid errors due to index j exceeding len(positions)
+                if j >= len(positions):
+
+                    # Adds the new row to the trading plan and to the quote board for the fetching function
+                    positions.append(updates[j])
+                    quote_board.add_rows(positions)
+
+                    # Requests contract details and market data (reuses the subscription of a known contract)
+                    contract = MyUtilities.get_contract_details(positions[j])
+                    self.reqContractDetails(j, contract)
+                    self.subscribe_market_data(j)
+
+                    print(f"\nStock ID: {j} {positions[j].symbol} - New position data is added acc. to new plan."
+                          f"( {clock.now_str()} )")
+
+                    positions[j].new_position_added = True
+                    positions[j].new_position_added_time = clock.now_str()
+
+                # Updating open positions or filled new positions
+                elif (
+                        (not positions[j].open_position and positions[j].order_filled and
+                         not positions[j].stock_sold)
+                        or (
+                                positions[j].open_position and
+                                positions[j].open_position_bracket_submitted and not positions[j].stock_sold
+                        )) and (
+                        updates[j].stop_price != positions[j].stop_price or
+                        updates[j].profit_taker_price != positions[j].profit_taker_price or
+                        updates[j].quantity < positions[j].quantity or
+                        updates[j].sell_on_close != positions[j].sell_on_close or
+                        updates[j].stop_low_of_day != positions[j].stop_low_of_day or
+                        (not (pd.isna(updates[j].sell_below_sma) and pd.isna(
+                            positions[j].sell_below_sma)) and
+                         updates[j].sell_below_sma != positions[j].sell_below_sma)
+                ):
 
-        # Updating DailyTradingPlan
-        # Function reads DailyTradingPlan every few seconds and checks for updates (open and new positions)
-        # Stops working 5 minutes before the close
-        if update_DailyTradingPlan_timestamp + datetime.timedelta(seconds=10) < time_now < \
-                market_close - (datetime.timedelta(minutes=5)):
-
-            success_reading_xls = True
-            io_list_update = None
-            update_DailyTradingPlan_timestamp = time_now
-
-            try:
-                io_list_update = MyUtilities.read_excel_inputs(NAME_OF_DAILYTRADINGPLAN, index_col=0)
-
-            except PermissionError:
-                print(
-                    f"Did not get permission to read DailyTradingPlan. Will try again in some secs. ( {time_now_str} )")
-                success_reading_xls = False
-
-            except FileNotFoundError:
-                print("File not found.")
-                success_reading_xls = False
-
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                success_reading_xls = False
-
-            if success_reading_xls:
-                # Applies the necessary datatypes again only if excel was read propperly
-                if io_list_update is None:
-                    print("Couldn’t reload DailyTradingPlan – skipping update.")
-                    return
-                else:
-                    io_list_update = MyUtilities.clean_up_data_frame(
-                        io_list_update, tick_data, return_both_dataframes=False
-                    )
-
-                for j in range(len(io_list_update)):
-
-                    # Adding new positions
-                    # Must come first to avoid errors due to index j exceeding len(io_list)
-                    if j >= len(io_list):
-
-                        # Adds the new row to io_list and io_list_copy_for_tick_data for fetching function
-                        io_list = pd.concat([io_list, io_list_update.iloc[[j]]], ignore_index=True)
-                        io_list_copy_for_tick_data = pd.concat([io_list_copy_for_tick_data, io_list_update.iloc[[j]]],
-                                                               ignore_index=True)
-
-                        # Requests contract details and market data
-                        contract = MyUtilities.get_contract_details(io_list, j)
-                        self.reqContractDetails(j, contract)
-                        self.reqMktData(j, contract, "", False, False, [])
-
-                        print(f"\nStock ID: {j} {io_list['Symbol'][j]} - New position data is added acc. to new plan."
-                              f"( {time_now_str} )")
-
-                        io_list.loc[j, 'New position added'] = True
-                        io_list.loc[j, 'New position added [time]'] = time_now_str
-
-                    # Updating open positions or filled new positions
-                    elif (
-                            (not io_list['Open position'][j] and io_list['Order filled'][j] and
-                             not io_list['Stock sold'][j])
-                            or (
-                                    io_list['Open position'][j] and
-                                    io_list['Open position bracket submitted'][j] and not io_list['Stock sold'][j]
-                            )) and (
-                            io_list_update['Stop price [$]'][j] != io_list['Stop price [$]'][j] or
-                            io_list_update['Profit taker price [$]'][j] != io_list['Profit taker price [$]'][j] or
-                            io_list_update['Quantity [#]'][j] < io_list['Quantity [#]'][j] or
-                            io_list_update['Sell on close'][j] != io_list['Sell on close'][j] or
-                            io_list_update['Stop low of day'][j] != io_list['Stop low of day'][j] or
-                            (not (pd.isna(io_list_update['Sell bellow SMA [$]'][j]) and pd.isna(
-                                io_list['Sell bellow SMA [$]'][j])) and
-                             io_list_update['Sell bellow SMA [$]'][j] != io_list['Sell bellow SMA [$]'][j])
-                    ):
+                    # Only required if "Stop low of day" is newly set
+                    if updates[j].stop_low_of_day and not positions[j].stop_low_of_day:
+                        positions[j].stop_price = quote_board.get(j, LOW_PRICE)
+                        updates[j].stop_price = positions[j].stop_price
+                        positions[j].stop_low_of_day = updates[j].stop_low_of_day
+                        MyUtilities.dailytradingplan_update(j, positions[j].stop_price,
+                                                    positions[j].quantity, NAME_OF_DAILYTRADINGPLAN)
 
-                        # Only required if "Stop low of day" is newly set
-                        if io_list_update['Stop low of day'][j] and not io_list['Stop low of day'][j]:
-                            io_list.loc[j, 'Stop price [$]'] = io_list.loc[j, 'LOW price [$]']
-                            io_list_update.loc[j, 'Stop price [$]'] = io_list.loc[j, 'Stop price [$]']
-                            io_list.loc[j, 'Stop low of day'] = io_list_update['Stop low of day'][j]
-                            MyUtilities.dailytradingplan_update(j, io_list['Stop price [$]'][j],
-                                                        io_list['Quantity [#]'][j], NAME_OF_DAILYTRADINGPLAN)
-
-                        if not io_list['Open position'][j] and io_list['Stop low of day'][j] and \
-                                io_list_update['Stop price [$]'][j] != io_list['Stop price [$]'][j]:
-                            print(
-                                f"\n### ATTENTION #### Stock ID: {j} {io_list['Symbol'][j]} - You are overwriting stop "
-                                f"at the low of the day of {io_list['Stop price [$]'][j]} with a new stop price of "
-                                f"{io_list_update['Stop price [$]'][j]}. ( {time_now_str} )")
-
-                        io_list.loc[j, 'Stop price [$]'] = io_list_update['Stop price [$]'][j]
-                        io_list.loc[j, 'Profit taker price [$]'] = io_list_update['Profit taker price [$]'][j]
-                        io_list.loc[j, 'Sell on close'] = io_list_update['Sell on close'][j]
-                        io_list.loc[j, 'Sell bellow SMA [$]'] = io_list_update['Sell bellow SMA [$]'][j]
+                    if not positions[j].open_position and positions[j].stop_low_of_day and \
+                            updates[j].stop_price != positions[j].stop_price:
+                        print(
+                            f"\n### ATTENTION #### Stock ID: {j} {positions[j].symbol} - You are overwriting stop "
+                            f"at the low of the day of {positions[j].stop_price} with a new stop price of "
+                            f"{updates[j].stop_price}. ( {clock.now_str()} )")
+
+                    positions[j].stop_price = updates[j].stop_price
+                    positions[j].profit_taker_price = updates[j].profit_taker_price
+                    positions[j].sell_on_close = updates[j].sell_on_close
+                    positions[j].sell_below_sma = updates[j].sell_below_sma
+
+                    contract = MyUtilities.get_contract_details(positions[j])
+
+                    # Only required if the quantity is trimmed
+                    trimmed_quantity = 0
+                    if updates[j].quantity < positions[j].quantity:
+                        trimmed_quantity = round(positions[j].quantity - updates[j].quantity, 0)
+                        positions[j].quantity = updates[j].quantity
+
+                    if updates[j].quantity > 0:
+                        # Modifies the current bracket order (new OCA group if its structure changed)
+                        # Comes before the trim is sold, so that the bracket never exceeds the position
+                        total_quantity = round(positions[j].quantity, 0)
+                        lmt_price = round(positions[j].profit_taker_price, 2)
+                        aux_price = round(positions[j].stop_price, 2)
+                        MyOrders.adjust_one_cancels_all(self, contract, total_quantity, lmt_price, aux_price,
+                                                        positions[j], clock, ib_timezone_str, market_session.close)
+
+                        print(f"\nStock ID: {j} {positions[j].symbol} - Open position bracket updated acc. to new plan."
+                              f"( {clock.now_str()} )")
+
+                        positions[j].open_position_updated = True
+                        positions[j].open_position_updated_time = clock.now_str()
 
+                    else:
                         # Cancel current bracket oder
-                        self.cancelOrder(int(io_list['profitOrderId'][j]), OrderCancel())
-
-                        # Only required if the quantity is trimmed
-                        if io_list_update['Quantity [#]'][j] < io_list['Quantity [#]'][j]:
-                            # Shoot market sell order
-                            contract = MyUtilities.get_contract_details(io_list, j)
-                            total_quantity = round(io_list['Quantity [#]'][j] - io_list_update['Quantity [#]'][j], 0)
-                            order, io_list = MyOrders.sell_market_order(self.nextOrderId(), j, total_quantity, io_list)
-                            self.placeOrder(order.orderId, contract, order)
-                            io_list.loc[j, 'Quantity [#]'] = io_list_update['Quantity [#]'][j]
-
-                            if io_list_update['Quantity [#]'][j] == 0:
-                                io_list.loc[j, 'Stock sold'] = True
-                                io_list.loc[j, 'Stock sold [time]'] = time_now_str
-                                print(f"\nStock ID: {j} {io_list['Symbol'][j]} completely sold. ( {time_now_str} )")
-
-                        if io_list_update['Quantity [#]'][j] > 0:
-                            # Place new OCA profit taker with adjusted stop loss
-                            contract = MyUtilities.get_contract_details(io_list, j)
-                            total_quantity = round(io_list['Quantity [#]'][j], 0)
-                            lmt_price = round(io_list['Profit taker price [$]'][j], 2)
-                            aux_price = round(io_list['Stop price [$]'][j], 2)
-                            oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price,
-                                                                    j, TIMEZONE, ib_timezone_str, market_close, io_list)
-                            for o in oca:
-                                self.placeOrder(o.orderId, contract, o)
-                                self.nextOrderId()
-
-                            print(f"\nStock ID: {j} {io_list['Symbol'][j]} - Open position bracket updated acc. to new plan."
-                                  f"( {time_now_str} )")
-
-                            io_list.loc[j, 'Open position updated'] = True
-                            io_list.loc[j, 'Open position updated [time]'] = time_now_str
-
-                    # Updating new positions that did not execute
-                    elif not io_list['Open position'][j] and not io_list['Crossed buy price'][j] and \
-                            (
-                                io_list_update['Entry price [$]'][j] != io_list['Entry price [$]'][j] or
-                                io_list_update['Stop price [$]'][j] != io_list['Stop price [$]'][j] or
-                                io_list_update['Quantity [#]'][j] != io_list['Quantity [#]'][j] or
-                                io_list_update['Buy limit price [$]'][j] != io_list['Buy limit price [$]'][j] or
-                                io_list_update['Profit taker price [$]'][j] != io_list['Profit taker price [$]'][j] or
-                                io_list_update['Sell on close'][j] != io_list['Sell on close'][j] or
-                                io_list_update['Stop low of day'][j] != io_list['Stop low of day'][j] or
-                                (not (pd.isna(io_list_update['Sell bellow SMA [$]'][j]) and pd.isna(
-                                    io_list['Sell bellow SMA [$]'][j]))
-                                 and io_list_update['Sell bellow SMA [$]'][j] != io_list['Sell bellow SMA [$]'][j])
-
-                            ):
-
-                        io_list.loc[j, 'Entry price [$]'] = io_list_update['Entry price [$]'][j]
-                        io_list.loc[j, 'Stop price [$]'] = io_list_update['Stop price [$]'][j]
-                        io_list.loc[j, 'Quantity [#]'] = io_list_update['Quantity [#]'][j]
-                        io_list.loc[j, 'Buy limit price [$]'] = io_list_update['Buy limit price [$]'][j]
-                        io_list.loc[j, 'Profit taker price [$]'] = io_list_update['Profit taker price [$]'][j]
-                        io_list.loc[j, 'Sell on close'] = io_list_update['Sell on close'][j]
-                        io_list.loc[j, 'Stop low of day'] = io_list_update['Stop low of day'][j]
-                        io_list.loc[j, 'Sell bellow SMA [$]'] = io_list_update['Sell bellow SMA [$]'][j]
-
-                        print(f"\nStock ID: {j} {io_list['Symbol'][j]} - New position data is updated acc. to new plan."
-                              f"( {time_now_str} )")
-
-                        io_list.loc[j, 'New position updated'] = True
-                        io_list.loc[j, 'New position updated [time]'] = time_now_str
-
-        # Stocks meeting these criteria are skipped and shall only prevent the code from "falling asleep"
-        # Recommended to use Crypto here due to 24/7 trading
-        if io_list['Entry price [$]'][reqId] == 9 and io_list['Stop price [$]'][reqId] == 11:
-            if not io_list['Stop undercut'][reqId]:
-                io_list.loc[reqId, 'Stop undercut'] = True
-            return
+                        self.cancelOrder(int(positions[j].profit_order_id), OrderCancel())
+
+                    if trimmed_quantity:
+                        # Shoot market sell order
+                        order = MyOrders.sell_market_order(self.nextOrderId(), positions[j], trimmed_quantity)
+                        self.placeOrder(order.orderId, contract, order)
 
-        # Checks if price undercuts stop and sets value as True in case
-        if io_list['LAST price [$]'][reqId] < io_list['Stop price [$]'][reqId] and \
-                not io_list['Stop undercut'][reqId]:
-            io_list.loc[reqId, 'Stop undercut'] = True
-            io_list.loc[reqId, 'Stop undercut [time]'] = time_now_str
-            print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} has undercut the stop. ( {time_now_str} )")
+                        if updates[j].quantity == 0:
+                            positions[j].stock_sold = True
+                            positions[j].stock_sold_time = clock.now_str()
+                            print(f"\nStock ID: {j} {positions[j].symbol} completely sold. ( {clock.now_str()} )")
 
-        # Only continues if all relevant data points are defined and parameters given
-        if pd.isnull(percent_invested) or portfolio_size is None or percent_invested is None or \
-                io_list['Position below limit'][reqId] or io_list['Max. daily loss reached'][reqId]:
+                # Updating new positions that did not execute
+                elif not positions[j].open_position and not positions[j].crossed_buy_price and \
+                        (
+                            updates[j].entry_price != positions[j].entry_price or
+                            updates[j].stop_price != positions[j].stop_price or
+                            updates[j].quantity != positions[j].quantity or
+                            updates[j].buy_limit_price != positions[j].buy_limit_price or
+                            updates[j].profit_taker_price != positions[j].profit_taker_price or
+                            updates[j].sell_on_close != positions[j].sell_on_close or
+                            updates[j].stop_low_of_day != positions[j].stop_low_of_day or
+                            (not (pd.isna(updates[j].sell_below_sma) and pd.isna(
+                                positions[j].sell_below_sma))
+                             and updates[j].sell_below_sma != positions[j].sell_below_sma)
+
+                        ):
+
+                    positions[j].entry_price = updates[j].entry_price
+                    positions[j].stop_price = updates[j].stop_price
+                    positions[j].quantity = updates[j].quantity
+                    positions[j].buy_limit_price = updates[j].buy_limit_price
+                    positions[j].profit_taker_price = updates[j].profit_taker_price
+                    positions[j].sell_on_close = updates[j].sell_on_close
+                    positions[j].stop_low_of_day = updates[j].stop_low_of_day
+                    positions[j].sell_below_sma = updates[j].sell_below_sma
+
+                    print(f"\nStock ID: {j} {positions[j].symbol} - New position data is updated acc. to new plan."
+                          f"( {clock.now_str()} )")
+
+                    # A released row gets its market data again if the new plan allows it to act
+                    if market_data_subscriptions.is_finished(j) and not MyUtilities.is_row_finished(positions[j]):
+                        self.subscribe_market_data(j)
+
+                    positions[j].new_position_updated = True
+                    positions[j].new_position_updated_time = clock.now_str()
+
+    # Moves the market session forward at each of its boundaries and re-evaluates all active rows,
+    # so that quiet stocks get their close-of-day handling on time
+    def on_session_timer(self):
+        with io_list_lock:
+            market_session.update(clock.epoch())
+
+        active_rows = market_data_subscriptions.active_rows()
+        rule_engine.notify_rows(active_rows, SESSION_EVENT)
+
+        for req_id in active_rows:
+            tick_queue.mark_dirty(req_id)
+
+    # Re-arms itself every 10 seconds and stops working 5 minutes before the close
+    def on_plan_reload_timer(self):
+        if market_session.passed(PLAN_FREEZE):
             return
 
-        # When buy price is crossed and field is still empty means crosses the price the first time
-        # Two-step entries are excluded, but OR grants access within first minute to check on lower spread/ price
-        # to enter
-
-        if (
-                io_list['LAST price [$]'][reqId] > io_list['Entry price [$]'][reqId] and
-                not io_list['Open position'][reqId] and not io_list['Crossed buy price'][reqId] and
-                not io_list['Order executed'][reqId]
-        ) or \
-                (
-                        io_list['Crossed buy price'][reqId] and not io_list['Order executed'][reqId] and
-                        time_now < market_opening + datetime.timedelta(minutes=1)
-                ):
+        if is_market_open:
+            with io_list_lock:
+                self.reload_daily_trading_plan()
+                row_lifecycle.sync_all(positions)
+                symbol_index.sync_all(positions)
+                risk_ledger.sync_all(positions)
+                MyOrders.order_index.add_rows(positions)
+                self.prepare_entry_templates()
+                batch_evaluator.refresh(positions)
+                rule_engine.notify_rows(range(len(positions)), PLAN_CHANGED)
+
+        scheduler.call_later(10, self.on_plan_reload_timer, key='plan reload')
+
+    # Builds the entry brackets of all waiting rows ahead, so that the breakout only sets order IDs and GTD
+    # Rows of the plan whose prices or quantity did not change keep their bracket
+    def prepare_entry_templates(self):
+        if market_session is None:
+            return
 
-            # Marks "crossed buy price" only once
-            if not io_list['Crossed buy price'][reqId]:
-                io_list.loc[reqId, 'Crossed buy price'] = True
-                io_list.loc[reqId, 'Crossed buy price [time]'] = time_now_str
-                if io_list.loc[reqId, 'Stop undercut']:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} crossed buy price,"
-                          f" but stop is already undercut. ( {time_now_str} )")
-                else:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} crossed buy price. ( {time_now_str} )")
-                io_list.loc[reqId, "Stop timestamp"] = datetime.datetime.now(tz=None)
-
-            entry_price = io_list['Entry price [$]'][reqId]
-            stop_price = io_list['Stop price [$]'][reqId]
-            qty_full = io_list['Quantity [#]'][reqId]
-
-            if not limit_absolute_risk:
-                # ---------------------------------------------
-                # Option A: limit by %-invested (as per previous code versions)
-                # ---------------------------------------------
-                if entry_price / EXR_RATE * qty_full / portfolio_size + percent_invested > percent_invested_max:
-
-                    # Reduces the size of the position to stay within the investment limit
-                    io_list.loc[reqId, 'Quantity [#]'] = math.floor(
-                        (percent_invested_max - percent_invested) * portfolio_size
-                        / (entry_price / EXR_RATE)
-                    )
-
-                    io_list.loc[reqId, 'Invest limit reached'] = True
-                    io_list.loc[reqId, 'Invest limit reached [time]'] = time_now_str
-
-                    # Very small resulting positions shall not be traded
-                    if io_list['Quantity [#]'][reqId] * entry_price < MIN_POSITION_SIZE * portfolio_size:
-                        io_list.loc[reqId, 'Position below limit'] = True
-                        print(
-                            f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily investment limit - "
-                            f"remainder is below the minimum position size of {round(MIN_POSITION_SIZE * 100, 1)}"
-                            f"% - trade not executed. ( {time_now_str} )"
-                        )
-                        return
+        for position in positions:
+            if MyUtilities.is_waiting_for_entry(position):
+                MyOrders.prepare_bracket(position, ib_timezone_str, market_session.close)
+            else:
+                MyOrders.entry_templates.discard(position.req_id)
+
+    # Scheduled at close + 3 min
+    def shutdown(self):
+        global strategy_loop_running
+
+        print("Code attempting to shut down. ( ", clock.now_str(), " )")
+
+        if fetch_stock_data_thread is not None and fetch_stock_data_thread.is_alive():
+            fetch_stock_data_thread.join()
+
+            print("Threads joined. ( ", clock.now_str(), " )")
+
+        # Ends the strategy loop, the scheduler and app.run() in the main thread
+        print("Finally exit. ( ", clock.now_str(), " )")
+        strategy_loop_running = False
+        scheduler.stop()
+        order_gateway.stop()
+        self.disconnect()
+
+    # Evaluates each dirty row once per cycle, independent of how many ticks arrived for it
+    def strategy_loop(self):
+        print("\nStrategy loop is started.\n")
+
+        while strategy_loop_running:
+            dirty_rows = tick_queue.drain(timeout=1)
+            if not dirty_rows:
+                continue
+
+            # Predicates of all rows in one pass, taken before any row of this cycle is evaluated
+            with io_list_lock:
+                signals = batch_evaluator.evaluate(quote_board.snapshot().values, MAX_STOCK_SPREAD,
+                                                   SELL_HALF_REVERSAL_RULE, SELL_FULL_REVERSAL_RULE,
+                                                   market_session is not None and
+                                                   not market_session.passed(FIRST_MINUTE_END))
+
+            for reqId in dirty_rows:
+                with io_list_lock:
+                    if self.needs_evaluation(reqId, signals):
+                        self.evaluate_rules(reqId)
+                        row_lifecycle.sync(positions, reqId)
+                        symbol_index.sync(positions, reqId)
+                        risk_ledger.sync(positions, reqId)
+                        batch_evaluator.refresh(positions, [reqId])
+                        self.release_finished_row(reqId)
+
+                if not strategy_loop_running:
+                    break
+
+        print("Tick queue:", tick_queue.stats())
+        print("Batch evaluator:", batch_evaluator.stats())
+        print(rule_engine.report())
+        print("Risk ledger:", risk_ledger.stats())
+        print("PnL:", pnl_table.stats())
+        print(pnl_table.table())
+        print("Executions:", execution_ledger.stats())
+        print("Order index:", MyOrders.order_index.stats())
+        print("Bracket adjustments:", MyOrders.protective_orders.stats())
+        print("Entry templates:", MyOrders.entry_templates.stats())
+        print(execution_ledger.table())
+        print("Bars:", bar_aggregator.stats())
+        print("Indicators:", indicator_engine.stats())
+        print("Scheduler:", scheduler.stats())
+        print("Order gateway:", order_gateway.stats())
+        print(row_lifecycle.report())
+        print(market_data_subscriptions.status())
+
+    # Waiting and protected rows only act on a price predicate until the plan freezes before the close, all other
+    # phases and the start of the session (fetch thread, portfolio check) always get their rule pass
+    def needs_evaluation(self, reqId, signals):
+        if not (is_market_open and fetch_data_triggered and open_positions_check_done) or \
+                market_session.passed(PLAN_FREEZE):
+            return True
+
+        if row_lifecycle.phase(reqId) not in (WAITING, PROTECTED, PARTIALLY_SOLD):
+            return True
+
+        return batch_evaluator.needs_action(signals, reqId)
+
+    def evaluate_rules(self, reqId):
+        global fetch_data_triggered
+        global market_open_print_timestamp
+        global fetch_stock_data_thread
+        global open_positions_check_done
 
-                    print(
-                        f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily investment limit. "
-                        f"Position size has been reduced. ( {time_now_str} )"
-                    )
+        now = clock.epoch()
+        position = positions[reqId]
 
-            else:
-                # --------------------------------------------------
-                # Option B: limit by absolute risk (new functionality)
-                # --------------------------------------------------
-
-                # 1) Risk already taken today by new, filled positions
-                # "Open position" == False -> not carried into the day
-                # "Order filled" == True   -> new buy-order has been filled
-                mask_new_filled = (~io_list['Open position']) & (io_list['Order filled'])
-
-                current_abs_risk = (
-                        (io_list.loc[mask_new_filled, 'Entry price [$]'] - io_list.loc[
-                            mask_new_filled, 'Stop price [$]'])
-                        * io_list.loc[mask_new_filled, 'Quantity [#] at open']
-                ).sum()
-
-                # 2) Risk of this order at full size (already in account currency)
-                per_share_risk_base = entry_price - stop_price
-                order_risk_full = per_share_risk_base * qty_full
-
-                print(
-                    f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} position has an additional risk of "
-                    f"{round(order_risk_full, 0)}. New risk taken today is {round(current_abs_risk, 0)}. "
-                    f"( {time_now_str} )"
-                )
+        if now > time_algo_starts + 60 and not open_positions_check_done:
+            MyUtilities.compare_positions_currency_specific(open_positions_iOList, positions)
+            open_positions_check_done = True
 
-                # If this order at full size would exceed the absolute risk limit
-                if current_abs_risk + order_risk_full > risk_abs_max:
+        # Continues only when market_hours are defined
+        if market_session is None:
+            return
 
-                    max_risk_remaining = risk_abs_max - current_abs_risk
+        # Publishes the boundaries passed since the last tick (open, pause, close, ...) to on_market_session_event()
+        market_session.update(now)
 
-                    if max_risk_remaining <= 0:
-                        # No risk budget left at all -> don't trade
-                        io_list.loc[reqId, 'Invest limit reached'] = True
-                        io_list.loc[reqId, 'Invest limit reached [time]'] = time_now_str
-                        print(
-                            f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily absolute risk limit "
-                            f"of {round(risk_abs_max, 0)} - no risk budget left, trade not executed. ( {time_now_str} )"
-                        )
-                        return
-
-                    # 3) Reduce quantity to fit into remaining risk budget
-                    allowed_qty = math.floor(max_risk_remaining / per_share_risk_base)
-
-                    # If we can't even buy 1 share within the remaining risk
-                    if allowed_qty <= 0:
-                        io_list.loc[reqId, 'Invest limit reached'] = True
-                        io_list.loc[reqId, 'Invest limit reached [time]'] = time_now_str
-                        io_list.loc[reqId, 'Position below limit'] = True
-                        print(
-                            f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily absolute risk limit "
-                            f"of {round(risk_abs_max, 0)} - remainder is below the minimum position size of "
-                            f"{round(MIN_POSITION_SIZE * 100, 1)}% - trade not executed. ( {time_now_str} )"
-                        )
-                        return
-
-                    # Apply reduced quantity
-                    io_list.loc[reqId, 'Quantity [#]'] = allowed_qty
-                    io_list.loc[reqId, 'Invest limit reached'] = True
-                    io_list.loc[reqId, 'Invest limit reached [time]'] = time_now_str
-
-                    # Very small resulting positions shall not be traded
-                    if allowed_qty * entry_price < MIN_POSITION_SIZE * portfolio_size:
-                        io_list.loc[reqId, 'Position below limit'] = True
-                        print(
-                            f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily absolute risk limit "
-                            f"of {round(risk_abs_max, 0)} - remainder is below the minimum position size of "
-                            f"{round(MIN_POSITION_SIZE * 100, 1)}% - trade not executed. ( {time_now_str} )"
-                        )
-                        return
-
-                    print(
-                        f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} would exceed my daily absolute risk limit "
-                        f"of {round(risk_abs_max, 0)}. "
-                        f"Position size has been reduced to {allowed_qty}. ( {time_now_str} )"
-                    )
-
-            # Terminates all buying if daily loss limit is reached
-            if max_daily_loss_reached:
-                io_list.loc[reqId, 'Max. daily loss reached'] = True
-                io_list.loc[reqId, 'Max. daily loss reached [time]'] = time_now_str
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} not executed - daily max. loss of "
-                      f"{round(MAX_ALLOWED_DAILY_PNL_LOSS * 100, 1)}% is reached. ( {time_now_str} ")
-                return
+        # Start function fetch_stock_data() only once
+        if not fetch_data_triggered and is_market_open:
+            fetch_stock_data_thread = threading.Thread(target=self.fetch_stock_data, daemon=False)
+            fetch_stock_data_thread.start()
+            fetch_data_triggered = True
 
-            stock_spread = abs((io_list['ASK price [$]'][reqId] - io_list['BID price [$]'][reqId])
-                               / io_list['ASK price [$]'][reqId])
-            io_list.loc[reqId, 'Spread at execution [%]'] = round(stock_spread * 100, 2)
-
-            # Provides feedback to cmd prompt when stock is above price or spread limit
-            # In the first minutes, a message is only printed every 10 seconds
-            # Only prints this message if stock is already looping for 10 sec. (small inaccuracy to CMD prompt)
-            if time_now < market_opening + datetime.timedelta(minutes=1) and io_list["Stop timestamp"][reqId] <= \
-                    datetime.datetime.now(tz=None) - datetime.timedelta(seconds=10):
-
-                io_list.loc[reqId, "Stop timestamp"] = datetime.datetime.now(tz=None)
-
-                if io_list['LAST price [$]'][reqId] >= io_list['Buy limit price [$]'][reqId]:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - LAST price is above buy limit -"
-                          f"stock loops within first minutes. ( {time_now_str} )")
-                    io_list.loc[reqId, 'Stock looped'] = True
-
-                if stock_spread > MAX_STOCK_SPREAD:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - Spread is above limit at:"
-                          f"{round(stock_spread * 100, 2)}% - stock loops within first minutes. ( {time_now_str} )")
-                    io_list.loc[reqId, 'Stock looped'] = True
-
-            elif market_opening + datetime.timedelta(minutes=1) <= time_now < market_close:
-
-                if io_list['LAST price [$]'][reqId] >= io_list['Buy limit price [$]'][reqId]:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - LAST price is above buy limit."
-                          f"( {time_now_str} )")
-
-                if stock_spread > MAX_STOCK_SPREAD:
-                    print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - Spread is above limit at: "
-                          f"{round(stock_spread * 100, 2)}%. ( {time_now_str} )")
-
-            # Provides feedback to DailyTradingPlan if stock is above price or spread limit
-            if io_list['LAST price [$]'][reqId] >= io_list['Buy limit price [$]'][reqId]:
-                io_list.loc[reqId, 'Price above limit'] = True
-
-            if stock_spread > MAX_STOCK_SPREAD:
-                io_list.loc[reqId, 'Spread above limit'] = True
-
-            # Checks 1) if stop has not already been undercut, 2) if stock price is still below the buy limit price,
-            # 3) spread < MAX_STOCK_SPREAD
-            if not io_list['Stop undercut'][reqId] and \
-                    io_list['LAST price [$]'][reqId] < io_list['Buy limit price [$]'][reqId] and \
-                    stock_spread < MAX_STOCK_SPREAD:
-
-                io_list.loc[reqId, 'Order executed'] = True
-                io_list.loc[reqId, 'Order executed [time]'] = time_now.strftime("%y%m%d %H:%M:%S")
-
-                # Blocks execution of buy order shortly before market close for "sell on close" stock
-                # 5 minutes since at t-4min the SOC brackets get replaced and t-3min the sells are done
-                if time_now > market_close - (datetime.timedelta(minutes=5)) and io_list['Sell on close'][reqId]:
-                    print(
-                        f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} shall be sold on close - buy not executed."
-                        f"( {time_now_str} )")
-
-                    return
-
-                if io_list['Stop low of day'][reqId] and \
-                        io_list['LOW price [$]'][reqId] > io_list['Stop price [$]'][reqId]:
-
-                    stop_risk_abs = (io_list['Entry price [$]'][reqId] - io_list['Stop price [$]'][reqId]) * \
-                                         io_list['Quantity [#]'][reqId]
-
-                    # Uses half of the original risk or low of day, whatever is wider
-                    # within first 10 Minutes of trading and the low of day thereafter
-                    if time_now < market_opening + datetime.timedelta(minutes=10):
-                        risk_per_share = io_list['Entry price [$]'][reqId] - io_list['Stop price [$]'][reqId]
-                        risk_per_share_halved = risk_per_share / 2
-                        risk_per_share_LoD = io_list['LAST price [$]'][reqId] - io_list['LOW price [$]'][reqId]
-
-                        if risk_per_share_halved >= risk_per_share_LoD:
-                            io_list.loc[reqId, 'Stop price [$]'] = io_list['Entry price [$]'][reqId] - \
-                                                                   risk_per_share_halved
-                            print(
-                                f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} crossed buy price within "
-                                f"first 10 minutes and therefore uses 50% of original risk instead of low of day. "
-                                f"{io_list['Stop price [$]'][reqId]} is the stop loss price. ( {time_now_str} )")
-                        else:
-                            io_list.loc[reqId, 'Stop price [$]'] = io_list['LOW price [$]'][reqId]
-                            print(
-                                f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} crossed buy price within "
-                                f"first 10 minutes - still used low of day as stop due to its width. "
-                                f"{io_list['Stop price [$]'][reqId]} is the stop loss price. ( {time_now_str} )")
-                    else:
-                        io_list.loc[reqId, 'Stop price [$]'] = io_list['LOW price [$]'][reqId]
-                        print(
-                            f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} uses low of the day of "
-                            f"{io_list['Stop price [$]'][reqId]} as stop loss price. ( {time_now_str} )")
-
-                    # Adjust position size to match pre-defined absolute risk
-                    new_quantity = stop_risk_abs / (io_list['LAST price [$]'][reqId] - io_list['Stop price [$]'][reqId])
-                    print(
-                        f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} buy quantity changed from "
-                        f"{io_list['Quantity [#]'][reqId]} to {round(new_quantity, 0)}. ( {time_now_str} )")
-                    print("### Attention ### Do not unintentionally overwrite buy quantity for open position.")
-                    io_list.loc[reqId, 'Quantity [#]'] = round(new_quantity, 0)
-
-                    MyUtilities.dailytradingplan_update(reqId, io_list['Stop price [$]'][reqId],
-                                                        io_list['Quantity [#]'][reqId], NAME_OF_DAILYTRADINGPLAN)
-
-                contract = MyUtilities.get_contract_details(io_list, reqId)
-                bracket, io_list = MyOrders.bracket_order(self.nextOrderId(), reqId, TIMEZONE, ib_timezone_str,
-                                                          market_close, io_list)
-                for o in bracket:
-                    self.placeOrder(o.orderId, contract, o)
-                    self.nextOrderId()
-
-                io_list.loc[reqId, 'Spread at execution [%]'] = round(stock_spread * 100, 2)
-                io_list.loc[reqId, 'Quantity [#] at open'] = io_list.loc[reqId, 'Quantity [#]']
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - Order placed. ( {time_now_str} )")
-
-        # Add & reduce function
-        # Increases the stop of all open positions when additional shares are added
-        if daily_brackets_submitted and io_list['Add and reduce'][reqId] and \
-                not io_list['Add and reduce executed'][reqId] and io_list['Order filled'][reqId]:
-
-            for i in range(len(io_list)):
-                if (
-                        (
-                                not io_list['Open position'][i] and io_list['Order filled'][i] and
-                                not io_list['Stock sold'][i]
-                        ) or
-                        (
-                                io_list['Open position'][i] and not io_list['Stock sold'][i]
-                        )
-                ) and io_list['Symbol'][i] == io_list['Symbol'][reqId]:
-
-                    # Cancel current bracket oder
-                    self.cancelOrder(int(io_list['profitOrderId'][i]), OrderCancel())
-
-                    # Place new OCA profit taker with adjusted stop loss
-                    contract = MyUtilities.get_contract_details(io_list, i)
-                    total_quantity = round(io_list['Quantity [#]'][i], 0)
-                    lmt_price = round(io_list['Profit taker price [$]'][i], 2)
-                    aux_price = round(io_list['Stop price [$]'][reqId], 2)
-                    oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, i,
-                                                            TIMEZONE, ib_timezone_str, market_close, io_list)
-                    for o in oca:
-                        self.placeOrder(o.orderId, contract, o)
-                        self.nextOrderId()
-
-                    # Changes stop price in io_list
-                    io_list.loc[i, 'Stop price [$]'] = aux_price
-
-                    # Changes stop price in DailyTradingPlan
-                    MyUtilities.dailytradingplan_update(i, aux_price, io_list['Quantity [#]'][i],
-                                                        NAME_OF_DAILYTRADINGPLAN)
-
-                    print(f"\nStock ID: {i} {io_list['Symbol'][i]} - Add and reduce executed. ( {time_now_str} )")
-
-            io_list.loc[reqId, 'Add and reduce executed'] = True
-
-        # Sells half of positions if stock is increasing X% over buy point and coming back in to b/e
-        # First, marker to be set if buy price increases X% after buy (see SELL_HALF_REVERSAL_RULE)
-        if not io_list['Open position'][reqId] and io_list['Order filled'][reqId] and \
-                not io_list['2% above buy point'][reqId] and \
-                io_list['LAST price [$]'][reqId] > io_list['Entry price [$]'][reqId] * (
-                1 + SELL_HALF_REVERSAL_RULE):
-
-            execution_timestamp = datetime.datetime.strptime(io_list['Order executed [time]'][reqId], "%y%m%d %H:%M:%S")
-            tz = pytz.timezone(TIMEZONE)
-            execution_timestamp = tz.normalize(tz.localize(execution_timestamp))
-            print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} increased {SELL_HALF_REVERSAL_RULE * 100}% "
-                  f"above buy price - Sell-half-rule activated. ( {time_now_str} )")
-
-            # Sets marker only if stock buy order was placed more than 2.5 minutes ago
-            if (time_now - execution_timestamp).seconds > 150:
-                io_list.loc[reqId, '2% above buy point'] = True
-
-        # Second, if stock comes in again to b/o level, 50% must be sold, bracket cancelled
-        # New OCA profit taker and stop loss to be set for 50% of quantity
-        if not io_list['Open position'][reqId] and io_list['Order filled'][reqId] and \
-                io_list['2% above buy point'][reqId] and not io_list['New OCA bracket'][reqId] and \
-                not io_list['Stock sold'][reqId] and not io_list['5% above buy point'][reqId] and \
-                io_list['LAST price [$]'][reqId] <= \
-                io_list['Entry price [$]'][reqId] * (1 + io_list['Spread at execution [%]'][reqId] / 100) and \
-                round(io_list['Quantity [#]'][reqId], 0) > 1:
-
-            # Cancels current bracket oder
-            self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-            # Shoot market sell order for 50%
-            contract = MyUtilities.get_contract_details(io_list, reqId)
-            total_quantity = math.ceil(round(io_list['Quantity [#]'][reqId], 0) / 2)
-            order, io_list = MyOrders.sell_market_order(self.nextOrderId(), reqId, total_quantity, io_list)
-            self.placeOrder(order.orderId, contract, order)
+        minutes_to_market_open = market_session.seconds_to_open(now) / 60
 
-            print(
-                f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} increased {round(SELL_HALF_REVERSAL_RULE * 100, 1)}% "
-                f"above buy price and came in to B/O level - sold half. ( {time_now_str} )")
-
-            # Place new OCA profit taker and stop loss for 50% quantity
-            total_quantity = math.floor(round(io_list['Quantity [#]'][reqId], 0) / 2)
-            lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-            aux_price = round(io_list['Stop price [$]'][reqId], 2)
-            oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                    TIMEZONE, ib_timezone_str, market_close, io_list)
-            for o in oca:
-                self.placeOrder(o.orderId, contract, o)
-                self.nextOrderId()
-            io_list.loc[reqId, 'New OCA bracket'] = True
-            io_list.loc[reqId, 'New OCA bracket [time]'] = time_now_str
-            io_list.loc[reqId, 'Quantity [#]'] = total_quantity
-
-        # Function increases stop to b/e if stock gained Y% over buy point
-        # Marker to be set if buy price increases Y% after buy (see SELL_FULL_REVERSAL_RULE)
-        if not io_list['Open position'][reqId] and io_list['Order filled'][reqId] and \
-                not io_list['Stock sold'][reqId] and not io_list['5% above buy point'][reqId] and \
-                io_list['LAST price [$]'][reqId] > io_list['Entry price [$]'][reqId] * (
-                1 + SELL_FULL_REVERSAL_RULE):
-
-            execution_timestamp = datetime.datetime.strptime(io_list['Order executed [time]'][reqId], "%y%m%d %H:%M:%S")
-            tz = pytz.timezone(TIMEZONE)
-            execution_timestamp = tz.normalize(tz.localize(execution_timestamp))
-
-            # Exits if order was place less than 2.5 minutes ago
-            if (time_now - execution_timestamp).seconds < 150:
-                return
+        # Rows appended by a plan reload are evaluated once the message loop added them to the quote board
+        if reqId >= quote_board.n_rows:
+            return
 
-            io_list.loc[reqId, '5% above buy point'] = True
-            io_list.loc[reqId, '5% above buy point [time]'] = time_now_str
-
-            # Cancel current bracket oder
-            self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-            # Place new OCA profit taker and stop loss with stop at B/E
-            contract = MyUtilities.get_contract_details(io_list, reqId)
-            total_quantity = round(io_list['Quantity [#]'][reqId], 0)
-            lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-            aux_price = round(io_list['Entry price [$]'][reqId], 2)
-            oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                    TIMEZONE, ib_timezone_str, market_close, io_list)
-            for o in oca:
-                self.placeOrder(o.orderId, contract, o)
-                self.nextOrderId()
-            io_list.loc[reqId, 'Stop price [$]'] = io_list['Entry price [$]'][reqId]
-
-            # Changes stop price in DailyTradingPlan
-            MyUtilities.dailytradingplan_update(reqId, aux_price, io_list['Quantity [#]'][reqId],
-                                                NAME_OF_DAILYTRADINGPLAN)
-
-            print("\nStock ID:", reqId, io_list['Symbol'][reqId],
-                  "increased", round(SELL_FULL_REVERSAL_RULE * 100, 1),
-                  "% above buy price - stop is increased to B/E. (",
-                  time_now_str, ")")
-
-        # SOC SMA Function: Cancels open orders and places new bracket without sell on close order
-        if time_now > market_close - (datetime.timedelta(minutes=4)) and \
-                not io_list['Stock sold'][reqId] and io_list['Sell on close'][reqId] and \
-                pd.notna(io_list['Sell bellow SMA [$]'][reqId]) and \
-                io_list['Profit taker price [$]'][reqId] > io_list['LAST price [$]'][reqId] > \
-                io_list['Stop price [$]'][reqId] and \
-                io_list['LAST price [$]'][reqId] > io_list['Sell bellow SMA [$]'][reqId] and \
-                (
-                        (
-                                not io_list['Open position'][reqId] and io_list['Order filled'][reqId]
-                        ) or
-                        io_list['Open position'][reqId]
-                ):
+        # Rule blocks registered for the current phase of the row
+        rules = row_lifecycle.rules(reqId)
+
+        # Account and session state read by the rules of this pass
+        rule_context.refresh(self, now, market_session, ib_timezone_str, is_market_open, percent_invested,
+                             portfolio_size, max_daily_loss_reached)
+        changed = rule_engine.changed_inputs(reqId)
+
+        # Place brackets around open positions (runs before the open too, to cancel the orders of the last session)
+        if rule_engine.run(rule_context, position, rules, PRE_OPEN_RULES, changed) == STOP_PASS:
+            return
 
-            # Important so that he places a bracket without SOC order
-            io_list.loc[reqId, 'Sell on close'] = False
-
-            # Cancels current bracket oder
-            self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-            # Place new bracket without GAT portion
-            contract = MyUtilities.get_contract_details(io_list, reqId)
-            total_quantity = round(io_list['Quantity [#]'][reqId], 0)
-            lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-            aux_price = round(io_list['Stop price [$]'][reqId], 2)
-            oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                    TIMEZONE, ib_timezone_str, market_close, io_list)
-            for o in oca:
-                self.placeOrder(o.orderId, contract, o)
-                self.nextOrderId()
-
-            print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} - Sell on close order deleted since last price "
-                  f"{round(io_list['LAST price [$]'][reqId], 2)} is above sell limit of "
-                  f"{round(io_list['Sell bellow SMA [$]'][reqId], 2)}. ( {time_now_str} )")
-
-        # Sells half of the position if stock does not close in the upper Z% of the daily range
-        # This function is working only when sell-half and sell-full rules have not been triggered
-        if time_now > market_close - (datetime.timedelta(minutes=2)) and \
-                not io_list['Bad close checked'][reqId]:
-
-            io_list.loc[reqId, 'Bad close checked'] = True
-
-            if not io_list['Open position'][reqId] and \
-                    io_list['Order filled'][reqId] and not io_list['Stock sold'][reqId] and \
-                    not io_list['Sell on close'][reqId] and pd.isnull(io_list['Sell bellow SMA [$]'][reqId]) and \
-                    not io_list['5% above buy point'][reqId] and not io_list['New OCA bracket'][reqId] and \
-                    not io_list['Bad close rule'][reqId] and round(io_list['Quantity [#]'][reqId], 0) > 1 and \
+        # Only continues if market_hours are defined and markets are open (reports every minute)
+        if not is_market_open and not market_session.passed(SHUTDOWN):
+
+            # Prints message more often the closer it gets to market opening
+            if (
+                    minutes_to_market_open > 15 and market_open_print_timestamp + 15 * 60 < now
+            ) or \
                     (
-                            (io_list['LAST price [$]'][reqId] - io_list['LOW price [$]'][reqId]) /
-                            (io_list['HIGH price [$]'][reqId] - io_list['LOW price [$]'][reqId]) < BAD_CLOSE_RULE
+                            15 >= minutes_to_market_open > 2 and
+                            market_open_print_timestamp + 3 * 60 < now
+                    ) or \
+                    (
+                            2 >= minutes_to_market_open and market_open_print_timestamp + 30 < now
                     ):
+                print(f"\nMarkets not open. ( {clock.now_str()} )")
 
-                # Cancels current bracket oder
-                self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-                # Shoot market sell order for 50%
-                contract = MyUtilities.get_contract_details(io_list, reqId)
-                total_quantity = math.ceil(round(io_list['Quantity [#]'][reqId], 0) / 2)
-                order, io_list = MyOrders.sell_market_order(self.nextOrderId(), reqId, total_quantity, io_list)
-                self.placeOrder(order.orderId, contract, order)
-
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} attempts a bad close - sold half. "
-                      f"( {time_now_str} )")
-
-                total_quantity = math.floor(round(io_list['Quantity [#]'][reqId], 0) / 2)
-                lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-                aux_price = round(io_list['Stop price [$]'][reqId], 2)
-                oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                        TIMEZONE, ib_timezone_str, market_close, io_list)
-                for o in oca:
-                    self.placeOrder(o.orderId, contract, o)
-                    self.nextOrderId()
-                io_list.loc[reqId, 'Bad close rule'] = True
-                io_list.loc[reqId, 'Bad close rule [time]'] = time_now_str
-                io_list.loc[reqId, 'Quantity [#]'] = total_quantity
-
-        # Sells the position 2 minutes before the close if it is negative on day 1
-        if time_now > market_close - (datetime.timedelta(minutes=2)) and io_list['Sell negative on day 1'][reqId] and \
-                not io_list['Negative close checked'][reqId]:
-
-            io_list.loc[reqId, 'Negative close checked'] = True
-
-            if not io_list['Open position'][reqId] and \
-                    io_list['Order filled'][reqId] and not io_list['Stock sold'][reqId] and \
-                    not io_list['Sell on close'][reqId] and pd.isnull(io_list['Sell bellow SMA [$]'][reqId]) and \
-                    io_list['LAST price [$]'][reqId] < io_list['Entry price [$]'][reqId]:
-
-                # Cancels current bracket oder
-                self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-                # Shoot market sell order
-                contract = MyUtilities.get_contract_details(io_list, reqId)
-                total_quantity = io_list['Quantity [#]'][reqId]
-                order, io_list = MyOrders.sell_market_order(self.nextOrderId(), reqId, total_quantity, io_list)
-                self.placeOrder(order.orderId, contract, order)
-                io_list.loc[reqId, 'Quantity [#]'] = 0
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} attempts to close negative - stock sold. "
-                      f"( {time_now_str} )")
-                io_list.loc[reqId, 'Stock sold'] = True
-                io_list.loc[reqId, 'Stock sold [time]'] = time_now_str
-
-        # Sells 1/x of the position for profit at x-R on day 1 to cushion risk
-        if (pd.notna(io_list['Profit at x-R'][reqId]) and not io_list['Open position'][reqId] and \
-                    io_list['Order filled'][reqId] and not io_list['Stock sold'][reqId] and \
-                    not io_list['x-R profits'][reqId]):
-
-            if io_list['Profit at x-R'][reqId] <= 0:
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} x-R multiple must be positive and >0. "
-                      f"( {time_now_str} )")
-                io_list.loc[reqId, 'x-R profits'] = True
-                return
+                market_open_print_timestamp = now
+
+            return
+
+        # The scheduler shuts the code down at close + 3 min
+        elif market_session.passed(SHUTDOWN):
+            return
+
+        # Rows waiting for a fill or closed for the day have nothing to check
+        if not rules:
+            return
+
+        # Only continues in logic if all relevant data points are already received and market_hours are defined
+        if not quote_board.is_complete(reqId, [LAST_PRICE, ASK_PRICE, BID_PRICE, LOW_PRICE]):
+            return
 
-            stop_risk_rel = (io_list['Entry price [$]'][reqId] - io_list['Stop price [$]'][reqId]) / \
-                            io_list['Entry price [$]'][reqId]
-            profit_price = (io_list['Profit at x-R'][reqId] * stop_risk_rel + 1) * io_list['Entry price [$]'][reqId]
-
-            # Shoot market order for 50% of the position in case first profit target is reached
-            if profit_price <= io_list['LAST price [$]'][reqId]:
-                io_list.loc[reqId, 'x-R profits'] = True
-                # Cancels current bracket oder
-                self.cancelOrder(int(io_list['profitOrderId'][reqId]), OrderCancel())
-
-                # Shoot market sell order for 50%
-                contract = MyUtilities.get_contract_details(io_list, reqId)
-                total_quantity = math.ceil(round(io_list['Quantity [#]'][reqId], 0) / io_list['Profit at x-R'][reqId])
-                order, io_list = MyOrders.sell_market_order(self.nextOrderId(), reqId, total_quantity, io_list)
-                self.placeOrder(order.orderId, contract, order)
-
-                print(f"\nStock ID: {reqId} {io_list['Symbol'][reqId]} reached {io_list['Profit at x-R'][reqId]}-times "
-                      f"risk at {io_list['LAST price [$]'][reqId]} for "
-                      f"{round(io_list['Profit at x-R'][reqId] * 100 * stop_risk_rel, 1)}% profit - "
-                      f"sold 1/{io_list['Profit at x-R'][reqId]}. ( {time_now_str} )")
-
-                total_quantity = round(io_list['Quantity [#]'][reqId], 0) - total_quantity
-                lmt_price = round(io_list['Profit taker price [$]'][reqId], 2)
-                aux_price = round(io_list['Stop price [$]'][reqId], 2)
-                oca, io_list = MyOrders.one_cancels_all(self.nextOrderId(), total_quantity, lmt_price, aux_price, reqId,
-                                                        TIMEZONE, ib_timezone_str, market_close, io_list)
-                for o in oca:
-                    self.placeOrder(o.orderId, contract, o)
-                    self.nextOrderId()
-                io_list.loc[reqId, 'x-R profits [time]'] = time_now_str
-                io_list.loc[reqId, 'Quantity [#]'] = total_quantity
-                MyUtilities.dailytradingplan_update(reqId, io_list['Stop price [$]'][reqId],
-                                                    io_list['Quantity [#]'][reqId], NAME_OF_DAILYTRADINGPLAN)
+        # Entry and exit rules registered for the phase of the row whose inputs changed since its last completed pass
+        if rule_engine.run(rule_context, position, rules, SESSION_RULES, changed) != STOP_PASS:
+            rule_engine.commit(reqId, changed)
 
     @iswrapper
     def tickSize(self, reqId: TickerId, tickType: TickType, size: Decimal):
         super().tickSize(reqId, tickType, size)
         # print("TickSize. TickerId:", req_id, "TickType:", tickType, "Size: ", decimalMaxString(size))
-        global io_list
-        global io_list_copy_for_tick_data
 
-        # Allocates all relevant tickTypes to their respective field
-        io_list, io_list_copy_for_tick_data = MyUtilities.feed_size_io_lists(io_list, io_list_copy_for_tick_data,
-                                                                              TickTypeEnum.toStr(tickType), reqId, size)
+        # Day volume of the contract - its changes are the volume of the bars without tick-by-tick sizes
+        if tickType == TickTypeEnum.VOLUME:
+            indicator_engine.feed_volume(reqId, bar_aggregator.feed_volume(reqId, size))
+
+        # Allocates all relevant tickTypes to their respective field of all rows trading the contract
+        for row in market_data_subscriptions.rows(reqId):
+            quote_board.feed_size(row, tickType, size)
+
+    @iswrapper
+    def tickByTickAllLast(self, reqId: int, tickType: int, time: int, price: float, size: Decimal,
+                          tickAttribLast: TickAttribLast, exchange: str, specialConditions: str):
+        super().tickByTickAllLast(reqId, tickType, time, price, size, tickAttribLast, exchange, specialConditions)
+
+        # Trades outside the session (pre-market, after-hours) and unreported trades are ignored
+        if tickAttribLast.unreported or not self.is_session_trade(time):
+            return
+
+        # Every single trade feeds the last price - high and low of the day stay with the HIGH and LOW ticks of the
+        # aggregated stream
+        ticker_id = market_data_subscriptions.ticker_id_of_tick_by_tick(reqId)
+        bar_aggregator.feed_trade(ticker_id, time, price, size)
+        indicator_engine.feed_trade(ticker_id, price, size)
+        for row in market_data_subscriptions.rows(ticker_id):
+            quote_board.feed_price(row, TickTypeEnum.LAST, price)
+
+            if market_data_subscriptions.is_active(row):
+                tick_queue.mark_dirty(row)
+
+    @iswrapper
+    def tickByTickBidAsk(self, reqId: int, time: int, bidPrice: float, askPrice: float,
+                         bidSize: Decimal, askSize: Decimal, tickAttribBidAsk: TickAttribBidAsk):
+        super().tickByTickBidAsk(reqId, time, bidPrice, askPrice, bidSize, askSize, tickAttribBidAsk)
+
+        # Keeps the spread check on the latest quote
+        ticker_id = market_data_subscriptions.ticker_id_of_tick_by_tick(reqId)
+        for row in market_data_subscriptions.rows(ticker_id):
+            quote_board.feed_price(row, TickTypeEnum.BID, bidPrice)
+            quote_board.feed_price(row, TickTypeEnum.ASK, askPrice)
+            quote_board.feed_size(row, TickTypeEnum.BID_SIZE, bidSize)
+            quote_board.feed_size(row, TickTypeEnum.ASK_SIZE, askSize)
+
+            if market_data_subscriptions.is_active(row):
+                tick_queue.mark_dirty(row)
 
     @iswrapper
     def tickGeneric(self, reqId: TickerId, tickType: TickType, value: float):
@@ -1495,80 +1269,96 @@ class TestApp(TestWrapper, TestClient):
 
     @printWhenExecuting
     def contractOperations(self):
-        for i in range(len(io_list)):
-            contract = MyUtilities.get_contract_details(io_list, i)
+        for i in range(len(positions)):
+            contract = MyUtilities.get_contract_details(positions[i])
             self.reqContractDetails(i, contract)
 
     @iswrapper
     def contractDetails(self, reqId: int, contractDetails: ContractDetails):
-        global market_opening
-        global market_close
-        global market_pause_start
-        global market_pause_end
-        global io_list
+        global market_session
         global all_opening_hours
         global ib_timezone_str
 
         super().contractDetails(reqId, contractDetails)
         # printinstance(contractDetails)
-        time_delta_to_initialized_market = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) - market_opening
 
-        # saves longName in io_list and prints it for checking
-        io_list.loc[reqId, 'Company name'] = contractDetails.longName
-        print(f"\n {reqId} {io_list['Company name'][reqId]}")
+        # saves longName in the trading plan and prints it for checking
+        with io_list_lock:
+            positions[reqId].company_name = contractDetails.longName
+        print(f"\n {reqId} {positions[reqId].company_name}")
 
-        # First line item must be ignored since it is only used to keep the algo awake
-        all_opening_hours.append(contractDetails.liquidHours[:28])
+        # Opening hours per row - contract details do not arrive in the order of the rows
+        all_opening_hours[reqId] = contractDetails.liquidHours[:28]
 
-        if len(all_opening_hours) == len(io_list):
-            if len(set(all_opening_hours)) > 2:
-                for i in range(len(all_opening_hours)):
-                    if i > 1 and all_opening_hours[i] != all_opening_hours[i - 1]:
-                        input(f"{io_list['Company name'][i]} and {io_list['Company name'][i - 1]} have different "
+        if len(all_opening_hours) == len(positions):
+            if len(set(all_opening_hours.values())) > 1:
+                for i in range(1, len(positions)):
+                    if all_opening_hours.get(i) != all_opening_hours.get(i - 1):
+                        input(f"{positions[i].company_name} and {positions[i - 1].company_name} have different "
                               f"market opening hours. You should end the program and adjust DailyTradingPlan.")
             else:
                 print("### Market opening hours are all identical. ###")
 
-        if MyUtilities.should_start_market_opening_function(io_list, time_delta_to_initialized_market):
+        if MyUtilities.should_start_market_opening_function(positions, market_session is not None):
 
             ib_timezone_str = contractDetails.timeZoneId
             print(f"\nIB's TIMEZONE is {ib_timezone_str}.")
             market_trading_hours = contractDetails.liquidHours
-            tz = pytz.timezone(TIMEZONE)
             tradinghours_split_to_list = re.split(";|-", market_trading_hours)
             print("\n", tradinghours_split_to_list)
             index_open = int(input("\nEnter the index of the next market OPEN: "))
             index_close = int(input("\nEnter the index of the next market CLOSE: "))
-            market_opening = datetime.datetime.strptime(tradinghours_split_to_list[index_open], "%Y%m%d:%H%M")
-            market_opening = tz.normalize(tz.localize(market_opening))
-            market_close = datetime.datetime.strptime(tradinghours_split_to_list[index_close], "%Y%m%d:%H%M")
-            market_close = tz.normalize(tz.localize(market_close))
-
-            if MARKET_HAS_PAUSE:
-                market_pause_start = datetime.datetime.strptime(tradinghours_split_to_list[index_open + 1],
-                                                                "%Y%m%d:%H%M")
-                market_pause_start = tz.normalize(tz.localize(market_pause_start))
-                market_pause_end = datetime.datetime.strptime(tradinghours_split_to_list[index_close - 1],
-                                                              "%Y%m%d:%H%M")
-                market_pause_end = tz.normalize(tz.localize(market_pause_end))
-
-                print(f"\nOpening: {market_opening} - "
-                      f"Pause: {market_pause_start} - {market_pause_end} - Closing: {market_close}")
-            else:
-                print(f"\nOpening: {market_opening} - Closing: {market_close}")
+
+            # All boundaries of the trading day are derived once from the liquid hours
+            session = MarketSession.from_liquid_hours(clock, market_trading_hours, index_open, index_close,
+                                                      MARKET_HAS_PAUSE)
+            session.subscribe(self.on_market_session_event)
+            print(f"\n{session}")
 
             # Only required for one main.py
             if which_markets_to_trade == "NY":
                 earnings_thread = threading.Thread(target=MyUtilities.find_earnings_dates,
-                                                   args=(io_list, market_opening), daemon=True)
+                                                   args=(positions, session.opening), daemon=True)
                 earnings_thread.start()
             else:
                 print("Earnings dates can only be given for US-stocks.")
 
-            if datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE)) > market_close:
+            if clock.epoch() > session.close_epoch:
                 input("\n ### Attention ### Market close is already in the past. Code will exit.")
                 exit()
 
+            market_session = session
+            print("\nMarket opening hours are defined.\n")
+
+            with io_list_lock:
+                self.prepare_entry_templates()
+
+            # Session boundaries and the shutdown fire on time, even if no tick arrives
+            for epoch, event in session.boundaries():
+                scheduler.call_at(epoch, self.on_session_timer, key=('session', event))
+            scheduler.call_at(session.epoch_of[SHUTDOWN], self.shutdown, key='shutdown')
+
+    def on_market_session_event(self, event):
+        global is_market_open
+
+        # Called by market_session.update() for every boundary passed, after the session moved to its current phase
+        was_market_open = is_market_open
+        is_market_open = market_session.is_open()
+
+        # Triggers only once when markets just opened
+        if is_market_open and not was_market_open:
+            scheduler.call_later(10, self.on_plan_reload_timer, key='plan reload')
+            print("\n##################################################################")
+            print("\nDingDingDing - Markets are open!\n")
+            print("##################################################################\n")
+            quote_board.clear([LAST_PRICE, BID_PRICE, ASK_PRICE, BID_SIZE, ASK_SIZE, CLOSE_PRICE])
+
+        # Triggers only once when markets just closed
+        if was_market_open and not is_market_open:
+            print("\n##################################################################")
+            print("\nMarkets are closed.\n")
+            print("##################################################################\n")
+
     @iswrapper
     def contractDetailsEnd(self, reqId: int):
         super().contractDetailsEnd(reqId)
@@ -1581,6 +1371,18 @@ class TestApp(TestWrapper, TestClient):
               contract.currency, "Shares:", execution.shares, "Avrg. price:", round(execution.avgPrice, 2), "OrderId:",
               execution.orderId)
 
+        # Each execution updates its row immediately, without waiting for the next orderStatus
+        with io_list_lock:
+            position, role = MyUtilities.find_order_role(execution.orderId)
+            if position is None:
+                return
+
+            fills = execution_ledger.book_execution(execution.execId, execution.orderId, position, role,
+                                                    float(execution.shares), execution.price)
+            if fills is not None:
+                MyUtilities.apply_execution(fills, position, clock)
+                self.sync_after_fills([position])
+
     @iswrapper
     def execDetailsEnd(self, reqId: int):
         super().execDetailsEnd(reqId)
@@ -1590,6 +1392,11 @@ class TestApp(TestWrapper, TestClient):
     def commissionAndFeesReport(self, commissionAndFeesReport: CommissionAndFeesReport):
         print("CommissionReport.", commissionAndFeesReport)
 
+        with io_list_lock:
+            execution_ledger.book_commission(commissionAndFeesReport.execId,
+                                             commissionAndFeesReport.commissionAndFees,
+                                             commissionAndFeesReport.realizedPNL)
+
     @iswrapper
     def currentTime(self, time: int):
         super().currentTime(time)
@@ -1629,36 +1436,46 @@ class TestApp(TestWrapper, TestClient):
         global tick_data_open_position
         global tick_data_new_row
 
-        time_now_fetch = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
+        time_now_fetch = clock.epoch()
 
         print("\nFetch stock data function is started.\n")
         # Writes the tick_data for each ticker to pd dataframe every second for later analysis
         # When saving this dataframe as excel at the end, ~44 different stocks can be saved
-        while market_close + datetime.timedelta(seconds=1) >= time_now_fetch >= market_opening:
+        while market_session.close_epoch + 1 >= time_now_fetch >= market_session.opening_epoch:
 
-            # Appends fetch data to relevant files
+            # Appends fetch data to relevant files from one consistent snapshot of the quote board
             tick_data, tick_data_open_position = MyUtilities.append_fetch_data(tick_data, tick_data_open_position,
                                                                                tick_data_new_row,
-                                                                               io_list_copy_for_tick_data, TIMEZONE)
+                                                                               quote_board.snapshot(),
+                                                                               symbol_index.groups(), clock)
 
             # Pauses while-loop for one second until the next round
             time.sleep(1)
 
-            time_now_fetch = datetime.datetime.now().astimezone(pytz.timezone(TIMEZONE))
+            time_now_fetch = clock.epoch()
 
-        filename = market_close.strftime("%y%m%d") + NAME_OF_DAILYTRADINGPLAN_SAVE
-        MyUtilities.save_excel_outputs(filename, io_list)
+        filename = market_session.close.strftime("%y%m%d") + NAME_OF_DAILYTRADINGPLAN_SAVE
+        with io_list_lock:
+            io_list_save = PositionRecord.to_io_list(positions, io_list_template)
+        MyUtilities.save_excel_outputs(filename, quote_board.materialise(io_list_save))
 
         # Avoids saving an Excel file if no new positions are in DailyTradingPlan
         if len(tick_data) > 100:
-            filename = market_close.strftime("%y%m%d") + NAME_OF_FETCHDATA_NEW_SAVE
+            filename = market_session.close.strftime("%y%m%d") + NAME_OF_FETCHDATA_NEW_SAVE
             MyUtilities.save_excel_outputs(filename, tick_data)
 
         # Avoids saving an Excel file if no open positions are in DailyTradingPlan
         if len(tick_data_open_position) > 100:
-            filename = market_close.strftime("%y%m%d") + NAME_OF_FETCHDATA_OPEN_SAVE
+            filename = market_session.close.strftime("%y%m%d") + NAME_OF_FETCHDATA_OPEN_SAVE
             MyUtilities.save_excel_outputs(filename, tick_data_open_position)
 
+        # 1-minute bars of every contract subscribed today (tickerId == reqId of the first row of the contract)
+        symbols = {key: positions[key].symbol for key in bar_aggregator.keys()}
+        bars_1m = bar_aggregator.table(BAR_1M, symbols)
+        if len(bars_1m):
+            filename = market_session.close.strftime("%y%m%d") + NAME_OF_BARS_SAVE
+            MyUtilities.save_excel_outputs(filename, bars_1m)
+
         # Return to close the thread, since daemon=False. "sys.exit()" is an alternative.
         return
 
@@ -1676,22 +1493,27 @@ def main():
     cmdLineParser.add_argument("-C", "--global-cancel", action="store_true",
                                dest="global_cancel", default=False,
                                help="whether to trigger a globalCancel req")
+    cmdLineParser.add_argument("-d", "--debug", action="store_true",
+                               dest="debug", default=False,
+                               help="whether to log every field assignment of orders and contracts (slower)")
     args = cmdLineParser.parse_args()
     print("Using args", args)
     logging.debug("Using args %s", args)
 
-    # enable logging when member vars are assigned
-    from ibapi import utils
-    Order.__setattr__ = utils.setattr_log
-    Contract.__setattr__ = utils.setattr_log
-    DeltaNeutralContract.__setattr__ = utils.setattr_log
-    TagValue.__setattr__ = utils.setattr_log
-    TimeCondition.__setattr__ = utils.setattr_log
-    ExecutionCondition.__setattr__ = utils.setattr_log
-    MarginCondition.__setattr__ = utils.setattr_log
-    PriceCondition.__setattr__ = utils.setattr_log
-    PercentChangeCondition.__setattr__ = utils.setattr_log
-    VolumeCondition.__setattr__ = utils.setattr_log
+    # enable logging when member vars are assigned (debug only - every field of an order or contract is logged,
+    # which slows down building the orders at the entry, see Utilities/MyOrderBenchmark.py)
+    if args.debug:
+        from ibapi import utils
+        Order.__setattr__ = utils.setattr_log
+        Contract.__setattr__ = utils.setattr_log
+        DeltaNeutralContract.__setattr__ = utils.setattr_log
+        TagValue.__setattr__ = utils.setattr_log
+        TimeCondition.__setattr__ = utils.setattr_log
+        ExecutionCondition.__setattr__ = utils.setattr_log
+        MarginCondition.__setattr__ = utils.setattr_log
+        PriceCondition.__setattr__ = utils.setattr_log
+        PercentChangeCondition.__setattr__ = utils.setattr_log
+        VolumeCondition.__setattr__ = utils.setattr_log
 
     try:
         app = TestApp()
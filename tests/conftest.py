@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The modules are imported as in main.py ("from Utilities.MyRiskLedger import RiskLedger")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Utilities.MyPositionRecord import PositionRecord
+
+
+@pytest.fixture
+def new_position():
+    # Row of a new position waiting for its entry: 100 shares, entry 10, stop 9
+    def make(req_id=0, quantity=100, entry_price=10.0, stop_price=9.0):
+        position = PositionRecord(req_id, {})
+        position.symbol = "NVDA"
+        position.entry_price = entry_price
+        position.stop_price = stop_price
+        position.quantity = quantity
+        position.quantity_at_open = quantity
+        position.open_position = False
+        position.order_filled = False
+        position.stock_sold = False
+        return position
+
+    return make
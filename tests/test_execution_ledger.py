@@ -0,0 +1,156 @@
+import pytest
+
+from Utilities.MyExecutionLedger import ExecutionLedger
+
+
+def held_position(new_position, quantity=100):
+    # Filled new position whose stop (order ID 12) and profit taker (order ID 11) are working
+    position = new_position(quantity=quantity)
+    position.order_filled = True
+    position.parent_order_id = 10
+    position.profit_order_id = 11
+    position.stop_order_id = 12
+    return position
+
+
+def test_quantity_before_is_taken_at_first_execution(new_position):
+    ledger = ExecutionLedger()
+    position = held_position(new_position)
+
+    fills = ledger.book_execution("0001.01", 12, position, 'stop', 10.0, 9.0)
+    # The row is updated in between, as execDetails does through MyUtilities.apply_execution()
+    position.quantity = 90
+    fills = ledger.book_execution("0002.01", 12, position, 'stop', 20.0, 8.9)
+
+    assert fills.quantity_before == 100.0
+    assert fills.shares == 30.0
+    assert fills.avg_price == pytest.approx((10 * 9.0 + 20 * 8.9) / 30)
+    assert ledger.filled(12) == 30.0
+
+
+def test_repeated_execution_is_ignored(new_position):
+    ledger = ExecutionLedger()
+    position = held_position(new_position)
+
+    assert ledger.book_execution("0001.01", 12, position, 'stop', 30.0, 9.0) is not None
+    assert ledger.book_execution("0001.01", 12, position, 'stop', 30.0, 9.0) is None
+
+    assert ledger.filled(12) == 30.0
+    assert ledger.duplicates == 1
+
+
+def test_correction_replaces_execution(new_position):
+    ledger = ExecutionLedger()
+    position = held_position(new_position)
+
+    ledger.book_execution("0001.01", 12, position, 'stop', 30.0, 9.0)
+    fills = ledger.book_execution("0001.02", 12, position, 'stop', 25.0, 8.8)
+
+    assert fills.shares == 25.0
+    assert fills.avg_price == pytest.approx(8.8)
+    assert ledger.corrections == 1
+
+    # The corrected execution arriving late is a duplicate
+    assert ledger.book_execution("0001.01", 12, position, 'stop', 30.0, 9.0) is None
+
+
+def test_commission_before_execution(new_position):
+    ledger = ExecutionLedger()
+    position = held_position(new_position)
+
+    ledger.book_commission("0001.01", 1.5, -30.0)
+    fills = ledger.book_execution("0001.01", 12, position, 'stop', 30.0, 9.0)
+
+    assert fills.fees == pytest.approx(1.5)
+    assert fills.realized_pnl == pytest.approx(-30.0)
+
+
+def test_row_summary_of_entry_and_stop(new_position):
+    ledger = ExecutionLedger()
+    position = held_position(new_position)
+
+    ledger.book_execution("0001.01", 10, position, 'parent', 100.0, 10.0)
+    ledger.book_execution("0002.01", 12, position, 'stop', 30.0, 9.0)
+
+    summary = ledger.row_summary(position.req_id)
+    assert summary['Symbol'] == "NVDA"
+    assert summary['Bought'] == 100.0
+    assert summary['Avg. buy price'] == pytest.approx(10.0)
+    assert summary['Sold'] == 30.0
+    assert summary['Avg. sell price'] == pytest.approx(9.0)
+
+
+class TestStatusAndExecutionOrder:
+    """
+    Fills reach the row through execDetails only - an orderStatus arriving before or after the executions must not
+    book them a second time.
+    """
+
+    @pytest.fixture(autouse=True)
+    def modules(self):
+        for module in ("ibapi", "bs4", "requests"):
+            pytest.importorskip(module)
+
+        from Utilities.MyClock import Clock
+        from Utilities.MyOrders import MyOrders
+        from Utilities.MyUtilities import MyUtilities
+
+        self.clock = Clock("America/New_York")
+        self.orders = MyOrders
+        self.utilities = MyUtilities
+
+    def exec_details(self, ledger, exec_id, order_id, shares, price):
+        # Same steps as TestApp.execDetails()
+        position, role = self.utilities.find_order_role(order_id)
+        fills = ledger.book_execution(exec_id, order_id, position, role, shares, price)
+        if fills is not None:
+            self.utilities.apply_execution(fills, position, self.clock)
+        return position
+
+    def order_status(self, order_id, status, filled):
+        # Same steps as TestApp.orderStatus() for a partially filled order
+        self.orders.protective_orders.update_status(order_id, status, filled)
+
+    def held_row(self, new_position, first_order_id):
+        position = new_position(req_id=first_order_id)
+        position.order_filled = True
+        position.stock_sold = False
+        for offset, attribute in enumerate(('parent_order_id', 'profit_order_id', 'stop_order_id')):
+            self.orders.order_index.assign(position, attribute, first_order_id + offset)
+        return position
+
+    def test_status_before_executions(self, new_position):
+        ledger = ExecutionLedger()
+        position = self.held_row(new_position, 1000)
+
+        self.order_status(1002, "Submitted", 30)
+        self.exec_details(ledger, "1002.01", 1002, 10.0, 9.0)
+        self.order_status(1002, "Submitted", 30)
+        self.exec_details(ledger, "1003.01", 1002, 20.0, 9.0)
+
+        assert position.quantity == 70
+        assert position.stop_order_filled
+        assert not position.stock_sold
+
+    def test_status_after_executions(self, new_position):
+        ledger = ExecutionLedger()
+        position = self.held_row(new_position, 2000)
+
+        self.exec_details(ledger, "2002.01", 2002, 30.0, 9.0)
+        self.exec_details(ledger, "2002.01", 2002, 30.0, 9.0)
+        self.order_status(2002, "Submitted", 30)
+
+        assert position.quantity == 70
+
+    def test_complete_sell(self, new_position):
+        ledger = ExecutionLedger()
+        position = self.held_row(new_position, 3000)
+
+        self.order_status(3001, "Filled", 100)
+        self.exec_details(ledger, "3001.01", 3001, 60.0, 12.0)
+        self.exec_details(ledger, "3001.02", 3001, 60.0, 12.0)  # Correction of the same execution
+        self.exec_details(ledger, "3002.01", 3001, 40.0, 12.1)
+
+        assert position.quantity == 0
+        assert position.profit_order_filled
+        assert position.stock_sold
@@ -0,0 +1,141 @@
+import types
+
+import pytest
+
+from Rules.ConstantsAndRules import INDICATOR_EMA_PERIODS
+from Utilities.MyBars import BarAggregator, BAR_1M
+from Utilities.MyIndicators import IndicatorEngine
+
+OPEN = 1_700_000_040  # Start of a minute
+
+
+def minute_bars(closes, ranges=None):
+    # Trades of one bar per minute: open at the close of the minute before, low and high around it, then the close
+    trades = []
+    previous = closes[0]
+    for minute, close in enumerate(closes):
+        spread = ranges[minute] if ranges else 0.0
+        epoch = OPEN + 60 * minute
+        trades += [(epoch, previous), (epoch + 10, close - spread), (epoch + 20, close + spread), (epoch + 30, close)]
+        previous = close
+    return trades
+
+
+def feed(engine, bar_aggregator, trades, key=0):
+    # Same order as the tick callbacks of main.py
+    for epoch, price, *size in trades:
+        bar_aggregator.feed_trade(key, epoch, price, *size)
+        engine.feed_trade(key, price, *size)
+
+
+@pytest.fixture
+def bar_aggregator():
+    return BarAggregator()
+
+
+def test_names_from_settings(bar_aggregator):
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+
+    assert engine.names == ('VWAP', 'ATR') + tuple(f"EMA{period}" for period in INDICATOR_EMA_PERIODS)
+    assert engine.value(0, 'VWAP') is None
+
+    feed(engine, bar_aggregator, [(OPEN, 10.0)])
+    with pytest.raises(KeyError):
+        engine.value(0, 'RSI')
+
+
+def test_vwap_of_sized_trades(bar_aggregator):
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+
+    feed(engine, bar_aggregator, [(OPEN, 10.0, 100), (OPEN + 5, 11.0, 300), (OPEN + 70, 12.0, 100)])
+    # The VOLUME tick is ignored once trades come with sizes
+    engine.feed_volume(0, bar_aggregator.feed_volume(0, 10000))
+
+    assert engine.value(0, 'VWAP') == pytest.approx((10 * 100 + 11 * 300 + 12 * 100) / 500)
+
+
+def test_vwap_from_volume_ticks(bar_aggregator):
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+
+    # LAST ticks without sizes - the changes of the day's volume are booked at the last price
+    engine.feed_volume(0, bar_aggregator.feed_volume(0, 5000))
+    feed(engine, bar_aggregator, [(OPEN, 10.0)])
+    engine.feed_volume(0, bar_aggregator.feed_volume(0, 5200))
+    feed(engine, bar_aggregator, [(OPEN + 5, 11.0)])
+    engine.feed_volume(0, bar_aggregator.feed_volume(0, 5500))
+
+    assert engine.value(0, 'VWAP') == pytest.approx((10 * 200 + 11 * 300) / 500)
+
+
+def test_atr_mean_of_first_bars_then_wilder(bar_aggregator):
+    period = 3
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, period)
+    closes = [10.0, 10.5, 10.2, 11.0, 10.4, 10.9]
+    ranges = [0.2, 0.3, 0.1, 0.4, 0.2, 0.3]
+
+    feed(engine, bar_aggregator, minute_bars(closes, ranges))
+
+    # The last bar is still open
+    bars = bar_aggregator.bars(0, BAR_1M, len(closes))[:-1]
+    true_ranges = [bars[0][2] - bars[0][3]] + [max(high - low, abs(high - previous[4]), abs(low - previous[4]))
+                                               for previous, (_, _, high, low, _, _) in zip(bars, bars[1:])]
+    atr = sum(true_ranges[:period]) / period
+    for true_range in true_ranges[period:]:
+        atr = (atr * (period - 1) + true_range) / period
+
+    assert engine.bars_closed == len(closes) - 1
+    assert engine.value(0, 'ATR') == pytest.approx(atr)
+
+
+def test_emas_of_closed_bars(bar_aggregator):
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+    closes = [10.0 + 0.1 * minute for minute in range(30)]
+
+    feed(engine, bar_aggregator, minute_bars(closes))
+
+    for period in INDICATOR_EMA_PERIODS:
+        ema = closes[0]
+        for close in closes[1:-1]:
+            ema += (close - ema) * 2 / (period + 1)
+        assert engine.value(0, f"EMA{period}") == pytest.approx(ema)
+
+    # The shorter EMA follows the rising closes more closely
+    short, long = (engine.value(0, f"EMA{period}") for period in sorted(INDICATOR_EMA_PERIODS)[:2])
+    assert short > long
+
+
+def test_contracts_are_kept_apart(bar_aggregator):
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+
+    feed(engine, bar_aggregator, [(OPEN, 10.0, 100)], key=0)
+    feed(engine, bar_aggregator, [(OPEN, 50.0, 100)], key=3)
+
+    assert engine.values(0)['VWAP'] == pytest.approx(10.0)
+    assert engine.values(3)['VWAP'] == pytest.approx(50.0)
+    assert engine.stats()['contracts'] == 2
+
+
+def test_rules_read_indicators_of_their_contract(bar_aggregator, new_position):
+    for module in ("ibapi", "bs4", "requests"):
+        pytest.importorskip(module)
+
+    from Functionalities.MyFunctionalities import RuleContext
+    from Utilities.MySubscriptions import MarketDataSubscriptions
+
+    # Two rows of the same contract share the subscription (and indicators) of the first one
+    subscriptions = MarketDataSubscriptions(max_lines=10)
+    contract = types.SimpleNamespace(symbol="NVDA", secType="STK", currency="USD", exchange="SMART",
+                                     primaryExch="NASDAQ")
+    subscriptions.add_row(4, contract)
+    subscriptions.add_row(7, contract)
+
+    engine = IndicatorEngine(bar_aggregator, INDICATOR_EMA_PERIODS, 14)
+    feed(engine, bar_aggregator, [(OPEN, 10.0, 100), (OPEN + 70, 11.0, 100)], key=4)
+
+    ctx = RuleContext(None, [], None, None, None, None, None, None, None, bar_aggregator, engine, subscriptions,
+                      [], "", 1.0, False, 1.0, 0.0)
+    position = new_position(req_id=7)
+
+    assert ctx.indicator(position, 'VWAP') == pytest.approx(10.5)
+    assert ctx.indicator(position, f"EMA{INDICATOR_EMA_PERIODS[0]}") == pytest.approx(10.0)
+    assert ctx.bars(position, BAR_1M, 2)[:, 4].tolist() == [10.0, 11.0]
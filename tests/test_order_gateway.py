@@ -0,0 +1,67 @@
+import time
+
+from Utilities.MyOrderGateway import OrderGateway, PROTECTIVE, ENTRY, MARKET_DATA
+
+
+def send_all(gateway, batches):
+    # Queues all batches before the gateway thread starts, then drains the queue - returns what was sent in order
+    sent = []
+    for priority, names, order_ids in batches:
+        gateway.submit(priority, [(sent.append, (name,)) for name in names], order_ids)
+    gateway.start()
+    gateway.stop()
+    return sent
+
+
+def test_priorities_in_order_of_submission():
+    gateway = OrderGateway(messages_per_second=1000, burst=10)
+
+    sent = send_all(gateway, [
+        (MARKET_DATA, ["reqMktData 1"], ()),
+        (ENTRY, ["parent 10", "profit 11", "stop 12"], (10, 11, 12)),
+        (PROTECTIVE, ["cancel 3"], ()),
+        (MARKET_DATA, ["reqMktData 2"], ()),
+    ])
+
+    assert sent == ["cancel 3", "parent 10", "profit 11", "stop 12", "reqMktData 1", "reqMktData 2"]
+    assert gateway.stats()['batches sent'] == 4
+
+
+def test_lower_new_order_ids_go_first():
+    gateway = OrderGateway(messages_per_second=1000, burst=10)
+
+    # TWS rejects order ID 20 once it has seen 30
+    sent = send_all(gateway, [
+        (ENTRY, ["parent 20", "profit 21", "stop 22"], (20, 21, 22)),
+        (PROTECTIVE, ["market sell 30"], (30,)),
+    ])
+
+    assert sent == ["parent 20", "profit 21", "stop 22", "market sell 30"]
+    assert gateway.promotions == 1
+
+
+def test_modifies_are_not_held_back():
+    gateway = OrderGateway(messages_per_second=1000, burst=10)
+    send_all(gateway, [(ENTRY, ["parent 10", "profit 11", "stop 12"], (10, 11, 12))])
+
+    # Order ID 12 is known to TWS now
+    sent = send_all(gateway, [
+        (ENTRY, ["parent 20", "profit 21", "stop 22"], (20, 21, 22)),
+        (PROTECTIVE, ["modify stop 12"], (12,)),
+    ])
+
+    assert sent[0] == "modify stop 12"
+    assert gateway.promotions == 0
+
+
+def test_messages_are_paced():
+    gateway = OrderGateway(messages_per_second=100, burst=2)
+
+    start = time.monotonic()
+    sent = send_all(gateway, [(PROTECTIVE, [f"cancel {i}"], ()) for i in range(6)])
+    elapsed = time.monotonic() - start
+
+    # Burst of 2, then 4 messages at 100 per second
+    assert len(sent) == 6
+    assert elapsed >= 0.035
+    assert gateway.stats()['messages sent'] == 6
@@ -0,0 +1,176 @@
+import pytest
+
+pytest.importorskip("ibapi")
+
+from Utilities.MyClock import Clock
+from Utilities.MyOrders import EntryTemplates, MyOrders, OrderIndex, ProtectiveOrders
+
+
+def bracket_position(new_position, req_id=0):
+    # Row waiting for its entry with the prices of an entry bracket, without sell on close
+    position = new_position(req_id=req_id)
+    position.buy_limit_price = 10.1
+    position.profit_taker_price = 12.5
+    position.sell_on_close = False
+    return position
+
+
+def registered_orders(position, first_order_id=10):
+    # Profit taker and stop of a bracket as registered by MyOrders.stamp_bracket()
+    _, profit, stop = MyOrders.build_bracket(position, "US/Eastern", None)
+    profit.orderId, stop.orderId = first_order_id + 1, first_order_id + 2
+    position.profit_order_id, position.stop_order_id = profit.orderId, stop.orderId
+
+    protective_orders = ProtectiveOrders()
+    protective_orders.register(position, profit, stop)
+    return protective_orders, profit, stop
+
+
+def test_lookup_of_assigned_order_ids(new_position):
+    index = OrderIndex()
+    position = new_position()
+
+    index.assign(position, 'parent_order_id', 10)
+    index.assign(position, 'stop_order_id', 12)
+
+    assert position.parent_order_id == 10
+    assert index.lookup(10) == (position, ('parent_order_id',))
+    assert index.lookup(12) == (position, ('stop_order_id',))
+    assert index.lookup(99) == (None, ())
+    assert index.unknown == 1
+
+
+def test_reassigned_order_id_is_removed(new_position):
+    index = OrderIndex()
+    position = new_position()
+
+    index.assign(position, 'stop_order_id', 12)
+    # New OCA bracket
+    index.assign(position, 'stop_order_id', 22)
+
+    assert index.lookup(12) == (None, ())
+    assert index.lookup(22) == (position, ('stop_order_id',))
+
+
+def test_one_order_id_with_several_roles(new_position):
+    index = OrderIndex()
+    position = new_position()
+
+    index.assign(position, 'stop_order_id', 12)
+    # Market order sent with the order ID of the stop it replaces
+    index.assign(position, 'market_order_id', 12)
+
+    assert index.lookup(12) == (position, ('stop_order_id', 'market_order_id'))
+
+
+def test_rows_loaded_from_plan(new_position):
+    index = OrderIndex()
+    positions = [new_position(req_id=0), new_position(req_id=1)]
+    positions[0].parent_order_id = 10
+    positions[1].profit_order_id = float('nan')  # Empty cell of the plan
+
+    index.add_rows(positions)
+    positions.append(new_position(req_id=2))
+    positions[2].stop_order_id = 32
+    index.add_rows(positions)
+
+    assert index.lookup(10) == (positions[0], ('parent_order_id',))
+    assert index.lookup(32) == (positions[2], ('stop_order_id',))
+    assert index.stats()['order ids'] == 2
+
+
+def test_amend_sends_only_changed_orders(new_position):
+    position = bracket_position(new_position)
+    protective_orders, profit, stop = registered_orders(position)
+
+    changed = protective_orders.amend(position, 100, 12.5, 9.5)
+
+    assert [order.orderId for order in changed] == [stop.orderId]
+    assert changed[0].auxPrice == 9.5
+    assert changed[0].transmit
+    # The orders sent before are left as they were
+    assert stop.auxPrice == 9.0
+
+    # The amended orders are the ones compared next time
+    assert protective_orders.amend(position, 100, 12.5, 9.5) == []
+    assert len(protective_orders.amend(position, 60, 12.5, 9.5)) == 2
+
+
+def test_partially_filled_group_is_replaced(new_position):
+    position = bracket_position(new_position)
+    protective_orders, profit, stop = registered_orders(position)
+
+    protective_orders.update_status(stop.orderId, "Submitted", 30)
+
+    assert protective_orders.amend(position, 70, 12.5, 9.5) is None
+
+
+def test_done_order_or_new_order_ids_replace_group(new_position):
+    position = bracket_position(new_position)
+    protective_orders, profit, stop = registered_orders(position)
+
+    protective_orders.update_status(profit.orderId, "Cancelled", 0)
+    assert protective_orders.amend(position, 100, 12.5, 9.5) is None
+
+    position = bracket_position(new_position, req_id=1)
+    protective_orders, profit, stop = registered_orders(position)
+    position.stop_order_id = 30
+    assert protective_orders.amend(position, 100, 12.5, 9.5) is None
+
+
+def test_sell_on_close_added_replaces_group(new_position):
+    position = bracket_position(new_position)
+    protective_orders, profit, stop = registered_orders(position)
+
+    position.sell_on_close = True
+
+    assert protective_orders.amend(position, 100, 12.5, 9.5) is None
+
+
+def test_template_is_used_once(new_position):
+    templates = EntryTemplates()
+    position = bracket_position(new_position)
+
+    templates.prepare(position, "US/Eastern", None)
+    templates.prepare(position, "US/Eastern", None)
+    orders = templates.take(position, "US/Eastern", None)
+
+    assert templates.prepared == 1
+    assert [order.totalQuantity for order in orders] == [100, 100, 100]
+    assert orders[0].lmtPrice == 10.1
+    assert templates.take(position, "US/Eastern", None) is None
+
+
+def test_changed_row_makes_template_stale(new_position):
+    templates = EntryTemplates()
+    position = bracket_position(new_position)
+
+    templates.prepare(position, "US/Eastern", None)
+    # Stop at the low of the day resized the entry
+    position.quantity = 80
+
+    assert templates.take(position, "US/Eastern", None) is None
+    assert templates.stale == 1
+
+
+def test_incomplete_row_is_left_to_the_entry(new_position):
+    templates = EntryTemplates()
+    position = bracket_position(new_position)
+    position.buy_limit_price = None
+
+    templates.prepare(position, "US/Eastern", None)
+
+    assert templates.take(position, "US/Eastern", None) is None
+    assert templates.prepared == 0
+
+
+def test_stamped_bracket_is_indexed(new_position):
+    position = bracket_position(new_position, req_id=50)
+    orders = MyOrders.build_bracket(position, "US/Eastern", None)
+
+    MyOrders.stamp_bracket(orders, 500, position, Clock("America/New_York"), "US/Eastern")
+
+    assert [order.orderId for order in orders] == [500, 501, 502]
+    assert [order.parentId for order in orders[1:]] == [500, 500]
+    assert orders[0].goodTillDate.endswith("US/Eastern")
+    assert MyOrders.order_index.lookup(502) == (position, ('stop_order_id',))
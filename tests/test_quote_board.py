@@ -0,0 +1,114 @@
+import math
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("ibapi")
+
+from ibapi.ticktype import TickTypeEnum
+
+from Utilities.MyQuoteBoard import QuoteBoard, BID_PRICE, ASK_PRICE, LAST_PRICE, HIGH_PRICE, BID_SIZE, ASK_SIZE
+
+
+@pytest.fixture
+def quote_board(new_position):
+    return QuoteBoard([new_position(req_id=i) for i in range(4)], capacity=4)
+
+
+def test_high_only_moves_outwards(quote_board):
+    assert quote_board.feed_price(0, TickTypeEnum.HIGH, 10.0)
+    assert not quote_board.feed_price(0, TickTypeEnum.HIGH, 9.5)
+    assert quote_board.get(0, HIGH_PRICE) == 10.0
+
+
+def test_snapshot_is_reused_until_a_write(quote_board):
+    quote_board.feed_price(1, TickTypeEnum.LAST, 12.345)
+    snapshot = quote_board.snapshot()
+
+    assert snapshot.version % 2 == 0
+    assert snapshot.values[1, LAST_PRICE] == 12.35
+    assert quote_board.snapshot() is snapshot
+    with pytest.raises(ValueError):
+        snapshot.values[1, LAST_PRICE] = 0.0
+
+    quote_board.feed_price(1, TickTypeEnum.LAST, 12.5)
+    assert quote_board.snapshot() is not snapshot
+    assert snapshot.values[1, LAST_PRICE] == 12.35
+
+
+def test_add_rows_grows_board(quote_board, new_position):
+    quote_board.feed_price(3, TickTypeEnum.BID, 5.0)
+    quote_board.add_rows([new_position(req_id=i) for i in range(6)])
+
+    # Queued until the message loop applies it
+    assert quote_board.n_rows == 4
+    assert not quote_board.is_complete(5, [BID_PRICE])
+    quote_board.apply_commands()
+
+    snapshot = quote_board.snapshot()
+    assert snapshot.values.shape[0] == 6
+    assert len(snapshot.symbols) == 6
+    assert snapshot.values[3, BID_PRICE] == 5.0
+    assert math.isnan(snapshot.values[5, BID_PRICE])
+
+
+def test_queued_writes_are_applied_before_the_next_tick(quote_board):
+    quote_board.feed_price(0, TickTypeEnum.BID, 5.0)
+    quote_board.copy_row(0, 2)
+    quote_board.clear([BID_PRICE])
+    quote_board.set_recorded(1, False)
+
+    # Still the state before the writes of the other threads
+    assert quote_board.get(0, BID_PRICE) == 5.0
+    assert math.isnan(quote_board.get(2, BID_PRICE))
+
+    quote_board.feed_price(0, TickTypeEnum.ASK, 5.1)
+
+    assert math.isnan(quote_board.get(0, BID_PRICE))
+    assert math.isnan(quote_board.get(2, BID_PRICE))
+    assert quote_board.get(0, ASK_PRICE) == 5.1
+    assert quote_board.snapshot().recorded == (True, False, True, True)
+
+
+def test_snapshots_are_consistent_with_concurrent_writers(quote_board):
+    # Ticks write BID size before ASK size with rising sizes, the session event clears both at once (applied by the
+    # tick thread). A consistent snapshot therefore never shows an ASK size above the BID size - a copy overlapping
+    # the two writes could.
+    done = threading.Event()
+
+    def ticks():
+        size = 0
+        while not done.is_set():
+            size += 1
+            quote_board.feed_size(0, TickTypeEnum.BID_SIZE, size)
+            quote_board.feed_size(0, TickTypeEnum.ASK_SIZE, size)
+
+    def session_events():
+        while not done.is_set():
+            quote_board.clear([BID_SIZE, ASK_SIZE])
+            quote_board.copy_row(0, 1)
+            quote_board.set_recorded(2, False)
+            time.sleep(0.0001)
+
+    writers = [threading.Thread(target=ticks), threading.Thread(target=session_events)]
+    for writer in writers:
+        writer.start()
+
+    try:
+        for _ in range(5000):
+            # Few attempts, so that snapshots under contention are taken as well
+            snapshot = quote_board.snapshot(max_attempts=1)
+            bid, ask = snapshot.values[0, BID_SIZE], snapshot.values[0, ASK_SIZE]
+
+            assert snapshot.version % 2 == 0
+            assert not ask > bid
+    finally:
+        done.set()
+        for writer in writers:
+            writer.join()
+
+    # Every write was applied by the tick thread
+    quote_board.apply_commands()
+    assert quote_board.version % 2 == 0
+    assert quote_board.snapshot().version == quote_board.version
@@ -0,0 +1,95 @@
+import pytest
+
+from Utilities.MyRiskLedger import RiskLedger
+
+
+def fill_entry(ledger, positions, shares):
+    # Parent fill as booked by MyUtilities.apply_execution() - the row holds the shares filled so far
+    positions[0].order_filled = True
+    positions[0].quantity = shares
+    ledger.sync(positions, 0)
+
+
+def test_reserve_counts_exposure_and_risk(new_position):
+    positions = [new_position()]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+
+    ledger.reserve(positions[0])
+
+    assert ledger.is_reserved(0)
+    assert ledger.reserved_exposure == pytest.approx(1000.0)
+    assert ledger.reserved_risk == pytest.approx(100.0)
+    assert ledger.risk_in_use == pytest.approx(100.0)
+
+
+def test_partial_fill_shrinks_reservation_once(new_position):
+    positions = [new_position()]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+    ledger.reserve(positions[0])
+
+    # The same fill synced repeatedly (orderStatus, execDetails, sync_all) must not drain the reservation
+    for _ in range(4):
+        fill_entry(ledger, positions, 30)
+
+    assert ledger.is_reserved(0)
+    assert ledger.reserved_exposure == pytest.approx(700.0)
+    assert ledger.exposure == pytest.approx(300.0)
+    # The row counts the risk of its full quantity at open from the first fill
+    assert ledger.reserved_risk == pytest.approx(0.0)
+    assert ledger.new_risk == pytest.approx(100.0)
+
+
+def test_complete_fill_releases_reservation(new_position):
+    positions = [new_position()]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+    ledger.reserve(positions[0])
+
+    fill_entry(ledger, positions, 30)
+    fill_entry(ledger, positions, 100)
+
+    assert not ledger.is_reserved(0)
+    assert ledger.reserved_exposure == 0.0
+    assert ledger.exposure == pytest.approx(1000.0)
+
+
+def test_sells_do_not_bring_reservation_back(new_position):
+    positions = [new_position()]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+    ledger.reserve(positions[0])
+
+    fill_entry(ledger, positions, 60)
+    # Stop sells 20 of the 60 shares while the rest of the entry is still working
+    positions[0].quantity = 40
+    ledger.sync(positions, 0)
+
+    assert ledger.reserved_exposure == pytest.approx(400.0)
+
+
+def test_cancel_releases_rest_of_reservation(new_position):
+    positions = [new_position(), new_position(req_id=1)]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+    ledger.reserve(positions[0])
+    ledger.reserve(positions[1])
+
+    fill_entry(ledger, positions, 30)
+    ledger.release(0)
+    ledger.release(0)
+
+    assert not ledger.is_reserved(0)
+    assert ledger.releases == 1
+    assert ledger.reserved_exposure == pytest.approx(1000.0)
+    assert ledger.exposure == pytest.approx(300.0)
+
+
+def test_percent_invested_includes_fills_and_reservations(new_position):
+    positions = [new_position()]
+    ledger = RiskLedger(positions, exr_rate=1.0)
+
+    assert ledger.percent_invested(10000.0) is None
+
+    ledger.sync_account(2000.0)
+    ledger.reserve(positions[0])
+    assert ledger.percent_invested(10000.0) == pytest.approx(0.3)
+
+    fill_entry(ledger, positions, 100)
+    assert ledger.percent_invested(10000.0) == pytest.approx(0.3)